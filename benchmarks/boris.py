@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Compare Boris pusher implementations of ParticleArray in time per particle per step.
+
+'reference' is the out-of-place ParticleArray._boris_update_momentums, 'numpy' and 'numba' are
+the in-place engines of ParticleArray.boris_update_momentums. Results of all of them are checked to be identical.
+
+Run from the repository root: python benchmarks/boris.py
+"""
+from timeit import repeat
+
+import numpy as np
+
+from ef.particle_array import ParticleArray, numba_boris_kernel
+from ef.util.inject import configure_application
+from ef.util.physical_constants import speed_of_light
+
+
+def make_step(engine, particles, el_field, mgn_field):
+    if engine == 'reference':
+        def step():
+            particles.momentums = ParticleArray._boris_update_momentums(particles.charge, particles.mass,
+                                                                        particles.momentums, 1e-3, el_field,
+                                                                        mgn_field)
+    else:
+        def step():
+            ParticleArray.boris_engine = engine
+            particles.boris_update_momentums(1e-3, el_field, mgn_field)
+    return step
+
+
+def time_step(step, n, number=5):
+    step()  # compile, allocate work arrays
+    return min(repeat(step, number=number, repeat=3)) / number / n
+
+
+def main():
+    configure_application()
+    engines = ['reference', 'numpy'] + (['numba'] if numba_boris_kernel() is not None else [])
+    random = np.random.RandomState(0)
+    print(f"{'particles':>10}" + ''.join(f" {e + ', ns':>14}" for e in engines))
+    for n in (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6):
+        momentums = random.normal(size=(n, 3))
+        el_field = random.normal(size=(n, 3))
+        mgn_field = random.normal(size=(n, 3)) * speed_of_light
+        times, results = [], []
+        for engine in engines:
+            particles = ParticleArray(np.arange(n), -1., 1., np.zeros((n, 3)), momentums.copy())
+            make_step(engine, particles, el_field, mgn_field)()
+            results.append(particles.momentums.copy())
+            times.append(time_step(make_step(engine, particles, el_field, mgn_field), n))
+        assert all(np.array_equal(r, results[0]) for r in results)
+        print(f"{n:>10}" + ''.join(f" {t * 1e9:>14.1f}" for t in times))
+    ParticleArray.boris_engine = 'numpy'
+
+
+if __name__ == "__main__":
+    main()
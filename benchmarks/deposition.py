@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Compare charge deposition engines of ArrayOnGrid across particle counts.
+
+Run from the repository root: python benchmarks/deposition.py
+"""
+from timeit import repeat
+
+import numpy as np
+
+from ef.meshgrid import MeshGrid
+from ef.util.array_on_grid import ArrayOnGrid
+
+
+def time_engine(engine, mesh, positions, number=3):
+    ArrayOnGrid.deposition_engine = engine
+    a = ArrayOnGrid(mesh)
+    return min(repeat(lambda: a.distribute_at_positions(-1., positions), number=number, repeat=3)) / number
+
+
+def main():
+    mesh = MeshGrid(10, 51)
+    random = np.random.RandomState(0)
+    print(f"{'particles':>10} {'add.at, s':>12} {'bincount, s':>12} {'speedup':>8}")
+    for n in (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6):
+        positions = random.uniform(0, 10, (n, 3))
+        t_at = time_engine('add.at', mesh, positions)
+        t_bincount = time_engine('bincount', mesh, positions)
+        print(f"{n:>10} {t_at:>12.5f} {t_bincount:>12.5f} {t_at / t_bincount:>8.1f}")
+    ArrayOnGrid.deposition_engine = 'bincount'
+
+
+if __name__ == "__main__":
+    main()
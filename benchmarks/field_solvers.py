@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Compare setup time, solve time and convergence of field solvers on cold and warm started solves.
+
+The warm solve starts from the previous potential after a 1% change of the charge density,
+as in late steps of a simulation. Residuals are relative to the residual of zero potential.
+
+Run from the repository root: python benchmarks/field_solvers.py
+"""
+from time import perf_counter
+
+import numpy as np
+
+from ef.config.components import BoundaryConditionsConf, Box
+from ef.field.solvers.geometric_mg import FieldSolverGeometricMG
+from ef.field.solvers.pyamg import FieldSolverPyamg
+from ef.field.solvers.sor import FieldSolverSOR
+from ef.inner_region import InnerRegion
+from ef.meshgrid import MeshGrid
+from ef.util.array_on_grid import ArrayOnGrid
+
+
+def relative_residual(checker, charge, potential):
+    b = 4 * np.pi * charge.data
+    phi = potential.data.copy()
+    phi[checker._region_nodes] = checker.potential_in_regions
+    return np.linalg.norm(b * checker.grid.free - checker.grid.apply(phi)) / checker.reference_norm(phi, b)
+
+
+def timed(f):
+    start = perf_counter()
+    result = f()
+    return perf_counter() - start, result
+
+
+def main():
+    print(f"{'nodes':>6} {'solver':>8} {'setup, s':>9} {'cold, s':>9} {'residual':>9} {'warm, s':>9} {'residual':>9}")
+    for n in (17, 33, 65):
+        mesh = MeshGrid((1, 1.2, 1.5), n)
+        regions = [InnerRegion('electrode', Box((.2, .3, .4), (.3, .3, .3)), 3)]
+        charge = ArrayOnGrid(mesh)
+        charge._data[1:-1, 1:-1, 1:-1] = np.random.RandomState(0).uniform(-1, 1, mesh.n_nodes - 2)
+        changed_charge = ArrayOnGrid(mesh, (), charge.data * 1.01)
+        checker = FieldSolverSOR(mesh, regions)
+        for name, solver_class in ('pyamg', FieldSolverPyamg), ('mg', FieldSolverGeometricMG), ('sor', FieldSolverSOR):
+            t_setup, solver = timed(lambda: solver_class(mesh, regions))
+            potential = ArrayOnGrid(mesh)
+            potential.apply_boundary_values(BoundaryConditionsConf(1, 2, 3, 4, 5, 6))
+            t_cold, _ = timed(lambda: solver.eval_potential(charge, potential))
+            r_cold = relative_residual(checker, charge, potential)
+            t_warm, _ = timed(lambda: solver.eval_potential(changed_charge, potential))
+            r_warm = relative_residual(checker, changed_charge, potential)
+            print(f"{n:>6} {name:>8} {t_setup:>9.3f} {t_cold:>9.3f} {r_cold:>9.1e} {t_warm:>9.3f} {r_warm:>9.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -27,7 +27,8 @@ setup(
     extras_require={'jupyter-examples': ['sympy', 'matplotlib', 'jupyter', 'pandas', 'sympy', 'nbformat'],
                     'amgx': ['pyamgx'],
                     'amg': ['pyamg'],
-                    'cupy': ['cupy']},
+                    'cupy': ['cupy'],
+                    'numba': ['numba']},
     classifiers=[
         # complete classifier list: http://pypi.python.org/pypi?%3Aaction=list_classifiers
         'Development Status :: 2 - Pre-Alpha',
@@ -0,0 +1,33 @@
+__all__ = ["FieldSamplingConf", "FieldSamplingSection"]
+
+from collections import namedtuple
+
+from ef.config.component import ConfigComponent
+from ef.config.section import ConfigSection
+
+
+class FieldSamplingConf(ConfigComponent):
+    """
+    Which static external fields to sample onto the spatial mesh before the simulation starts:
+    'none' keeps all fields exact, 'grid' combines fields given on grids,
+    'all' also samples uniform and time-independent expression fields.
+    """
+    def __init__(self, sample_static_fields="none"):
+        if sample_static_fields not in ("none", "grid", "all"):
+            raise ValueError("Unexpected static field sampling mode: {}".format(sample_static_fields))
+        self.sample_static_fields = sample_static_fields
+
+    def to_conf(self):
+        return FieldSamplingSection(self.sample_static_fields)
+
+    def make(self):
+        return self.sample_static_fields
+
+
+class FieldSamplingSection(ConfigSection):
+    section = "FieldSampling"
+    ContentTuple = namedtuple("FieldSamplingTuple", ('sample_static_fields',))
+    convert = ContentTuple(str)
+
+    def make(self):
+        return FieldSamplingConf(self.content.sample_static_fields)
@@ -26,7 +26,40 @@ class Shape(ConfigComponent, SerializableH5):
     def visualize(self, visualizer, **kwargs):
         raise NotImplementedError()
 
+    @property
+    def bounding_box(self):
+        """Lower and upper corners of an axis-aligned box containing the shape."""
+        return self._bounding_box
+
+    def set_bounding_box(self, lower, upper):
+        margin = 1e-9 * max(1., np.max(np.abs(np.concatenate((lower, upper)))))  # floating point slack
+        self._bounding_box = self.xp.asarray(np.asarray(lower) - margin), self.xp.asarray(np.asarray(upper) + margin)
+
     def are_positions_inside(self, positions):
+        """Discard positions outside the bounding box with cheap comparisons, run the exact test on the rest."""
+        positions = self.xp.asarray(positions)
+        if positions.ndim != 2:
+            return self.are_positions_inside_exact(positions)
+        lower, upper = self._bounding_box
+        # narrow down the candidates one axis at a time, only the first pass looks at all positions
+        x = positions[:, 0]
+        candidates = self.xp.flatnonzero(self.xp.logical_and(x >= lower[0], x <= upper[0]))
+        for axis in 1, 2:
+            c = positions[candidates, axis]
+            candidates = candidates[self.xp.logical_and(c >= lower[axis], c <= upper[axis])]
+        inside = self.xp.zeros(len(positions), dtype=bool)
+        if len(candidates):
+            inside[candidates] = self.are_positions_inside_exact(positions[candidates])
+        return inside
+
+    def are_positions_inside_exact(self, positions):
+        raise NotImplementedError()
+
+    def signed_distance(self, positions):
+        """
+        Distance from positions to the shape surface, negative inside.
+        May underestimate the absolute distance, but never overestimate it.
+        """
         raise NotImplementedError()
 
     def generate_uniform_random_position(self, random_state):
@@ -89,6 +122,35 @@ def rotation_from_z(vector):
     return np.concatenate(([cos], vector_component))
 
 
+def axial_coordinates(xp, start, end, positions):
+    """
+    :return: projections of positions on the start-end axis, distances from the axis and the axis length
+    """
+    pointvec = xp.asarray(positions) - start
+    axisvec = end - start
+    axis = xp.linalg.norm(axisvec)
+    projection = pointvec.dot(axisvec / axis)
+    perp_to_axis = xp.linalg.norm(pointvec - (axisvec / axis) * projection[..., xp.newaxis], axis=-1)
+    return projection, perp_to_axis, axis
+
+
+def axial_bounding_box(start, end, radius):
+    """Axis-aligned bounding box of a cylinder with given axis and radius."""
+    axis = (end - start) / norm(end - start)
+    extent = radius * np.sqrt(np.maximum(1 - axis ** 2, 0))
+    return np.minimum(start, end) - extent, np.maximum(start, end) + extent
+
+
+def box_signed_distance(xp, q):
+    """
+    Signed distance to a box centered at origin, given coordinates relative to it minus half-size.
+    :param q: Array of shape (..., d), (abs(point - center) - half_size) along each of d axes
+    """
+    outside = xp.linalg.norm(xp.maximum(q, 0), axis=-1)
+    inside = xp.minimum(q.max(axis=-1), 0)
+    return outside + inside
+
+
 class Box(Shape):
     def __init__(self, origin=(0, 0, 0), size=(1, 1, 1)):
         super().__init__()
@@ -96,15 +158,24 @@ class Box(Shape):
         self.size = vector(size)
         self._origin = self.xp.asarray(self.origin)
         self._size = self.xp.asarray(self.size)
+        self._bounding_box = self._origin, self._origin + self._size
 
     def visualize(self, visualizer, **kwargs):
         visualizer.draw_box(self.size, self.origin, **kwargs)
 
     def are_positions_inside(self, positions):
+        return self.are_positions_inside_exact(positions)  # no point in prefiltering with the same box
+
+    def are_positions_inside_exact(self, positions):
         positions = self.xp.asarray(positions)
         return self.xp.logical_and(self.xp.all(positions >= self._origin, axis=-1),
                                    self.xp.all(positions <= self._origin + self._size, axis=-1))
 
+    def signed_distance(self, positions):
+        positions = self.xp.asarray(positions)
+        half = self._size / 2
+        return box_signed_distance(self.xp, self.xp.abs(positions - self._origin - half) - half)
+
     def generate_uniform_random_posititons(self, random_state, n):
         return random_state.uniform(self.origin, self.origin + self.size, (n, 3))
 
@@ -136,11 +207,12 @@ class Cylinder(Shape):
         self._end = self.xp.asarray(self.end)
         self.radius = float(radius)
         self._rotation = rotation_from_z(self.end - self.start)
+        self.set_bounding_box(*axial_bounding_box(self.start, self.end, self.radius))
 
     def visualize(self, visualizer, **kwargs):
         visualizer.draw_cylinder(self.start, self.end, self.radius, **kwargs)
 
-    def are_positions_inside(self, positions):
+    def are_positions_inside_exact(self, positions):
         positions = self.xp.asarray(positions)
         pointvec = positions - self._start
         axisvec = self._end - self._start
@@ -154,6 +226,11 @@ class Cylinder(Shape):
                                      self.xp.logical_and(0 <= projection, projection <= axis))
         return result
 
+    def signed_distance(self, positions):
+        projection, perp_to_axis, axis = axial_coordinates(self.xp, self._start, self._end, positions)
+        q = self.xp.stack((perp_to_axis - self.radius, self.xp.abs(projection - axis / 2) - axis / 2), -1)
+        return box_signed_distance(self.xp, q)
+
     def generate_uniform_random_posititons(self, random_state, n):
         r = np.sqrt(random_state.uniform(0.0, 1.0, n)) * self.radius
         phi = random_state.uniform(0.0, 2.0 * np.pi, n)
@@ -188,11 +265,12 @@ class Tube(Shape):
         self.inner_radius = float(inner_radius)
         self.outer_radius = float(outer_radius)
         self._rotation = rotation_from_z(self.end - self.start)
+        self.set_bounding_box(*axial_bounding_box(self.start, self.end, self.outer_radius))
 
     def visualize(self, visualizer, **kwargs):
         visualizer.draw_tube(self.start, self.end, self.inner_radius, self.outer_radius, **kwargs)
 
-    def are_positions_inside(self, positions):
+    def are_positions_inside_exact(self, positions):
         positions = self.xp.asarray(positions)
         pointvec = positions - self._start
         axisvec = self._end - self._start
@@ -205,6 +283,13 @@ class Tube(Shape):
         return and_(and_(0 <= projection, projection <= axis),
                     and_(self.inner_radius <= perp_to_axis, perp_to_axis <= self.outer_radius))
 
+    def signed_distance(self, positions):
+        projection, perp_to_axis, axis = axial_coordinates(self.xp, self._start, self._end, positions)
+        half_thickness = (self.outer_radius - self.inner_radius) / 2
+        q = self.xp.stack((self.xp.abs(perp_to_axis - self.inner_radius - half_thickness) - half_thickness,
+                           self.xp.abs(projection - axis / 2) - axis / 2), -1)
+        return box_signed_distance(self.xp, q)
+
     def generate_uniform_random_posititons(self, random_state, n):
         r = np.sqrt(random_state.uniform(self.inner_radius / self.outer_radius, 1.0, n)) * self.outer_radius
         phi = random_state.uniform(0.0, 2.0 * np.pi, n)
@@ -240,14 +325,19 @@ class Sphere(Shape):
         self.origin = vector(origin)
         self._origin = self.xp.asarray(self.origin)
         self.radius = float(radius)
+        self.set_bounding_box(self.origin - self.radius, self.origin + self.radius)
 
     def visualize(self, visualizer, **kwargs):
         visualizer.draw_sphere(self.origin, self.radius, **kwargs)
 
-    def are_positions_inside(self, positions):
+    def are_positions_inside_exact(self, positions):
         positions = self.xp.asarray(positions)
         return self.xp.linalg.norm(positions - self._origin, axis=-1) <= self.radius
 
+    def signed_distance(self, positions):
+        positions = self.xp.asarray(positions)
+        return self.xp.linalg.norm(positions - self._origin, axis=-1) - self.radius
+
     def generate_uniform_random_posititons(self, random_state, n):
         while True:
             p = random_state.uniform(-1, 1, (n * 2, 3)) * self.radius + self.origin
@@ -267,15 +357,40 @@ class Sphere(Shape):
 
 
 class Cone(Shape):
+    """
+    Hollow truncated cone along z axis. Inner and outer radii change linearly from start to end.
+    :param start: axis x, axis y, start z, end z
+    """
     def __init__(self, start=(0, 0, 0, 1),
                  start_radii=(1, 2), end_radii=(3, 4)):
         super().__init__()
         self.start = np.array(start, np.float)
         self.start_radii = np.array(start_radii, np.float)
         self.end_radii = np.array(end_radii, np.float)
+        self._start_radii = self.xp.asarray(self.start_radii)
+        self._end_radii = self.xp.asarray(self.end_radii)
+        radius = max(self.start_radii.max(), self.end_radii.max())
+        z = np.sort(self.start[2:])
+        self.set_bounding_box((self.start[0] - radius, self.start[1] - radius, z[0]),
+                              (self.start[0] + radius, self.start[1] + radius, z[1]))
+
+    @property
+    def axis_start(self):
+        return np.array((self.start[0], self.start[1], self.start[2]))
+
+    @property
+    def axis_end(self):
+        return np.array((self.start[0], self.start[1], self.start[3]))
 
     def visualize(self, visualizer, **kwargs):
-        visualizer.draw_cone(self.start, self.end,
+        visualizer.draw_cone(self.axis_start, self.axis_end,
                              self.start_radii, self.end_radii, **kwargs)
 
-# TODO: def are_positions_inside(self, point)
+    def are_positions_inside_exact(self, positions):
+        positions = self.xp.asarray(positions)
+        x, y, start_z, end_z = self.start
+        t = (positions[..., 2] - start_z) / (end_z - start_z)  # 0 at start, 1 at end
+        r = self.xp.sqrt((positions[..., 0] - x) ** 2 + (positions[..., 1] - y) ** 2)
+        inner, outer = (self._start_radii[i] + t * (self._end_radii[i] - self._start_radii[i]) for i in (0, 1))
+        and_ = self.xp.logical_and
+        return and_(and_(0 <= t, t <= 1), and_(inner <= r, r <= outer))
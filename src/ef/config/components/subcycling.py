@@ -0,0 +1,56 @@
+__all__ = ["SubcyclingConf", "SubcyclingSection", "SpeciesSubcyclingConf", "SpeciesSubcyclingSection"]
+
+from collections import namedtuple
+
+from ef.config.component import ConfigComponent
+from ef.config.section import ConfigSection, NamedConfigSection
+
+
+class SubcyclingConf(ConfigComponent):
+    """
+    Particle pushes per field solve: the potential is solved on every field_solve_interval-th time step
+    and kept between solves, while particles are pushed on every time step.
+    """
+    def __init__(self, field_solve_interval=1):
+        if field_solve_interval < 1:
+            raise ValueError("Expect field_solve_interval >= 1")
+        self.field_solve_interval = int(field_solve_interval)
+
+    def to_conf(self):
+        return SubcyclingSection(self.field_solve_interval)
+
+    def make(self):
+        return self.field_solve_interval
+
+
+class SubcyclingSection(ConfigSection):
+    section = "Subcycling"
+    ContentTuple = namedtuple("SubcyclingTuple", ('field_solve_interval',))
+    convert = ContentTuple(int)
+
+    def make(self):
+        return SubcyclingConf(self.content.field_solve_interval)
+
+
+class SpeciesSubcyclingConf(ConfigComponent):
+    """
+    Push the species of the named particle source once every push_interval time steps with a longer step,
+    e.g. heavy ions next to electrons that need a short time step.
+    """
+    def __init__(self, name="ParticleSource1", push_interval=1):
+        if push_interval < 1:
+            raise ValueError("Expect push_interval >= 1")
+        self.name = name
+        self.push_interval = int(push_interval)
+
+    def to_conf(self):
+        return SpeciesSubcyclingSection(self.name, self.push_interval)
+
+
+class SpeciesSubcyclingSection(NamedConfigSection):
+    section = "SpeciesSubcycling"
+    ContentTuple = namedtuple("SpeciesSubcyclingTuple", ('push_interval',))
+    convert = ContentTuple(int)
+
+    def make(self):
+        return SpeciesSubcyclingConf(self.name, self.content.push_interval)
@@ -15,7 +15,8 @@ from ef.util.inject import safe_default_inject
 class Config(DataClass):
     def __init__(self, time_grid=TimeGridConf(), spatial_mesh=SpatialMeshConf(), sources=(), inner_regions=(),
                  output_file=OutputFileConf(), boundary_conditions=BoundaryConditionsConf(),
-                 particle_interaction_model=ParticleInteractionModelConf(), external_fields=()):
+                 particle_interaction_model=ParticleInteractionModelConf(), external_fields=(),
+                 field_sampling=FieldSamplingConf(), subcycling=SubcyclingConf(), species_subcycling=()):
         self.time_grid = time_grid
         self.spatial_mesh = spatial_mesh
         self.sources = list(sources)
@@ -24,6 +25,9 @@ class Config(DataClass):
         self.boundary_conditions = boundary_conditions
         self.particle_interaction_model = particle_interaction_model
         self.external_fields = list(external_fields)
+        self.field_sampling = field_sampling
+        self.subcycling = subcycling
+        self.species_subcycling = list(species_subcycling)
 
     @classmethod
     def from_components(cls, components):
@@ -31,15 +35,19 @@ class Config(DataClass):
                    'sources': ParticleSourceConf, 'inner_regions': InnerRegionConf,
                    'output_file': OutputFileConf, 'boundary_conditions': BoundaryConditionsConf,
                    'particle_interaction_model': ParticleInteractionModelConf,
-                   'external_fields': FieldConf}
+                   'external_fields': FieldConf, 'field_sampling': FieldSamplingConf,
+                   'subcycling': SubcyclingConf, 'species_subcycling': SpeciesSubcyclingConf}
         singletons = TimeGridConf, SpatialMeshConf, OutputFileConf, BoundaryConditionsConf, ParticleInteractionModelConf
+        optional_singletons = FieldSamplingConf, SubcyclingConf
         kwargs = {}
         for arg, parent in parents.items():
             children = [c for c in components if isinstance(c, parent)]
-            if parent in singletons:
+            if parent in singletons + optional_singletons:
                 if len(children) > 1:
                     raise Exception("Several {} configured, cannot init Config".format(parent))
                 if len(children) < 1:
+                    if parent in optional_singletons:
+                        continue
                     raise Exception("No {} configuration found, cannot init Config".format(parent))
                 kwargs[arg] = children[0]
             else:
@@ -71,7 +79,8 @@ class Config(DataClass):
     @property
     def components(self):
         return [self.time_grid, self.spatial_mesh] + self.sources + self.inner_regions + \
-               [self.output_file, self.boundary_conditions, self.particle_interaction_model] + self.external_fields
+               [self.output_file, self.boundary_conditions, self.particle_interaction_model] + self.external_fields + \
+               [self.field_sampling, self.subcycling] + self.species_subcycling
 
     def get_potentials(self):
         bc = self.boundary_conditions
@@ -119,7 +128,9 @@ class Config(DataClass):
         magnetic_fields = [f for f in fields if f.electric_or_magnetic == 'magnetic']
         model = self.particle_interaction_model.make()
         return simulation.Simulation(grid, mesh, regions, sources, electric_fields, magnetic_fields, model,
-                                     potential=potential)
+                                     potential=potential, sample_static_fields=self.field_sampling.make(),
+                                     field_solve_interval=self.subcycling.make(),
+                                     push_intervals={s.name: s.push_interval for s in self.species_subcycling})
 
     def is_trivial(self):
         if not self.boundary_conditions.is_the_same_on_all_boundaries:
@@ -0,0 +1,45 @@
+import numpy as np
+
+from ef.field import Field, FieldSum, FieldZero
+from ef.field.on_grid import FieldOnGrid
+from ef.meshgrid import MeshGrid
+
+
+class FieldEvaluator:
+    """
+    Evaluate total electric and magnetic fields at the same positions in one pass.
+
+    Fields stored on the simulation mesh share a single trilinear interpolation stencil,
+    other fields are evaluated on their own and added.
+    """
+    def __init__(self, mesh: MeshGrid, electric: Field, magnetic: Field):
+        self.mesh = mesh
+        self.electric = electric
+        self.magnetic = magnetic
+        self._electric_on_mesh, self._electric_other = self.split(electric)
+        self._magnetic_on_mesh, self._magnetic_other = self.split(magnetic)
+
+    def split(self, field: Field):
+        fields = field.fields if type(field) is FieldSum else [field]
+        on_mesh = [f for f in fields if isinstance(f, FieldOnGrid) and self.is_on_mesh(f.array.grid)]
+        other = [f for f in fields if type(f) is not FieldZero and all(f is not g for g in on_mesh)]
+        return on_mesh, other
+
+    def is_on_mesh(self, grid: MeshGrid) -> bool:
+        return grid is self.mesh or (np.array_equal(grid.n_nodes, self.mesh.n_nodes) and
+                                     np.array_equal(grid.size, self.mesh.size) and
+                                     np.array_equal(grid.origin, self.mesh.origin))
+
+    def get_at_points(self, positions, time):
+        on_mesh = self._electric_on_mesh + self._magnetic_on_mesh
+        stencil = on_mesh[0].array.interpolation_stencil(positions) if on_mesh else None
+        return self._evaluate(self.electric, self._electric_on_mesh, self._electric_other, stencil, positions, time), \
+               self._evaluate(self.magnetic, self._magnetic_on_mesh, self._magnetic_other, stencil, positions, time)
+
+    @staticmethod
+    def _evaluate(field, on_mesh, other, stencil, positions, time):
+        values = [f.array.interpolate_with_stencil(stencil) for f in on_mesh] + \
+                 [f.get_at_points(positions, time) for f in other]
+        if not values:
+            return FieldZero('ZeroSum', field.electric_or_magnetic).get_at_points(positions, time)
+        return sum(values[1:], values[0])
@@ -1,9 +1,9 @@
 import ast
-import operator as op
+import sys
 
 import inject
 import numpy
-from simpleeval import SimpleEval
+from simpleeval import FeatureNotAvailable, FunctionNotDefined, NameNotDefined
 
 from ef.field import Field
 from ef.util.inject import safe_default_inject
@@ -19,34 +19,92 @@ class FieldExpression(Field):
         self.expression_x = expression_x
         self.expression_y = expression_y
         self.expression_z = expression_z
-        self._ev = SimpleEval(functions={"sin": xp.sin,
-                                         "cos": xp.cos,
-                                         "sqrt": xp.sqrt},
-                              operators={ast.Add: op.add, ast.Sub: op.sub, ast.Mult: op.mul,
-                                         ast.Div: op.truediv, ast.FloorDiv: op.floordiv,
-                                         ast.Pow: op.pow, ast.Mod: op.mod,
-                                         ast.Eq: op.eq, ast.NotEq: op.ne,
-                                         ast.Gt: op.gt, ast.Lt: op.lt,
-                                         ast.GtE: op.ge, ast.LtE: op.le,
-                                         ast.Not: op.not_,
-                                         ast.USub: op.neg, ast.UAdd: op.pos,
-                                         ast.In: lambda x, y: op.contains(y, x),
-                                         ast.NotIn: lambda x, y: not op.contains(y, x),
-                                         ast.Is: lambda x, y: x is y,
-                                         ast.IsNot: lambda x, y: x is not y,
-                                         }
-                              )
-        # todo: inherit SimpleEval and define math functions inside
+        compiler = ExpressionCompiler(xp)
+        self._function = compiler.compile((expression_x, expression_y, expression_z), name)
+        self._time_independent = 't' not in compiler.names_used
         # todo: add r, theta, phi names
 
+    @property
+    def is_time_independent(self) -> bool:
+        return self._time_independent
+
     def get_at_points(self, positions, time: float) -> numpy.ndarray:
         positions = self._xp.asarray(positions)
-        self._ev.names["t"] = time
-        self._ev.names["x"] = positions[:, 0]
-        self._ev.names["y"] = positions[:, 1]
-        self._ev.names["z"] = positions[:, 2]
-        result = self._xp.empty_like(positions)
-        result[:, 0] = self._ev.eval(self.expression_x)
-        result[:, 1] = self._ev.eval(self.expression_y)
-        result[:, 2] = self._ev.eval(self.expression_z)
+        result = self._xp.empty_like(positions, dtype=float)
+        result[:, 0], result[:, 1], result[:, 2] = \
+            self._function(positions[:, 0], positions[:, 1], positions[:, 2], time)
         return result
+
+
+class ExpressionCompiler:
+    """
+    Compile arithmetic expressions of x, y, z and t into a single python function over arrays.
+    Only whitelisted operators and functions are allowed, subexpressions shared by the expressions are evaluated once.
+    """
+    names = ('x', 'y', 'z', 't')
+    constants = {'True': True, 'False': False}
+    functions = ('sin', 'cos', 'sqrt')
+    binary_operators = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.FloorDiv: '//',
+                        ast.Pow: '**', ast.Mod: '%'}
+    unary_operators = {ast.USub: '-', ast.UAdd: '+'}
+    comparisons = {ast.Eq: '==', ast.NotEq: '!=', ast.Gt: '>', ast.Lt: '<', ast.GtE: '>=', ast.LtE: '<='}
+
+    def __init__(self, xp=numpy):
+        self.namespace = {f: getattr(xp, f) for f in self.functions}
+        self.namespace['logical_not'] = xp.logical_not
+        self.lines = []
+        self.subexpressions = {}
+        self.names_used = set()
+        self._constants = {}
+        self._expression = None
+
+    def compile(self, expressions, name='expression'):
+        results = []
+        for expression in expressions:
+            self._expression = expression
+            results.append(self.visit(ast.parse(expression.strip(), mode='eval').body))
+        source = '\n    '.join([f"def evaluate({', '.join(self.names)}):"] + self.lines +
+                                [f"return {', '.join(results)},"])
+        exec(compile(source, f'<{name}>', 'exec'), self.namespace)
+        return self.namespace['evaluate']
+
+    def visit(self, node):
+        """Return python source for the node value, emitting a temporary variable for each new subexpression."""
+        if isinstance(node, ast.Name):
+            if node.id in self.names:
+                self.names_used.add(node.id)
+                return node.id
+            if node.id in self.constants:
+                return self.constant(self.constants[node.id])
+            raise NameNotDefined(node.id, self._expression)
+        if sys.version_info < (3, 8) and isinstance(node, (ast.Num, ast.NameConstant)):
+            node = ast.Constant(getattr(node, 'n', getattr(node, 'value', None)))
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, bool)):
+            return self.constant(node.value)
+        if isinstance(node, ast.BinOp) and type(node.op) in self.binary_operators:
+            code = f"{self.visit(node.left)} {self.binary_operators[type(node.op)]} {self.visit(node.right)}"
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in self.unary_operators:
+            code = f"{self.unary_operators[type(node.op)]}{self.visit(node.operand)}"
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            code = f"logical_not({self.visit(node.operand)})"
+        elif isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in self.comparisons:
+            code = f"{self.visit(node.left)} {self.comparisons[type(node.ops[0])]} {self.visit(node.comparators[0])}"
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in self.functions:
+                raise FunctionNotDefined(getattr(node.func, 'id', ast.dump(node.func)), self._expression)
+            if node.keywords:
+                raise FeatureNotAvailable("Keyword arguments are not allowed in field expressions")
+            code = f"{node.func.id}({', '.join(self.visit(a) for a in node.args)})"
+        else:
+            raise FeatureNotAvailable(f"Sorry, {type(node).__name__} is not available in field expressions")
+        if code not in self.subexpressions:
+            self.subexpressions[code] = f"_{len(self.subexpressions)}"
+            self.lines.append(f"{self.subexpressions[code]} = {code}")
+        return self.subexpressions[code]
+
+    def constant(self, value):
+        key = (type(value), value)
+        if key not in self._constants:
+            self._constants[key] = f"c{len(self._constants)}"
+            self.namespace[self._constants[key]] = value
+        return self._constants[key]
@@ -1,4 +1,8 @@
+import hashlib
+import logging
 import os.path
+from itertools import islice
+from typing import Optional, Tuple
 
 import inject
 import numpy
@@ -6,28 +10,95 @@ import numpy
 from ef.field.on_grid import FieldOnGrid
 from ef.meshgrid import MeshGrid
 from ef.util.array_on_grid import ArrayOnGrid
+from ef.util.array_on_grid_mapped import ArrayOnGridMapped
 
 
 class FieldFromCSVFile(FieldOnGrid):
+    """
+    Field given on a regular grid by a text file with a header line and X Y Z Fx Fy Fz columns.
+
+    The parsed field is cached as binary .npy files keyed by the hash of the text file,
+    so later runs memory-map the cache instead of parsing the text again.
+    Cache files are kept next to the text file unless cache_directory is set.
+    With lazy_loading the cached field is not loaded into memory, only the blocks around particles are read.
+    """
+    cache_directory: Optional[str] = None
+    lazy_loading: bool = inject.attr('lazy_field_files')
+    chunk_lines = 1000000
+
     @inject.params(xp=numpy, array_class=ArrayOnGrid)
     def __init__(self, name, electric_or_magnetic, field_filename, xp=numpy, array_class=ArrayOnGrid):
         if not os.path.exists(field_filename):
             raise FileNotFoundError("Field file not found")
-        raw = numpy.loadtxt(field_filename, skiprows=1)
-        # assume X Y Z Fx Fy Fz columns
-        # sort by column 0, then 1, then 2
-        # https://stackoverflow.com/a/38194077
-        ind = raw[:, 2].argsort()  # First sort doesn't need to be stable.
-        raw = raw[ind]
-        ind = raw[:, 1].argsort(kind='mergesort')
-        raw = raw[ind]
-        ind = raw[:, 0].argsort(kind='mergesort')
-        raw = raw[ind]
-        size = (raw[-1, :3] - raw[0, :3])
-        origin = raw[0, :3]
-        dist = raw[:, :3] - raw[0, :3]
-        step = dist.min(axis=0, where=dist > 0, initial=dist.max())
-        grid = MeshGrid.from_step(size, step, origin)
-        field = xp.asarray(raw[:, 3:].reshape((*grid.n_nodes, 3)))
-        super().__init__(name, electric_or_magnetic, array_class(grid, 3, field))
+        grid, field = self.load(field_filename)
+        array = ArrayOnGridMapped(grid, 3, field) if self.lazy_loading else array_class(grid, 3, xp.asarray(field))
+        super().__init__(name, electric_or_magnetic, array)
         self.field_filename = field_filename
+
+    @classmethod
+    def load(cls, field_filename) -> Tuple[MeshGrid, numpy.ndarray]:
+        field_path, grid_path = cls.cache_paths(field_filename)
+        if os.path.exists(field_path) and os.path.exists(grid_path):
+            origin, size = numpy.load(grid_path)
+            field = numpy.load(field_path, mmap_mode='r')
+            return MeshGrid(size, field.shape[:3], origin), field
+        grid, field = cls.parse(field_filename)
+        try:
+            os.makedirs(os.path.dirname(field_path), exist_ok=True)
+            # write to temporary files first, so that an interrupted run does not leave a broken cache
+            for path, data in ((field_path, field), (grid_path, numpy.stack((grid.origin, grid.size)))):
+                with open(path + '.tmp', 'wb') as f:
+                    numpy.save(f, data)
+                os.replace(path + '.tmp', path)
+        except OSError as e:
+            logging.warning(f"Could not cache field file {field_filename}: {e}")
+        return grid, field
+
+    @classmethod
+    def cache_paths(cls, field_filename) -> Tuple[str, str]:
+        digest = hashlib.sha256()
+        with open(field_filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        directory = os.path.dirname(os.path.abspath(field_filename)) if cls.cache_directory is None \
+            else cls.cache_directory
+        prefix = os.path.join(directory, f"{os.path.basename(field_filename)}.{digest.hexdigest()[:16]}")
+        return prefix + '.field.npy', prefix + '.grid.npy'
+
+    @classmethod
+    def parse(cls, field_filename) -> Tuple[MeshGrid, numpy.ndarray]:
+        # assume X Y Z Fx Fy Fz columns in any order of rows
+        # the first pass finds the grid from the coordinates, the second one puts field values into it,
+        # so that only a chunk of the text is in memory besides the field
+        axes = [numpy.empty(0)] * 3
+        n_points = 0
+        for xyz in cls.read_chunks(field_filename, usecols=(0, 1, 2)):
+            axes = [numpy.union1d(axis, column) for axis, column in zip(axes, xyz.T)]
+            n_points += len(xyz)
+        if n_points == 0:
+            raise ValueError(f"Field file {field_filename} has no points")
+        origin = numpy.array([axis[0] for axis in axes])
+        size = numpy.array([axis[-1] for axis in axes]) - origin
+        step = numpy.array([axis[1] - axis[0] if len(axis) > 1 else size.max() for axis in axes])
+        grid = MeshGrid.from_step(size, step, origin)
+        if n_points != grid.n_nodes.prod():
+            raise ValueError(f"Field file {field_filename} has {n_points} points, "
+                             f"expected a regular grid of {tuple(grid.n_nodes)}")
+        field = numpy.empty((*grid.n_nodes, 3))
+        covered = numpy.zeros(grid.n_nodes, bool)
+        for raw in cls.read_chunks(field_filename):
+            nodes = tuple(numpy.rint((raw[:, :3] - origin) / grid.cell).astype(int).T)
+            field[nodes] = raw[:, 3:]
+            covered[nodes] = True
+        if not covered.all():
+            raise ValueError(f"Field file {field_filename} has no values at {numpy.count_nonzero(~covered)} nodes "
+                             f"of the regular grid {tuple(grid.n_nodes)}, other points are repeated or off the grid")
+        return grid, field
+
+    @classmethod
+    def read_chunks(cls, field_filename, usecols=None):
+        """Parse the text file by chunks of chunk_lines rows."""
+        with open(field_filename) as f:
+            f.readline()  # skip header
+            for lines in iter(lambda: list(islice(f, cls.chunk_lines)), []):
+                yield numpy.loadtxt(lines, ndmin=2, usecols=usecols)
@@ -9,3 +9,156 @@ class FieldParticles(Field):
 
     def get_at_points(self, positions, time):
         return sum(p.xp.nan_to_num(p.field_at_points(positions)) for p in self.particle_arrays)
+
+
+class FieldParticlesBarnesHut(FieldParticles):
+    """
+    Particle field evaluated with the Barnes-Hut octree algorithm in O(N log N).
+
+    A tree node is replaced by its charge and dipole moment when its size seen from the target point
+    is smaller than the opening angle, otherwise it is opened. Leaves are summed directly.
+    With few particles the exact direct sum of FieldParticles is used.
+    """
+    max_depth = 21  # octree levels, limited by 63-bit morton codes
+    targets_per_chunk = 4096
+
+    def __init__(self, name, particle_arrays, opening_angle=0.5, leaf_size=16, direct_sum_max_particles=1000):
+        super().__init__(name, particle_arrays)
+        self.opening_angle = opening_angle
+        self.leaf_size = leaf_size
+        self.direct_sum_max_particles = direct_sum_max_particles
+
+    def get_at_points(self, positions, time):
+        n_particles = sum(len(p.ids) for p in self.particle_arrays)
+        if n_particles <= self.direct_sum_max_particles:
+            return super().get_at_points(positions, time)
+        xp = self.particle_arrays[0].xp
+        sources = np.concatenate([self.to_host(p.positions) for p in self.particle_arrays])
+        charges = np.concatenate([np.full(len(p.ids), p.charge, dtype=float) for p in self.particle_arrays])
+        tree = _Octree(sources, charges, self.leaf_size, self.max_depth)
+        targets = self.to_host(xp.asarray(positions)).reshape((-1, 3)).astype(float)
+        result = np.empty_like(targets)
+        for start in range(0, len(targets), self.targets_per_chunk):
+            chunk = slice(start, start + self.targets_per_chunk)
+            result[chunk] = tree.field_at_points(targets[chunk], self.opening_angle)
+        return xp.asarray(result)
+
+    @staticmethod
+    def to_host(a):
+        return a if isinstance(a, np.ndarray) else a.get()
+
+
+class _Octree:
+    def __init__(self, positions, charges, leaf_size, max_depth):
+        origin = positions.min(axis=0)
+        size = (positions.max(axis=0) - origin).max()
+        if size == 0:
+            size = 1.
+        n_cells = 1 << max_depth
+        cells = np.minimum(((positions - origin) * (n_cells / size)).astype(np.int64), n_cells - 1)
+        codes = self.morton_codes(cells)
+        order = np.argsort(codes, kind='stable')
+        self.codes = codes[order]
+        self.positions = positions[order]
+        self.charges = charges[order]
+
+        starts, ends, levels, parents = [np.array([0])], [np.array([len(order)])], [np.array([0])], []
+        n_nodes = 1
+        for level in range(max_depth):
+            s, e = starts[-1], ends[-1]
+            split = np.flatnonzero(e - s > leaf_size)
+            if split.size == 0:
+                break
+            counts = e[split] - s[split]
+            owner = np.repeat(split, counts)  # index of the parent node (within its level) for each particle
+            idx = np.repeat(s[split] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            keys = self.codes[idx] >> np.uint64(3 * (max_depth - level - 1))
+            first = np.ones(len(idx), dtype=bool)
+            first[1:] = (keys[1:] != keys[:-1]) | (owner[1:] != owner[:-1])
+            child_start = idx[first]
+            child_parent = owner[first]
+            child_end = np.empty_like(child_start)
+            child_end[:-1] = np.where(child_parent[1:] == child_parent[:-1], child_start[1:], e[child_parent[:-1]])
+            child_end[-1] = e[child_parent[-1]]
+            parents.append(child_parent + n_nodes - len(s))
+            starts.append(child_start)
+            ends.append(child_end)
+            levels.append(np.full(len(child_start), level + 1))
+            n_nodes += len(child_start)
+
+        self.start = np.concatenate(starts)
+        self.end = np.concatenate(ends)
+        self.width = size / 2. ** np.concatenate(levels)
+        parent = np.concatenate(parents) if parents else np.empty(0, dtype=int)
+        # children of a node are contiguous, as they are created in the order of their parents
+        self.n_children = np.bincount(parent, minlength=len(self.start))
+        self.first_child = np.full(len(self.start), -1)
+        has_children = self.n_children > 0
+        self.first_child[has_children] = 1 + np.cumsum(self.n_children)[has_children] - self.n_children[has_children]
+
+        def segment_sums(values):
+            cumulative = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+            return cumulative[self.end] - cumulative[self.start]
+
+        weight = np.abs(self.charges)
+        self.charge = segment_sums(self.charges)
+        abs_charge = segment_sums(weight)
+        abs_charge[abs_charge == 0] = 1.
+        weighted = segment_sums(weight[:, np.newaxis] * self.positions)
+        self.center = weighted / abs_charge[:, np.newaxis]
+        self.dipole = segment_sums(self.charges[:, np.newaxis] * self.positions) - \
+                      self.charge[:, np.newaxis] * self.center
+
+    @staticmethod
+    def morton_codes(cells):
+        def spread_bits(x):
+            x = x.astype(np.uint64) & np.uint64(0x1fffff)
+            for shift, mask in ((32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f),
+                                (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)):
+                x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+            return x
+
+        return (spread_bits(cells[:, 0]) << np.uint64(2)) | (spread_bits(cells[:, 1]) << np.uint64(1)) | \
+               spread_bits(cells[:, 2])
+
+    def field_at_points(self, targets, opening_angle):
+        field = np.zeros_like(targets)
+        t = np.arange(len(targets))
+        node = np.zeros(len(targets), dtype=int)
+        while t.size:
+            d = targets[t] - self.center[node]
+            r2 = np.einsum('ij,ij->i', d, d)
+            far = self.width[node] ** 2 < opening_angle ** 2 * r2
+            leaf = ~far & (self.first_child[node] < 0)
+            self.add_far_field(field, t[far], d[far], r2[far], node[far])
+            self.add_leaf_field(field, targets, t[leaf], node[leaf])
+            t, node = t[~far & ~leaf], node[~far & ~leaf]
+            n_children = self.n_children[node]
+            t = np.repeat(t, n_children)
+            node = np.repeat(self.first_child[node] - np.cumsum(n_children) + n_children, n_children) + \
+                   np.arange(n_children.sum())
+        return field
+
+    def add_far_field(self, field, t, d, r2, node):
+        r = np.sqrt(r2)
+        inv_r3 = 1. / (r2 * r)
+        p = self.dipole[node]
+        p_dot_d = np.einsum('ij,ij->i', p, d)
+        e = (self.charge[node] * inv_r3)[:, np.newaxis] * d + \
+            (3 * p_dot_d * inv_r3 / r2)[:, np.newaxis] * d - inv_r3[:, np.newaxis] * p
+        self.scatter_add(field, t, e)
+
+    def add_leaf_field(self, field, targets, t, node):
+        counts = self.end[node] - self.start[node]
+        tt = np.repeat(t, counts)
+        pp = np.repeat(self.start[node] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        d = targets[tt] - self.positions[pp]
+        r2 = np.einsum('ij,ij->i', d, d)
+        r2[r2 == 0] = np.inf  # no self-interaction
+        e = (self.charges[pp] / (r2 * np.sqrt(r2)))[:, np.newaxis] * d
+        self.scatter_add(field, tt, e)
+
+    @staticmethod
+    def scatter_add(field, t, values):
+        for i in range(3):
+            field[:, i] += np.bincount(t, values[:, i], minlength=len(field))
@@ -1,14 +1,51 @@
-from typing import List
+import hashlib
+import logging
+import os
+from typing import List, Optional, Sequence
 
+import inject
 import numpy as np
 import scipy.sparse
 import scipy.sparse.linalg
 
 from ef.inner_region import InnerRegion
 from ef.meshgrid import MeshGrid
+from ef.util.inject import safe_default_inject
+
+
+def mesh_digest(name: str, mesh: MeshGrid):
+    digest = hashlib.sha256(name.encode())
+    for a in mesh.size, mesh.n_nodes, mesh.origin:
+        digest.update(np.ascontiguousarray(a, dtype=float).tobytes())
+    return digest
+
+
+def geometry_hash(name: str, mesh: MeshGrid, region_nodes: Sequence[np.ndarray]) -> str:
+    """Hash of the exact mesh and node indexes inside inner regions, to name cache files of solver setup."""
+    digest = mesh_digest(name, mesh)
+    for nodes in region_nodes:
+        digest.update(b'region')
+        digest.update(np.ascontiguousarray(nodes, dtype=np.int64).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def regions_hash(name: str, mesh: MeshGrid, inner_regions: Sequence[InnerRegion]) -> str:
+    """Hash of the exact mesh and the shapes, potentials and inversion of inner regions."""
+    digest = mesh_digest(name, mesh)
+    for region in inner_regions:
+        digest.update(b'region')
+        digest.update(type(region.shape).__name__.encode())
+        for key, value in sorted(region.shape.dict.items()):
+            digest.update(key.encode())
+            digest.update(np.ascontiguousarray(value, dtype=float).tobytes())
+        digest.update(np.array((region.potential, region.inverted), dtype=float).tobytes())
+    return digest.hexdigest()[:16]
 
 
 class FieldSolver:
+    cache_directory: Optional[str] = inject.attr('solver_cache_dir')  # None to always assemble equation matrices
+
+    @safe_default_inject
     def __init__(self, mesh: MeshGrid, inner_regions: List[InnerRegion],
                  tolerance: float = 1e-10, max_iter: int = 1000):
         if inner_regions:
@@ -16,51 +53,34 @@ class FieldSolver:
             print("WARNING: proceed with caution")
         self._double_index = self.double_index(mesh.n_nodes)
         self.mesh = mesh
-        self.nodes_in_regions, self.potential_in_regions = self.generate_nodes_in_regions(inner_regions)
+        if not self.load_cached_equation(inner_regions):
+            self.nodes_in_regions, self.potential_in_regions = self.generate_nodes_in_regions(inner_regions)
+            self.A = self.construct_equation_matrix()
+            self.save_cached_equation(inner_regions)
         nrows = (mesh.n_nodes - 2).prod()
-        self.A = self.construct_equation_matrix()
         self.phi_vec = np.empty(nrows)
         self.rhs = np.empty_like(self.phi_vec)
         self.tolerance = tolerance
         self.max_iter = max_iter
 
     def construct_equation_matrix(self):
+        # 7-point laplacian multiplied by the squared cell volume, assembled directly in csr format
         nx, ny, nz = self.mesh.n_nodes - 2
         size = nx * ny * nz
         cx, cy, cz = self.mesh.cell ** 2
         dx, dy, dz = cy * cz, cx * cz, cx * cy
-        diag_dx = self.get_diag_d2dx2_in_3d(nx, ny, nz, dx)
-        diag_dy = self.get_diag_d2dy2_in_3d(nx, ny, nz, dy)
-        i = np.concatenate((np.arange(size),
-                            np.arange(size - 1), np.arange(1, size),
-                            np.arange(size - nx), np.arange(nx, size),
-                            np.arange(size - nx * ny), np.arange(nx * ny, size)))
-        j = np.concatenate((np.arange(size),
-                            np.arange(1, size), np.arange(size - 1),
-                            np.arange(nx, size), np.arange(size - nx),
-                            np.arange(nx * ny, size), np.arange(size - nx * ny)))
-        values = np.concatenate((np.full(size, -2.0 * (dx + dy + dz)),
-                                 diag_dx, diag_dx,
-                                 diag_dy, diag_dy,
-                                 np.full(size - nx * ny, dz), np.full(size - nx * ny, dz)))
-        matrix = scipy.sparse.coo_matrix((values, (i, j)), shape=(size, size))
-        return self.zero_nondiag_for_nodes_inside_objects(matrix).tocsr()
-
-    @staticmethod
-    def get_diag_d2dx2_in_3d(nx, ny, nz, dx):
-        diag_offset = 1
-        block_size = nx
-        ones = np.full(block_size - diag_offset, dx)
-        zeros = np.zeros(diag_offset)
-        return np.concatenate([ones, zeros] * (ny * nz))[:-diag_offset]
-
-    @staticmethod
-    def get_diag_d2dy2_in_3d(nx, ny, nz, dy):
-        diag_offset = nx
-        block_size = nx * ny
-        ones = np.full(block_size - diag_offset, dy)
-        zeros = np.zeros(diag_offset)
-        return np.concatenate([ones, zeros] * nz)[:-diag_offset]
+        # neighbours in the order of increasing column index; node index is i + j * nx + k * nx * ny
+        offsets = np.array((-nx * ny, -nx, -1, 0, 1, nx, nx * ny))
+        values = np.array((dz, dy, dx, -2.0 * (dx + dy + dz), dx, dy, dz))
+        valid = np.ones((nz, ny, nx, 7), bool)
+        valid[0, :, :, 0] = valid[:, 0, :, 1] = valid[:, :, 0, 2] = False
+        valid[:, :, -1, 4] = valid[:, -1, :, 5] = valid[-1, :, :, 6] = False
+        valid = valid.reshape((size, 7))
+        columns = (np.arange(size)[:, np.newaxis] + offsets)[valid]
+        data = np.broadcast_to(values, (size, 7))[valid]
+        indptr = np.concatenate(([0], np.cumsum(np.count_nonzero(valid, axis=1))))
+        matrix = scipy.sparse.csr_matrix((data, columns, indptr), shape=(size, size))
+        return self.zero_nondiag_for_nodes_inside_objects(matrix)
 
     def generate_nodes_in_regions(self, inner_regions):
         ijk = self._double_index[:, 1:]
@@ -78,18 +98,79 @@ class FieldSolver:
         indices = n[inside]
         return indices, potential[indices]
 
-    def zero_nondiag_for_nodes_inside_objects(self, matrix: scipy.sparse.coo_matrix):
-        data = matrix.data
-        row = matrix.row
-        col = matrix.col
-        mask = np.isin(row, self.nodes_in_regions)
-        data[mask] = 0.
-        data[np.logical_and(row == col, mask)] = 1.
-        return scipy.sparse.coo_matrix((data, (row, col)), shape=matrix.shape)
+    def zero_nondiag_for_nodes_inside_objects(self, matrix):
+        """Turn matrix rows of nodes inside objects into identity rows, in place for a csr matrix."""
+        matrix = matrix.tocsr()
+        rows = np.asarray(self.nodes_in_regions, dtype=int)
+        starts = matrix.indptr[rows]
+        counts = matrix.indptr[rows + 1] - starts
+        # positions of the stored values in these rows
+        stored = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        matrix.data[stored] = 0.
+        matrix.data[stored[matrix.indices[stored] == np.repeat(rows, counts)]] = 1.
+        return matrix
+
+    def cache_path(self, inner_regions: Sequence[InnerRegion]) -> Optional[str]:
+        if self.cache_directory is None:
+            return None
+        name = regions_hash(type(self).__name__, self.mesh, inner_regions)
+        return os.path.join(self.cache_directory, f"equation_{name}.npz")
+
+    def load_cached_equation(self, inner_regions: Sequence[InnerRegion]) -> bool:
+        path = self.cache_path(inner_regions)
+        if path is None or not os.path.exists(path):
+            return False
+        with np.load(path) as cached:
+            self.A = scipy.sparse.csr_matrix((cached['data'], cached['indices'], cached['indptr']),
+                                             shape=tuple(cached['shape']))
+            self.nodes_in_regions = cached['nodes_in_regions']
+            self.potential_in_regions = cached['potential_in_regions']
+        return True
+
+    def save_cached_equation(self, inner_regions: Sequence[InnerRegion]):
+        path = self.cache_path(inner_regions)
+        if path is None or self.A is None:
+            return
+        try:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, data=self.A.data, indices=self.A.indices, indptr=self.A.indptr, shape=self.A.shape,
+                         nodes_in_regions=self.nodes_in_regions, potential_in_regions=self.potential_in_regions)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logging.warning(f"Could not cache field equation in {self.cache_directory}: {e}")
 
     def eval_potential(self, charge_density, potential):
         raise NotImplementedError()
 
+    def eval_potentials(self, charge_densities, potentials, potentials_in_regions=None):
+        """
+        Solve for a batch of charge densities and boundary potentials on the mesh and inner region nodes of this solver.
+
+        :param potentials_in_regions: potential at nodes_in_regions for each problem, by default potential_in_regions
+        """
+        if potentials_in_regions is None:
+            potentials_in_regions = [self.potential_in_regions] * len(charge_densities)
+        rhs = np.empty(((self.mesh.n_nodes - 2).prod(), len(charge_densities)))
+        for i, (charge, potential, inside) in enumerate(zip(charge_densities, potentials, potentials_in_regions)):
+            self.init_rhs_vector_in_full_domain(charge, potential)
+            self.rhs[self.nodes_in_regions] = inside
+            rhs[:, i] = self.rhs.get() if hasattr(self.rhs, 'get') else self.rhs
+        phi = self.solve_batch(rhs)
+        for i, potential in enumerate(potentials):
+            self.phi_vec = phi[:, i]
+            # subclasses may keep their solution elsewhere, the batch solution is in phi_vec
+            FieldSolver.transfer_solution_to_spat_mesh(self, potential)
+
+    def solve_batch(self, rhs):
+        """
+        Solve the equation for several right-hand sides at once.
+
+        :param rhs: array of shape (nrows, n_problems)
+        :return: solutions of the same shape
+        """
+        raise NotImplementedError()
+
     def init_rhs_vector(self, charge_density, potential):
         self.init_rhs_vector_in_full_domain(charge_density, potential)
         self.set_rhs_for_nodes_inside_objects()
@@ -0,0 +1,39 @@
+from typing import List
+
+
+class FieldSolverAdaptive:
+    """
+    Skip potential solves while the charge density changes little since the last solve.
+
+    The wrapped solver is called when the norm of the change of charge density relative to the charge density
+    of the last solve exceeds change_threshold, or when max_skipped_solves solves in a row have been skipped.
+    Otherwise the potential is left as it is. Whether each requested solve was done is recorded in solved.
+    """
+
+    def __init__(self, solver, change_threshold: float, max_skipped_solves: int = 10):
+        self.solver = solver
+        self.mesh = solver.mesh
+        self.change_threshold = change_threshold
+        self.max_skipped_solves = max_skipped_solves
+        self.solved: List[bool] = []
+        self._skipped = 0
+        self._last_charge = None
+
+    def relative_change(self, charge_density) -> float:
+        xp = charge_density.xp
+        change = float(xp.linalg.norm(charge_density._data - self._last_charge))
+        last = float(xp.linalg.norm(self._last_charge))
+        if change == 0:
+            return 0.
+        return change / last if last else float('inf')
+
+    def eval_potential(self, charge_density, potential):
+        if self._last_charge is not None and self._skipped < self.max_skipped_solves and \
+                self.relative_change(charge_density) <= self.change_threshold:
+            self._skipped += 1
+            self.solved.append(False)
+            return
+        self.solver.eval_potential(charge_density, potential)
+        self._last_charge = charge_density.xp.array(charge_density._data)
+        self._skipped = 0
+        self.solved.append(True)
@@ -0,0 +1,37 @@
+import numpy as np
+import scipy.fft
+
+from ef.field.solvers import FieldSolver
+
+
+class FieldSolverFFT(FieldSolver):
+    def __init__(self, mesh, inner_regions, *args, **kwargs):
+        """
+        Direct solver diagonalizing the discrete laplacian with a type I discrete sine transform.
+        Only supports Dirichlet boundary conditions on the domain box, without inner regions.
+        """
+        if inner_regions:
+            raise ValueError("FFT field solver does not support inner regions, choose another solver")
+        super().__init__(mesh, inner_regions, *args, **kwargs)
+        cx, cy, cz = self.mesh.cell ** 2
+        # eigenvalues of the 1d second difference operator with zero boundaries
+        lx, ly, lz = (-4 * np.sin(np.pi * np.arange(1, n + 1) / (2 * (n + 1))) ** 2 for n in self.mesh.n_nodes - 2)
+        self._eigenvalues = (cy * cz * lx[:, np.newaxis, np.newaxis] +
+                             cx * cz * ly[np.newaxis, :, np.newaxis] +
+                             cx * cy * lz[np.newaxis, np.newaxis, :])
+
+    def construct_equation_matrix(self):
+        return None  # matrix-free
+
+    def eval_potential(self, charge_density, potential):
+        self.init_rhs_vector_in_full_domain(charge_density, potential)
+        self.phi_vec = self.solve_batch(self.rhs[:, np.newaxis])[:, 0]
+        self.transfer_solution_to_spat_mesh(potential)
+
+    def solve_batch(self, rhs):
+        n_problems = rhs.shape[1]
+        rhs = rhs.reshape((*(self.mesh.n_nodes - 2), n_problems), order='F')
+        axes = (0, 1, 2)
+        phi = scipy.fft.idstn(scipy.fft.dstn(rhs, type=1, axes=axes) / self._eigenvalues[..., np.newaxis],
+                              type=1, axes=axes)
+        return phi.reshape((-1, n_problems), order='F')
@@ -0,0 +1,101 @@
+import numpy as np
+import scipy.sparse.linalg
+
+from ef.field.solvers.stencil import FieldSolverStencil, GridLevel
+
+
+class FieldSolverGeometricMG(FieldSolverStencil):
+    """
+    Matrix-free geometric multigrid solver working directly on the arrays of potential and charge.
+
+    The 7-point laplacian, red-black Gauss-Seidel smoothing, full weighting restriction and linear prolongation
+    are whole-array stencil operations, so they run on numpy or cupy arrays alike.
+    Boundary nodes and nodes inside inner regions are fixed by a mask on every level.
+    Axes are coarsened by a factor of two while they have an even number of cells,
+    the coarsest level is solved directly, or approximately with conjugate gradients if it is still large.
+    V-cycles precondition a flexible conjugate gradient method, which is robust to the irregular inner regions.
+    """
+    smoothing_steps = 2
+    coarsest_unknowns = 4096  # stop coarsening when the level has fewer free nodes
+    direct_solve_unknowns = 15000  # solve the coarsest level by lu decomposition if it has fewer free nodes
+    coarsest_iterations = 50
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        xp = self._xp
+        fixed = self.grid.fixed
+        self.levels = [self.grid]
+        while self.levels[-1].n_free > self.coarsest_unknowns:
+            coarsened = [n >= 5 and n % 2 == 1 for n in fixed.shape]
+            if not any(coarsened):
+                break
+            fixed = fixed[tuple(slice(None, None, 2) if c else slice(None) for c in coarsened)]
+            self.levels[-1].coarsened = coarsened
+            self.levels.append(GridLevel(fixed, self.levels[-1].cell * np.where(coarsened, 2, 1), xp))
+        coarsest = self.levels[-1]
+        self._coarse_lu = scipy.sparse.linalg.splu(coarsest.matrix().tocsc()) \
+            if 0 < coarsest.n_free <= self.direct_solve_unknowns else None
+
+    def solve(self, phi, b):
+        xp = self._xp
+        top = self.levels[0]
+        b_norm = self.reference_norm(phi, b)
+        if b_norm == 0:
+            phi *= 1 - top.free
+            return
+        r = b * top.free - top.apply(phi)
+        z = self.v_cycle(0, r)
+        p = z.copy()
+        rz = float(xp.vdot(r, z))
+        for _ in range(self.max_iter):
+            if float(xp.linalg.norm(r)) <= self.tolerance * b_norm:
+                break
+            q = top.apply(p)
+            alpha = rz / float(xp.vdot(p, q))
+            phi += alpha * p
+            r -= alpha * q
+            z = self.v_cycle(0, r)
+            # flexible (Polak-Ribiere) update, the coarsest level solve may be inexact
+            beta = -alpha * float(xp.vdot(z, q)) / rz
+            rz = float(xp.vdot(r, z))
+            p *= beta
+            p += z
+
+    def v_cycle(self, index, r):
+        level = self.levels[index]
+        if index == len(self.levels) - 1:
+            return self.solve_coarsest(r)
+        e = self._xp.zeros_like(r)
+        for _ in range(self.smoothing_steps):
+            level.smooth(e, r, level.colors)
+        coarse = self.levels[index + 1]
+        e += level.prolong(self.v_cycle(index + 1, coarse.free * level.restrict(r - level.apply(e))))
+        e *= level.free
+        for _ in range(self.smoothing_steps):
+            level.smooth(e, r, level.colors[::-1])
+        return e
+
+    def solve_coarsest(self, r):
+        level = self.levels[-1]
+        e = self._xp.zeros_like(r)
+        if self._coarse_lu is not None:
+            rhs = r[level.free_mask]
+            solution = self._coarse_lu.solve(rhs.get() if hasattr(rhs, 'get') else rhs)
+            e[level.free_mask] = self._xp.asarray(solution)
+            return e
+        # jacobi preconditioned conjugate gradients, a fixed number of iterations
+        d = level.diagonal
+        res = r.copy()
+        p = res / d
+        rz = float(self._xp.vdot(res, p))
+        for _ in range(self.coarsest_iterations):
+            if rz == 0:
+                break
+            q = level.apply(p)
+            alpha = rz / float(self._xp.vdot(p, q))
+            e += alpha * p
+            res -= alpha * q
+            z = res / d
+            rz, rz_old = float(self._xp.vdot(res, z)), rz
+            p = z + rz / rz_old * p
+        return e
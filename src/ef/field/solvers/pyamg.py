@@ -1,13 +1,40 @@
+import numpy as np
+import scipy.sparse
+
 from ef.field.solvers import FieldSolver
 
 
 class FieldSolverPyamg(FieldSolver):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, accel='auto', **kwargs):
+        """
+        Smoothed aggregation multigrid solver. The hierarchy is built once for the equation matrix
+        and reused for every time step.
+
+        :param accel: krylov method to precondition with the multigrid hierarchy, e.g. 'cg' or 'gmres';
+            None for plain multigrid cycles, 'auto' to choose cg or gmres depending on matrix symmetry
+        """
         super().__init__(*args, **kwargs)
         import pyamg
-        self._solver = pyamg
+        # laplacian rows have negative diagonal, flip them so that the matrix is positive definite for cg
+        self._row_sign = np.where(self.A.diagonal() < 0, -1., 1.)
+        matrix = scipy.sparse.diags(self._row_sign).dot(self.A).tocsr()
+        self._solver = pyamg.solver(matrix, pyamg.solver_configuration(matrix, verb=False))
+        if accel == 'auto':
+            accel = 'cg' if self._solver.levels[0].A.symmetry == 'hermitian' else 'gmres'
+        self.accel = accel
+        self._phi_batch = None
 
     def eval_potential(self, charge_density, potential):
         self.init_rhs_vector(charge_density, potential)
-        self.phi_vec = self._solver.solve(self.A, self.rhs, x0=self.phi_vec, tol=self.tolerance, verb=False, maxiter=self.max_iter)
+        self.phi_vec = self._solver.solve(self._row_sign * self.rhs, x0=self.phi_vec, tol=self.tolerance,
+                                          maxiter=self.max_iter, accel=self.accel)
         self.transfer_solution_to_spat_mesh(potential)
+
+    def solve_batch(self, rhs):
+        # the hierarchy is shared, but pyamg cycles work on a single vector, so columns are solved in turn
+        if self._phi_batch is None or self._phi_batch.shape != rhs.shape:
+            self._phi_batch = np.zeros_like(rhs)
+        for i in range(rhs.shape[1]):
+            self._phi_batch[:, i] = self._solver.solve(self._row_sign * rhs[:, i], x0=self._phi_batch[:, i],
+                                                       tol=self.tolerance, maxiter=self.max_iter, accel=self.accel)
+        return self._phi_batch.copy()
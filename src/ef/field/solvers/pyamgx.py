@@ -49,6 +49,17 @@ class FieldSolverPyamgx(FieldSolver):
         self._solver.solve(self._rhs, self._phi_vec)
         self.transfer_solution_to_spat_mesh(potential)
 
+    def solve_batch(self, rhs):
+        # amgx solves one vector at a time with the same setup; rhs and phi vectors are reused
+        phi = numpy.empty_like(rhs)
+        column = numpy.empty(rhs.shape[0])
+        for i in range(rhs.shape[1]):
+            self._rhs.upload(numpy.ascontiguousarray(rhs[:, i]))
+            self._solver.solve(self._rhs, self._phi_vec)
+            self._phi_vec.download(column)
+            phi[:, i] = column
+        return phi
+
     def transfer_solution_to_spat_mesh(self, potential):
         if potential.xp is numpy:
             self._phi_vec.download(self.phi_vec)
@@ -0,0 +1,128 @@
+import inject
+import numpy as np
+import scipy.sparse
+
+from ef.field.solvers import FieldSolver
+from ef.util.inject import safe_default_inject
+
+
+class FieldSolverStencil(FieldSolver):
+    """
+    Base of matrix-free solvers working on whole arrays of potential with stencil operations.
+
+    Boundary nodes and nodes inside inner regions are fixed, their potential is never changed.
+    Subclasses implement solve() on numpy or cupy arrays of the injected xp.
+    """
+
+    @safe_default_inject
+    @inject.params(xp=np)
+    def __init__(self, mesh, inner_regions, *args, xp=np, **kwargs):
+        super().__init__(mesh, inner_regions, *args, **kwargs)
+        self._xp = xp
+        fixed = np.ones(mesh.n_nodes, bool)
+        fixed[1:-1, 1:-1, 1:-1] = False
+        region_nodes = tuple(i + 1 for i in np.unravel_index(self.nodes_in_regions, mesh.n_nodes - 2, order='F'))
+        fixed[region_nodes] = True
+        self._region_nodes = tuple(xp.asarray(i) for i in region_nodes)
+        self.grid = GridLevel(fixed, mesh.cell, xp)
+
+    def construct_equation_matrix(self):
+        return None  # matrix-free
+
+    def eval_potential(self, charge_density, potential):
+        xp = self._xp
+        phi = xp.array(potential._data, dtype=float)  # boundary values and the previous solution as initial guess
+        phi[self._region_nodes] = xp.asarray(self.potential_in_regions)
+        self.solve(phi, 4 * np.pi * xp.asarray(charge_density._data, dtype=float))
+        potential._data[1:-1, 1:-1, 1:-1] = potential.xp.asarray(phi[1:-1, 1:-1, 1:-1])
+
+    def solve_batch(self, rhs):
+        # columns hold the matrix equation rhs with boundary potentials moved to the right side
+        xp = self._xp
+        shape = tuple(self.mesh.n_nodes - 2)
+        result = np.empty_like(rhs)
+        for i in range(rhs.shape[1]):
+            column = xp.asarray(rhs[:, i].reshape(shape, order='F'))
+            b = xp.zeros(self.grid.shape)
+            b[1:-1, 1:-1, 1:-1] = column / -self.mesh.cell.prod() ** 2
+            phi = xp.zeros(self.grid.shape)
+            phi[self._region_nodes] = column[tuple(j - 1 for j in self._region_nodes)]
+            self.solve(phi, b)
+            phi = phi[1:-1, 1:-1, 1:-1]
+            result[:, i] = (phi.get() if hasattr(phi, 'get') else phi).ravel('F')
+        return result
+
+    def solve(self, phi, b):
+        """
+        Solve -laplacian(phi) = b in place at free nodes, with phi fixed at boundary and inner region nodes.
+        Values of phi at free nodes are the initial guess.
+        """
+        raise NotImplementedError()
+
+    def reference_norm(self, phi, b):
+        """Residual norm of zero potential at free nodes, solvers stop at tolerance relative to it."""
+        return float(self._xp.linalg.norm(b * self.grid.free - self.grid.apply(phi * (1 - self.grid.free))))
+
+
+class GridLevel:
+    """Masks and stencil operations of the negative laplacian on a grid of nodes, some of them fixed."""
+
+    def __init__(self, fixed, cell, xp):
+        self.xp = xp
+        self.shape = fixed.shape
+        self.cell = np.asarray(cell, dtype=float)
+        self.inv_h2 = 1 / self.cell ** 2
+        self.diagonal = 2 * self.inv_h2.sum()
+        self.coarsened = [False] * 3
+        self.fixed = fixed
+        self.n_free = int(np.count_nonzero(~fixed))
+        self.free_mask = xp.asarray(~fixed)
+        self.free = xp.asarray((~fixed).astype(float))
+        parity = np.indices(self.shape).sum(axis=0) % 2
+        self.colors = tuple(xp.asarray(((~fixed) & (parity == c)).astype(float)) for c in (0, 1))
+
+    def apply(self, u):
+        """Negative 7-point laplacian at free nodes, zero at fixed nodes."""
+        result = self.xp.zeros_like(u)
+        inner = result[1:-1, 1:-1, 1:-1]
+        inner += self.diagonal * u[1:-1, 1:-1, 1:-1]
+        inner -= self.inv_h2[0] * (u[2:, 1:-1, 1:-1] + u[:-2, 1:-1, 1:-1])
+        inner -= self.inv_h2[1] * (u[1:-1, 2:, 1:-1] + u[1:-1, :-2, 1:-1])
+        inner -= self.inv_h2[2] * (u[1:-1, 1:-1, 2:] + u[1:-1, 1:-1, :-2])
+        result *= self.free
+        return result
+
+    def smooth(self, e, r, colors):
+        # nodes of the same color are not neighbours, so a half sweep of gauss-seidel is a jacobi update
+        for color in colors:
+            e += color * (r - self.apply(e)) / self.diagonal
+
+    def restrict(self, r):
+        for axis in np.flatnonzero(self.coarsened):
+            fine = self.xp.moveaxis(r, axis, 0)
+            coarse = self.xp.zeros(((fine.shape[0] - 1) // 2 + 1, *fine.shape[1:]))
+            coarse[1:-1] = 0.25 * fine[1:-2:2] + 0.5 * fine[2:-1:2] + 0.25 * fine[3::2]
+            r = self.xp.moveaxis(coarse, 0, axis)
+        return r
+
+    def prolong(self, e):
+        for axis in np.flatnonzero(self.coarsened):
+            coarse = self.xp.moveaxis(e, axis, 0)
+            fine = self.xp.empty((2 * coarse.shape[0] - 1, *coarse.shape[1:]))
+            fine[::2] = coarse
+            fine[1::2] = 0.5 * (coarse[:-1] + coarse[1:])
+            e = self.xp.moveaxis(fine, 0, axis)
+        return e
+
+    def matrix(self):
+        """Sparse matrix of apply() restricted to free nodes, in C order of their indices."""
+        n = [s - 2 for s in self.shape]
+        eye = [scipy.sparse.identity(m) for m in n]
+        matrix = 0
+        for axis in range(3):
+            second_difference = scipy.sparse.diags([-1., 2., -1.], [-1, 0, 1], shape=(n[axis], n[axis]))
+            factors = [second_difference if a == axis else eye[a] for a in range(3)]
+            matrix = matrix + self.inv_h2[axis] * scipy.sparse.kron(scipy.sparse.kron(factors[0], factors[1]),
+                                                                    factors[2])
+        free = np.flatnonzero(~self.fixed[1:-1, 1:-1, 1:-1])
+        return matrix.tocsr()[free][:, free]
@@ -0,0 +1,95 @@
+import logging
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from ef.field.solvers import FieldSolver, geometry_hash
+from ef.inner_region import InnerRegion
+from ef.util.array_on_grid import ArrayOnGrid
+
+
+class FieldSolverSuperposition:
+    """
+    Solve the potential as a sum of the vacuum potential of the electrodes and the potential of space charge.
+
+    The vacuum potential is linear in the electrode voltages: the six faces of the domain boundary
+    and the inner regions. A basis potential for each electrode, with that electrode at unit voltage
+    and others grounded, is computed once with the wrapped solver and cached on disk by geometry hash.
+    Each solve then only needs the space charge potential with all electrodes grounded.
+    If boundary faces are not at uniform potentials, the wrapped solver is used directly.
+    """
+    cache_directory: Optional[str] = None  # defaults to $XDG_CACHE_HOME/ef or ~/.cache/ef
+    # face slices of the potential array in BoundaryConditionsConf order: right, left, bottom, top, near, far
+    faces = tuple(tuple(index if axis == a else slice(1, -1) for a in range(3))
+                  for axis in range(3) for index in (0, -1))
+
+    def __init__(self, solver: FieldSolver, inner_regions: Sequence[InnerRegion]):
+        self.solver = solver
+        self.mesh = solver.mesh
+        self.inner_regions: List[InnerRegion] = list(inner_regions)
+        # each node inside objects belongs to the last region containing it, as in the wrapped solver
+        self._node_owner = np.full(len(solver.nodes_in_regions), -1)
+        region_nodes = []
+        for i, region in enumerate(self.inner_regions):
+            nodes = solver.generate_nodes_in_regions([region])[0]
+            self._node_owner[np.isin(solver.nodes_in_regions, nodes)] = i
+            region_nodes.append(nodes)
+        self.basis = self.load_or_compute_basis(region_nodes)
+        self._charge_potential = ArrayOnGrid(self.mesh)
+
+    def geometry_hash(self, region_nodes) -> str:
+        return geometry_hash(type(self.solver).__name__, self.mesh, region_nodes)
+
+    def load_or_compute_basis(self, region_nodes) -> np.ndarray:
+        directory = self.cache_directory
+        if directory is None:
+            directory = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'ef')
+        path = os.path.join(directory, f"superposition_{self.geometry_hash(region_nodes)}.npy")
+        if os.path.exists(path):
+            return np.load(path)
+        basis = self.compute_basis()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, basis)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logging.warning(f"Could not cache electrode potentials in {directory}: {e}")
+        return basis
+
+    def compute_basis(self) -> np.ndarray:
+        """Solve for the interior potential of each electrode at unit voltage, faces first, then inner regions."""
+        n_electrodes = len(self.faces) + len(self.inner_regions)
+        charges = [ArrayOnGrid(self.mesh) for _ in range(n_electrodes)]
+        potentials = [ArrayOnGrid(self.mesh) for _ in range(n_electrodes)]
+        for face, potential in zip(self.faces, potentials):
+            potential._data[face] = 1.
+        potentials_in_regions = [np.zeros(len(self.solver.nodes_in_regions)) for _ in self.faces] + \
+                                [(self._node_owner == i).astype(float) for i in range(len(self.inner_regions))]
+        self.solver.eval_potentials(charges, potentials, potentials_in_regions)
+        return np.stack([p.data[1:-1, 1:-1, 1:-1] for p in potentials])
+
+    def face_voltages(self, potential: ArrayOnGrid) -> Optional[List[float]]:
+        data = potential.data
+        faces = [data[face] for face in self.faces]
+        if any(f.size and (f != f.flat[0]).any() for f in faces):
+            return None
+        return [float(f.flat[0]) if f.size else 0. for f in faces]
+
+    def vacuum_potential(self, face_voltages: Sequence[float], region_voltages: Sequence[float]) -> np.ndarray:
+        """Interior potential for given electrode voltages without space charge."""
+        voltages = np.concatenate((face_voltages, region_voltages))
+        return np.tensordot(voltages, self.basis, axes=1)
+
+    def eval_potential(self, charge_density: ArrayOnGrid, potential: ArrayOnGrid):
+        face_voltages = self.face_voltages(potential)
+        if face_voltages is None:
+            self.solver.eval_potential(charge_density, potential)
+            return
+        phi = self.vacuum_potential(face_voltages, [r.potential for r in self.inner_regions])
+        if charge_density.data.any():
+            self.solver.eval_potentials([charge_density], [self._charge_potential],
+                                        [np.zeros(len(self.solver.nodes_in_regions))])
+            phi += self._charge_potential.data[1:-1, 1:-1, 1:-1]
+        potential._data[1:-1, 1:-1, 1:-1] = potential.xp.asarray(phi)
@@ -2,8 +2,14 @@ import numpy as np
 
 from ef.util.serializable_h5 import SerializableH5
 
+CELL_OUTSIDE, CELL_INSIDE, CELL_BOUNDARY = 0, 1, 2
+
 
 class InnerRegion(SerializableH5):
+    # Least fraction of the mesh volume that must be in cells fully inside or outside the region, but within its
+    # bounding box, for index_cells to keep the cell index. Positions in these cells skip the exact shape test.
+    cell_index_min_saving = 0.5
+
     def __init__(self, name, shape, potential=0.0, total_absorbed_particles=0, total_absorbed_charge=0.0,
                  inverted=False):
         self.name = name
@@ -12,16 +18,77 @@ class InnerRegion(SerializableH5):
         self.total_absorbed_particles = total_absorbed_particles
         self.total_absorbed_charge = total_absorbed_charge
         self.inverted = inverted
+        self._cell_index = None
 
     def collide_with_particles(self, particles):
         collisions = self.check_if_points_inside(particles.positions)
+        self.absorb(collisions, particles.charge)
+        particles.remove(collisions)
+
+    def absorb(self, collisions, charge):
         c = self.shape.xp.count_nonzero(collisions)
         self.total_absorbed_particles += int(c)
-        self.total_absorbed_charge += float(c * particles.charge)
-        particles.remove(collisions)
+        self.total_absorbed_charge += float(c * charge)
+
+    def index_cells(self, mesh):
+        """
+        Classify mesh cells as fully outside, fully inside or crossing the region boundary,
+        so that only particles in boundary cells need the exact shape test.
+        """
+        xp = self.shape.xp
+        n_cells = mesh.n_nodes - 1
+        half_diagonal = np.linalg.norm(mesh.cell) / 2 * (1 + 1e-6)
+        centers = np.empty((n_cells[1], n_cells[2], 3))
+        centers[..., 1:] = mesh.origin[1:] + (np.moveaxis(np.mgrid[0:n_cells[1], 0:n_cells[2]], 0, -1) + .5) * \
+                           mesh.cell[1:]
+        index = np.empty(n_cells, np.int8)
+        for i in range(n_cells[0]):  # one plane at a time to limit memory use
+            centers[..., 0] = mesh.origin[0] + (i + .5) * mesh.cell[0]
+            try:
+                distance = self.shape.signed_distance(xp.asarray(centers))
+            except NotImplementedError:
+                self._cell_index = None
+                return
+            distance = distance.get() if hasattr(distance, 'get') else distance
+            index[i] = CELL_BOUNDARY
+            index[i][distance < -half_diagonal] = CELL_INSIDE
+            index[i][distance > half_diagonal] = CELL_OUTSIDE
+        # The bounding box prefilter of the shape is cheaper than the cell lookup,
+        # unless the lookup saves enough exact tests for uniformly spread particles.
+        lower, upper = (b.get() if hasattr(b, 'get') else b for b in self.shape.bounding_box)
+        box = np.clip(upper, mesh.origin, mesh.origin + mesh.size) - np.clip(lower, mesh.origin, mesh.origin + mesh.size)
+        box_fraction = np.prod(box) / np.prod(mesh.size)
+        boundary_fraction = np.count_nonzero(index == CELL_BOUNDARY) / index.size
+        if box_fraction - boundary_fraction < self.cell_index_min_saving:
+            self._cell_index = None
+            return
+        # pad with a layer of boundary cells, so that positions outside the mesh get the exact test
+        self._cell_index = xp.asarray(np.pad(index, 1, constant_values=CELL_BOUNDARY).ravel())
+        self._cell_strides = xp.asarray(((n_cells[1] + 2) * (n_cells[2] + 2), n_cells[2] + 2, 1))
+        self._cell_last = xp.asarray(n_cells + 1.)
+        self._cell_origin = xp.asarray(mesh.origin - mesh.cell)
+        self._inverse_cell_size = xp.asarray(1 / mesh.cell)
+
+    def check_with_cell_index(self, positions):
+        xp = self.shape.xp
+        positions = xp.asarray(positions)
+        cells = positions - self._cell_origin
+        cells *= self._inverse_cell_size
+        xp.maximum(cells, 0, out=cells)
+        xp.minimum(cells, self._cell_last, out=cells)
+        flat = cells.astype(int).dot(self._cell_strides)
+        state = self._cell_index.take(flat)
+        inside = state == CELL_INSIDE
+        boundary = xp.flatnonzero(state == CELL_BOUNDARY)
+        if len(boundary):
+            inside[boundary] = self.shape.are_positions_inside(positions[boundary])
+        return inside
 
     def check_if_points_inside(self, positions):
-        pos_inside = self.shape.are_positions_inside(positions)
+        if self._cell_index is not None and np.ndim(positions) == 2:
+            pos_inside = self.check_with_cell_index(positions)
+        else:
+            pos_inside = self.shape.are_positions_inside(positions)
         if self.inverted:
             pos_inside = self.shape.xp.logical_not(pos_inside)
         return pos_inside
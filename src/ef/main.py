@@ -10,6 +10,7 @@ import h5py
 
 from ef.config.components import OutputFileConf
 from ef.config.config import Config
+from ef.output.background import OutputWriterBackground
 from ef.output.reader import Reader
 from ef.runner import Runner
 from ef.util.inject import configure_application
@@ -20,22 +21,41 @@ def main():
     parser.add_argument("config_or_h5_file", help="config or h5 file", type=guess_input_type)
     parser.add_argument("--output-format", default="cpp", help="select output hdf5 format",
                         choices=["python", "cpp", "history", "none"])
+    parser.add_argument("--async-output", action="store_true",
+                        help="write output files in a background thread while the simulation goes on")
+    parser.add_argument("--binary-field", default="direct",
+                        help="select particle field evaluation for the binary interaction model",
+                        choices=["direct", "tree"])
+    parser.add_argument("--lazy-field-files", action="store_true",
+                        help="read external field files from disk on demand instead of loading them into memory")
     parser.add_argument("--prefix", help="customize output file prefix")
     parser.add_argument("--suffix", help="customize output file suffix")
     parser.add_argument("--solver", default="amg", help="select field solving library",
-                        choices=["amg", "amgx"])
+                        choices=["amg", "amgx", "fft", "mg", "sor"])
+    parser.add_argument("--solver-cache-dir",
+                        help="cache assembled field equations in this directory to skip assembly on later runs")
+    parser.add_argument("--electrode-superposition", action="store_true",
+                        help="precompute and cache vacuum potentials of electrodes, only solve for space charge")
+    parser.add_argument("--field-solve-threshold", type=float, default=0.,
+                        help="skip field solves while the relative change of charge density since the last solve "
+                             "is at most this, 0 to solve on every step")
+    parser.add_argument("--max-skipped-solves", type=int, default=10,
+                        help="solve the field at least once in this many steps with --field-solve-threshold")
     parser.add_argument("--backend", default="numpy", help="select acceleration library",
                         choices=["numpy", "cupy"])
 
     args = parser.parse_args()
 
     is_config, parser_or_h5_filename = args.config_or_h5_file
-    configure_application(args.solver, args.backend)
+    configure_application(args.solver, args.backend, args.binary_field, args.lazy_field_files, args.solver_cache_dir)
     if is_config:
         conf = read_conf(parser_or_h5_filename, args.prefix, args.suffix, args.output_format)
         sim = conf.make()
         writer = conf.output_file.make()
-        Runner(sim, output_writer=writer).start()
+        if args.async_output:
+            writer = OutputWriterBackground(writer)
+        Runner(sim, output_writer=writer, electrode_superposition=args.electrode_superposition,
+               field_solve_threshold=args.field_solve_threshold, max_skipped_solves=args.max_skipped_solves).start()
     else:
         print("Continuing from h5 file:", parser_or_h5_filename)
         prefix, suffix = merge_h5_prefix_suffix(parser_or_h5_filename, args.prefix, args.suffix)
@@ -43,7 +63,10 @@ def main():
         with h5py.File(parser_or_h5_filename, 'r') as h5file:
             sim = Reader.read_simulation(h5file)
         writer = OutputFileConf(prefix, suffix, args.output_format).make()
-        Runner(sim, output_writer=writer).continue_()
+        if args.async_output:
+            writer = OutputWriterBackground(writer)
+        Runner(sim, output_writer=writer, electrode_superposition=args.electrode_superposition,
+               field_solve_threshold=args.field_solve_threshold, max_skipped_solves=args.max_skipped_solves).continue_()
     del sim
     return 0
 
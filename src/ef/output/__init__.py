@@ -8,6 +8,9 @@ class OutputWriter:
     def write(self, sim: 'Simulation', name: Optional[str] = None) -> None:
         raise NotImplementedError()
 
+    def close(self) -> None:
+        pass
+
 
 class OutputWriterNone(OutputWriter):
     def write(self, sim: 'Simulation', name: Optional[str] = None) -> None:
@@ -0,0 +1,74 @@
+import copy
+import threading
+from queue import Queue
+from typing import Optional
+
+from ef.output import OutputWriter
+
+
+class OutputWriterBackground(OutputWriter):
+    """
+    Wraps another output writer to run it in a background thread, so that time stepping
+    goes on while a simulation snapshot is being written.
+    """
+
+    def __init__(self, writer: OutputWriter, max_queue_size: int = 2):
+        self.writer: OutputWriter = writer
+        self._queue: Queue = Queue(max_queue_size)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._write_queued, name='ef-output-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, sim: 'Simulation', name: Optional[str] = None) -> None:
+        self.raise_writer_error()
+        self._queue.put((self.snapshot(sim), name))  # blocks while the queue is full
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.writer.close()
+        self.raise_writer_error()
+
+    def raise_writer_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Background output writer failed") from error
+
+    @staticmethod
+    def snapshot(sim: 'Simulation') -> 'Simulation':
+        """
+        Copy the parts of the simulation state that change between time steps: particles, time grid, potential,
+        charge density, electric field and absorbed particle counters. Mesh, sources, external fields and other
+        configuration are shared with the simulation. CuPy arrays are copied on the device,
+        the writer thread moves them to host memory.
+        """
+        snapshot = copy.copy(sim)
+        snapshot.time_grid = copy.copy(sim.time_grid)
+        snapshot.particle_tracker = copy.copy(sim.particle_tracker)
+        snapshot.inner_regions = [copy.copy(region) for region in sim.inner_regions]
+        snapshot.charge_density = OutputWriterBackground.copy_array(sim.charge_density)
+        snapshot.potential = OutputWriterBackground.copy_array(sim.potential)
+        snapshot.electric_field = copy.copy(sim.electric_field)
+        snapshot.electric_field.array = OutputWriterBackground.copy_array(sim.electric_field.array)
+        snapshot.particle_arrays = [type(p)(p.ids.copy(), p.charge, p.mass, p.positions.copy(), p.momentums.copy(),
+                                            p.momentum_is_half_time_step_shifted, p.push_interval)
+                                    for p in sim.particle_arrays]
+        return snapshot
+
+    @staticmethod
+    def copy_array(array: 'ArrayOnGrid') -> 'ArrayOnGrid':
+        """Copy the data of the array, sharing the grid."""
+        result = copy.copy(array)
+        result._data = array._data.copy()  # on the device for cupy, data would be a copy in host memory
+        return result
+
+    def _write_queued(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self.writer.write(*item)
+            except BaseException as err:
+                self._error = err
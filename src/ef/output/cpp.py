@@ -26,10 +26,19 @@ class OutputWriterCpp(OutputWriterNumberedH5):
             s.export_h5(g.create_group(s.name))
         for p in sim.particle_arrays:
             s = next(s for s in sim.particle_sources if s.charge == p.charge and s.mass == p.mass)
-            p.export_h5(g[s.name])
+            if p.push_interval == sim.push_interval(p):
+                p.export_h5(g[s.name])
+            else:
+                # particles generated within the push interval of a sub-cycled species are kept apart until its end
+                sg = g[s.name].create_group('unaligned_particles')
+                for k in 'charge', 'mass':
+                    sg.attrs[k] = g[s.name].attrs[k]
+                p.export_h5(sg)
         for s in sim.particle_sources:
             if 'particle_id' not in g[s.name]:
-                ParticleArray([], s.charge, s.mass, np.empty((0, 3)), np.empty((0, 3)), True).export_h5(g[s.name])
+                ParticleArray([], s.charge, s.mass, np.empty((0, 3)), np.empty((0, 3)), True,
+                              sim.push_intervals.get(s.name, 1)).export_h5(g[s.name])
+        h5file.create_group('Subcycling').attrs['field_solve_interval'] = sim.field_solve_interval
 
         g = h5file.create_group('InnerRegions')
         g.attrs['number_of_regions'] = [len(sim.inner_regions)]
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Tuple, List
 
 import h5py
 import numpy as np
@@ -9,14 +9,20 @@ from ef.util.serializable_h5 import tree_to_hdf5
 
 
 class OutputWriterHistory(OutputWriter):
-    def __init__(self, prefix: str, suffix: str):
+    particles_per_chunk = 4096
+
+    def __init__(self, prefix: str, suffix: str, compression: Optional[str] = None):
         self.prefix: str = prefix
         self.suffix: str = suffix
+        self.compression: Optional[str] = compression
         self.h5file: h5py.File = h5py.File(f"{prefix}history{suffix}", 'w')
 
     def __del__(self):
         self.h5file.close()
 
+    def close(self) -> None:
+        self.h5file.flush()
+
     def write(self, sim: 'Simulation', name: Optional[str] = None) -> None:
         if name is not None:
             return  # don't write fields_without_particles etc.
@@ -24,14 +30,38 @@ class OutputWriterHistory(OutputWriter):
             self.init_file(sim, self.h5file)
         t = sim.time_grid.current_node // sim.time_grid.node_to_save
         h = self.h5file['history']
-        for p in sim.particle_arrays:
-            for i, id_ in enumerate(p.ids):
-                h['particles/position'][id_, t] = p.positions[i]
-                h['particles/momentum'][id_, t] = p.momentums[i]
-                h['particles/mass'][id_] = p.mass
-                h['particles/charge'][id_] = p.charge
+        ids, positions, momentums, masses, charges = self.gather_particles(sim)
+        for start, stop in self.contiguous_runs(ids):
+            s = slice(ids[start], ids[stop - 1] + 1)
+            h['particles/position'][s, t] = positions[start:stop]
+            h['particles/momentum'][s, t] = momentums[start:stop]
+            h['particles/mass'][s] = masses[start:stop]
+            h['particles/charge'][s] = charges[start:stop]
         if sim.particle_interaction_model == Model.PIC:
-            h['field/potential'][t] = sim.potential
+            h['field/potential'][t] = sim.potential.data
+
+    @staticmethod
+    def gather_particles(sim: 'Simulation') -> Tuple[np.ndarray, ...]:
+        """
+        Collect particles of all arrays into numpy arrays sorted by particle id.
+
+        :return: ids, positions, momentums, masses, charges
+        """
+        arrays = [p.dict for p in sim.particle_arrays]
+        ids = np.concatenate([a['ids'] for a in arrays] + [np.empty(0, int)])
+        order = ids.argsort(kind='stable')
+        positions = np.concatenate([a['positions'] for a in arrays] + [np.empty((0, 3))])[order]
+        momentums = np.concatenate([a['momentums'] for a in arrays] + [np.empty((0, 3))])[order]
+        masses = np.concatenate([np.full(len(a['ids']), a['mass']) for a in arrays] + [np.empty(0)])[order]
+        charges = np.concatenate([np.full(len(a['ids']), a['charge']) for a in arrays] + [np.empty(0)])[order]
+        return ids[order], positions, momentums, masses, charges
+
+    @staticmethod
+    def contiguous_runs(sorted_ids: np.ndarray) -> List[Tuple[int, int]]:
+        """Split sorted ids into runs of consecutive values, return (start, stop) index pairs of each run."""
+        breaks = np.flatnonzero(np.diff(sorted_ids) != 1) + 1
+        bounds = np.concatenate(([0], breaks, [len(sorted_ids)])) if len(sorted_ids) else []
+        return list(zip(bounds[:-1], bounds[1:]))
 
     def init_file(self, sim: 'Simulation', h5file: h5py.File) -> None:
         h = h5file.create_group('history')
@@ -42,7 +72,8 @@ class OutputWriterHistory(OutputWriter):
         h['time'] = np.linspace(0, sim.time_grid.total_time, n_time)
         h['particles/ids'] = np.arange(n_particles)
         h['particles/coordinates'] = [np.string_('x'), np.string_('y'), np.string_('z')]
-        h.create_dataset('particles/position', (n_particles, n_time, 3))
+        chunks = (min(n_particles, self.particles_per_chunk), 1, 3) if n_particles else None
+        h.create_dataset('particles/position', (n_particles, n_time, 3), chunks=chunks, compression=self.compression)
         h['particles/position'].dims[0].label = 'id'
         h['particles/position'].dims.create_scale(h['particles/ids'], 'ids')
         h['particles/position'].dims[0].attach_scale(h['particles/ids'])
@@ -52,7 +83,7 @@ class OutputWriterHistory(OutputWriter):
         h['particles/position'].dims[2].label = 'coordinates'
         h['particles/position'].dims.create_scale(h['particles/coordinates'], 'coordinates')
         h['particles/position'].dims[2].attach_scale(h['particles/coordinates'])
-        h.create_dataset('particles/momentum', (n_particles, n_time, 3))
+        h.create_dataset('particles/momentum', (n_particles, n_time, 3), chunks=chunks, compression=self.compression)
         h['particles/momentum'].dims[0].label = 'id'
         h['particles/momentum'].dims.create_scale(h['particles/ids'], 'ids')
         h['particles/momentum'].dims[0].attach_scale(h['particles/ids'])
@@ -71,12 +102,13 @@ class OutputWriterHistory(OutputWriter):
         h['particles/charge'].dims.create_scale(h['particles/ids'], 'ids')
         h['particles/charge'].dims[0].attach_scale(h['particles/ids'])
         if sim.particle_interaction_model == Model.PIC:
-            h.create_dataset('field/potential', (n_time, *sim.potential.n_nodes))
+            h.create_dataset('field/potential', (n_time, *sim.potential.n_nodes), chunks=(1, *sim.potential.n_nodes),
+                             compression=self.compression)
             h['field/potential'].dims[0].label = 'time'
             h['field/potential'].dims.create_scale(h['time'], 'time')
             h['field/potential'].dims[0].attach_scale(h['time'])
             for i, c in enumerate('xyz'):
-                h[f'field/{c}'] = np.linspace(0, sim.electric_field.size[i], sim.electric_field.n_nodes[i])
+                h[f'field/{c}'] = np.linspace(0, sim.mesh.size[i], sim.mesh.n_nodes[i])
                 h['field/potential'].dims[i + 1].label = c
                 h['field/potential'].dims.create_scale(h[f'field/{c}'], c)
                 h['field/potential'].dims[i + 1].attach_scale(h[f'field/{c}'])
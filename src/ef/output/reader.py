@@ -48,7 +48,12 @@ class Reader:
     def import_from_h5(h5file: h5py.File) -> Simulation:
         fields = [Field.import_h5(g) for g in h5file['ExternalFields'].values()]
         sources = [ParticleSource.import_h5(g) for g in h5file['ParticleSources'].values()]
-        particles = [ParticleArray.import_h5(g) for g in h5file['ParticleSources'].values()]
+        particles = [ParticleArray.import_h5(sg) for g in h5file['ParticleSources'].values()
+                     for sg in ([g, g['unaligned_particles']] if 'unaligned_particles' in g else [g])]
+        push_intervals = {name: int(g.attrs['push_interval']) for name, g in h5file['ParticleSources'].items()
+                          if g.attrs.get('push_interval', 1) != 1}
+        field_solve_interval = int(h5file['Subcycling'].attrs['field_solve_interval']) \
+            if 'Subcycling' in h5file else 1
         # cupy max has no `initial` argument
         max_id = int(max([(p.ids.get() if hasattr(p.ids, 'get') else p.ids).max(initial=-1) for p in particles], default=-1))
         g = h5file['SpatialMesh']
@@ -67,5 +72,6 @@ class Reader:
             particle_interaction_model=Model[
                 h5file['ParticleInteractionModel'].attrs['particle_interaction_model'].decode('utf8')
             ],
-            particle_sources=sources, particle_arrays=particles, particle_tracker=ParticleTracker(max_id)
+            particle_sources=sources, particle_arrays=particles, particle_tracker=ParticleTracker(max_id),
+            field_solve_interval=field_solve_interval, push_intervals=push_intervals
         )
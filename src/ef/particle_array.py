@@ -1,3 +1,6 @@
+import logging
+from functools import lru_cache
+
 import inject
 import numpy
 from numpy.core._multiarray_umath import normalize_axis_index
@@ -9,51 +12,190 @@ from ef.util.serializable_h5 import SerializableH5
 
 class ParticleArray(SerializableH5):
     xp = inject.attr(numpy)
+    field_tile_size = 1024  # sources and targets per block of the pairwise field sum
+    boris_engine = 'numpy'  # or 'numba', which falls back to numpy if numba is missing or arrays are not numpy
 
     @safe_default_inject
-    def __init__(self, ids, charge, mass, positions, momentums, momentum_is_half_time_step_shifted=False):
-        self.ids = self.xp.asarray(ids)
+    def __init__(self, ids, charge, mass, positions, momentums, momentum_is_half_time_step_shifted=False,
+                 push_interval=1):
+        self._size = 0
+        self.ids = self.xp.asarray(ids).reshape(-1)
         self.charge = charge
         self.mass = mass
-        self.positions = self.xp.asarray(positions).reshape((-1, 3))
-        self.momentums = self.xp.asarray(momentums).reshape((-1, 3))
+        self.positions = self.xp.asarray(positions, dtype=float).reshape((-1, 3))
+        self.momentums = self.xp.asarray(momentums, dtype=float).reshape((-1, 3))
         self.momentum_is_half_time_step_shifted = momentum_is_half_time_step_shifted
+        self.push_interval = push_interval  # time steps per push, momentums lag by half of that
+
+    # Particles are stored in buffers that may be longer than the number of particles.
+    # The first `_size` rows are alive, the rest is spare capacity for particles appended later.
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @ids.setter
+    def ids(self, value):
+        self._set_buffer('_ids', self.xp.asarray(value))
+
+    @property
+    def positions(self):
+        return self._positions[:self._size]
+
+    @positions.setter
+    def positions(self, value):
+        self._set_buffer('_positions', self.xp.asarray(value))
+
+    @property
+    def momentums(self):
+        return self._momentums[:self._size]
+
+    @momentums.setter
+    def momentums(self, value):
+        self._set_buffer('_momentums', self.xp.asarray(value))
+
+    @property
+    def capacity(self):
+        return min(len(self._ids), len(self._positions), len(self._momentums))
+
+    def _set_buffer(self, name, value):
+        buffer = vars(self).get(name)
+        if buffer is not None and len(value) == self._size:
+            buffer[:self._size] = value
+        else:
+            setattr(self, name, value)
+            self._size = len(value)
 
     @property
     def dict(self):
-        d = super().dict
+        d = {'ids': self.ids, 'charge': self.charge, 'mass': self.mass, 'positions': self.positions,
+             'momentums': self.momentums,
+             'momentum_is_half_time_step_shifted': self.momentum_is_half_time_step_shifted,
+             'push_interval': self.push_interval}
         if self.xp is not numpy:
             d['ids'] = d['ids'].get()
             d['positions'] = d['positions'].get()
             d['momentums'] = d['momentums'].get()
         return d
 
+    def reserve(self, capacity):
+        """Grow the buffers to hold at least `capacity` particles, at least doubling their size."""
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity)
+        for name in '_ids', '_positions', '_momentums':
+            old = getattr(self, name)
+            new = self.xp.empty((capacity,) + old.shape[1:], old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def append(self, particles):
+        n = self._size + len(particles.ids)
+        self.reserve(n)
+        self._ids[self._size:n] = particles.ids
+        self._positions[self._size:n] = particles.positions
+        self._momentums[self._size:n] = particles.momentums
+        self._size = n
+
     def keep(self, mask):
         mask = self.xp.asarray(mask)
-        self.ids = self.ids[mask]
-        self.positions = self.positions[mask]
-        self.momentums = self.momentums[mask]
+        n = int(self.xp.count_nonzero(mask))
+        for name in '_ids', '_positions', '_momentums':
+            buffer = getattr(self, name)
+            buffer[:n] = buffer[:self._size][mask]
+        self._size = n
 
     def remove(self, mask):
+        """Remove masked particles, filling the gaps with the last alive particles. Does not preserve the order."""
         mask = self.xp.asarray(mask)
-        self.keep(self.xp.logical_not(mask))
+        removed = self.xp.flatnonzero(mask)
+        n = self._size - len(removed)
+        if n == self._size:
+            return
+        gaps = removed[removed < n]
+        tail = n + self.xp.flatnonzero(self.xp.logical_not(mask[n:]))
+        for name in '_ids', '_positions', '_momentums':
+            buffer = getattr(self, name)
+            buffer[gaps] = buffer[tail]
+        self._size = n
 
     def update_positions(self, dt):
-        self.positions += dt / self.mass * self.momentums
+        positions = self.positions
+        positions += dt / self.mass * self.momentums
 
     def field_at_points(self, points):
-        diff = self.xp.asarray(points) - self.positions[:, self.xp.newaxis, :]  # (m, n, 3)
-        dist = self.xp.linalg.norm(diff, axis=-1)  # (m, n)
-        dist[dist == 0] = 1.
-        force = diff / (dist ** 3)[..., self.xp.newaxis]  # (m, n, 3)
-        return self.charge * self.xp.sum(force, axis=0)  # (n, 3)
+        points = self.xp.asarray(points, dtype=float).reshape((-1, 3))
+        field = self.xp.zeros_like(points)  # (n, 3)
+        tile = self.field_tile_size
+        for i in range(0, len(points), tile):
+            targets = points[i:i + tile]
+            for j in range(0, len(self.positions), tile):
+                diff = targets - self.positions[j:j + tile, self.xp.newaxis, :]  # (tile, tile, 3)
+                dist = self.xp.linalg.norm(diff, axis=-1)  # (tile, tile)
+                dist[dist == 0] = 1.
+                dist **= 3
+                diff /= dist[..., self.xp.newaxis]
+                field[i:i + tile] += diff.sum(axis=0)
+        field *= self.charge
+        return field
 
     def boris_update_momentums(self, dt, total_el_field, total_mgn_field):
-        self.momentums = self._boris_update_momentums(self.charge, self.mass, self.momentums, dt, total_el_field,
-                                                      total_mgn_field)
+        """
+        Boris update of momentums in place, with the arithmetic of _boris_update_momentums
+        but without temporary arrays: intermediate results go to work arrays reused between steps.
+        """
+        xp = self.xp
+        momentums = self.momentums
+        el_field = xp.asarray(total_el_field, dtype=float)
+        mgn_field = xp.asarray(total_mgn_field, dtype=float)
+        q_quote = dt * self.charge / self.mass / 2.0
+        if self.boris_engine not in ('numpy', 'numba'):
+            raise ValueError("Unknown Boris pusher engine: {}".format(self.boris_engine))
+        if self.boris_engine == 'numba' and xp is numpy:
+            kernel = numba_boris_kernel()
+            if kernel is not None:
+                kernel(momentums, numpy.broadcast_to(el_field, momentums.shape),
+                       numpy.broadcast_to(mgn_field, momentums.shape), q_quote, q_quote / speed_of_light, self.mass)
+                return
+        half_el_force, u, h, tmp, rotation, norm = self._boris_work_arrays(len(momentums))
+        xp.multiply(el_field, q_quote, out=half_el_force)
+        xp.divide(momentums, self.mass, out=u)
+        u += half_el_force  # v_minus
+        xp.multiply(mgn_field, q_quote / speed_of_light, out=h)  # rotation vector t
+        self._cross_into(u, h, tmp, norm)
+        tmp += u  # v_prime
+        xp.multiply(h, h, out=rotation)
+        xp.sum(rotation, -1, out=norm)
+        norm += 1.0
+        xp.divide(2.0, norm, out=norm)
+        h *= norm[:, xp.newaxis]  # s = 2t / (1 + t**2)
+        self._cross_into(tmp, h, rotation, norm)
+        u += rotation  # v_plus
+        u += half_el_force
+        xp.multiply(u, self.mass, out=momentums)
 
     def boris_update_momentum_no_mgn(self, dt, total_el_field):
-        self.momentums += self.charge * dt * self.xp.asarray(total_el_field)
+        momentums = self.momentums
+        force = self._boris_work_arrays(len(momentums))[0]
+        self.xp.multiply(self.xp.asarray(total_el_field), self.charge * dt, out=force)
+        momentums += force
+
+    def _boris_work_arrays(self, n):
+        """Five (n, 3) arrays and one (n,) array, grown with the particle buffers and kept between steps."""
+        work = vars(self).get('_boris_work')
+        if work is None or len(work[-1]) < n:
+            capacity = max(n, self.capacity)
+            work = [self.xp.empty((capacity, 3)) for _ in range(5)] + [self.xp.empty(capacity)]
+            self._boris_work = work
+        return [a[:n] for a in work]
+
+    @classmethod
+    def _cross_into(cls, a, b, out, tmp):
+        """Cross product of (n, 3) arrays into out, in the order of operations of cross, tmp is an (n,) work array."""
+        for i, j, k in (0, 1, 2), (1, 2, 0), (2, 0, 1):
+            cls.xp.multiply(a[:, j], b[:, k], out=out[:, i])
+            cls.xp.multiply(a[:, k], b[:, j], out=tmp)
+            out[:, i] -= tmp
 
     @classmethod
     def import_h5(cls, g):
@@ -62,11 +204,12 @@ class ParticleArray(SerializableH5):
         mom = cls.xp.stack(tuple(cls.xp.asarray(g['momentum_{}'.format(c)][()]) for c in 'xyz'), -1)
         return cls(ids=g['particle_id'][()], charge=float(ga['charge']), mass=float(ga['mass']),
                    positions=pos, momentums=mom,
-                   momentum_is_half_time_step_shifted=True)
+                   momentum_is_half_time_step_shifted=True, push_interval=int(ga.get('push_interval', 1)))
 
     def export_h5(self, g):
         g['particle_id'] = self.dict['ids']
         g.attrs['max_id'] = self.dict['ids'].max(initial=-1)
+        g.attrs['push_interval'] = self.push_interval
         for i, c in enumerate('xyz'):
             g['position_{}'.format(c)] = self.dict['positions'][:, i]
             g['momentum_{}'.format(c)] = self.dict['momentums'][:, i]
@@ -171,3 +314,33 @@ class ParticleArray(SerializableH5):
                 cp2 -= a1 * b0
 
         return cls.xp.moveaxis(cp, -1, axisc)
+
+
+@lru_cache(maxsize=None)
+def numba_boris_kernel():
+    """Compile the Boris update loop with numba on first use, None if numba is not installed."""
+    try:
+        import numba
+    except ImportError:
+        logging.warning("numba is not installed, the Boris pusher falls back to numpy")
+        return None
+
+    @numba.njit
+    def boris_kernel(momentums, el_field, mgn_field, q_quote, h_factor, mass):
+        # same operations in the same order as the numpy version, so that results are identical
+        for n in range(momentums.shape[0]):
+            e0, e1, e2 = el_field[n, 0] * q_quote, el_field[n, 1] * q_quote, el_field[n, 2] * q_quote
+            u0 = momentums[n, 0] / mass + e0
+            u1 = momentums[n, 1] / mass + e1
+            u2 = momentums[n, 2] / mass + e2
+            h0, h1, h2 = mgn_field[n, 0] * h_factor, mgn_field[n, 1] * h_factor, mgn_field[n, 2] * h_factor
+            t0 = (u1 * h2 - u2 * h1) + u0
+            t1 = (u2 * h0 - u0 * h2) + u1
+            t2 = (u0 * h1 - u1 * h0) + u2
+            f = 2.0 / ((h0 * h0 + h1 * h1 + h2 * h2) + 1.0)
+            s0, s1, s2 = h0 * f, h1 * f, h2 * f
+            momentums[n, 0] = (u0 + (t1 * s2 - t2 * s1) + e0) * mass
+            momentums[n, 1] = (u1 + (t2 * s0 - t0 * s2) + e1) * mass
+            momentums[n, 2] = (u2 + (t0 * s1 - t1 * s0) + e2) * mass
+
+    return boris_kernel
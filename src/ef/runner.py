@@ -1,26 +1,47 @@
+from typing import List, Optional, Sequence
+
 import inject
+import numpy as np
 
 from ef.field.solvers import FieldSolver
+from ef.field.solvers.adaptive import FieldSolverAdaptive
 from ef.field.solvers.pyamg import FieldSolverPyamg
-from ef.output import OutputWriterNone
+from ef.field.solvers.superposition import FieldSolverSuperposition
+from ef.output import OutputWriter, OutputWriterNone
 from ef.simulation import Simulation
 
 
 class Runner:
     @inject.params(simulation=Simulation, field_solver_class=FieldSolver, output_writer=OutputWriterNone)
-    def __init__(self, simulation, field_solver_class=None, output_writer=OutputWriterNone()):
+    def __init__(self, simulation, field_solver_class=None, output_writer=OutputWriterNone(),
+                 electrode_superposition=False, field_solve_threshold=0., max_skipped_solves=10):
+        """
+        :param field_solve_threshold: skip potential solves while the relative change of charge density
+            since the last solve is at most this, but no more than max_skipped_solves in a row; 0 to always solve
+        """
         self.output_writer = output_writer
         self.simulation = simulation
         self.solver = field_solver_class(simulation.mesh, simulation.inner_regions)
+        self.superposition: Optional[FieldSolverSuperposition] = None
+        if electrode_superposition:
+            self.solver = self.superposition = FieldSolverSuperposition(self.solver, simulation.inner_regions)
+        if field_solve_threshold > 0:
+            self.solver = FieldSolverAdaptive(self.solver, field_solve_threshold, max_skipped_solves)
 
     def start(self):
-        self.eval_and_write_fields_without_particles()
-        self.simulation.generate_and_prepare_particles(self.solver, initial=True)
-        self.write()
-        self.run()
+        try:
+            self.eval_and_write_fields_without_particles()
+            self.simulation.generate_and_prepare_particles(self.solver, initial=True)
+            self.write()
+            self.run()
+        finally:
+            self.output_writer.close()
 
     def continue_(self):
-        self.run()
+        try:
+            self.run()
+        finally:
+            self.output_writer.close()
 
     def run(self):
         total_time_iterations = self.simulation.time_grid.total_nodes - 1
@@ -30,6 +51,8 @@ class Runner:
                 i, i + 1, total_time_iterations), end='')
             self.simulation.advance_one_time_step(self.solver)
             self.write_step_to_save()
+        if isinstance(self.solver, FieldSolverAdaptive):
+            print("\nSolved the field on {:d} of {:d} steps".format(sum(self.solver.solved), len(self.solver.solved)))
 
     def write_step_to_save(self):
         if self.simulation.time_grid.should_save:
@@ -42,7 +65,102 @@ class Runner:
 
     def eval_and_write_fields_without_particles(self):
         self.simulation.charge_density.reset()
-        self.solver.eval_potential(self.simulation.charge_density, self.simulation.potential)
+        potential = self.simulation.potential
+        face_voltages = None if self.superposition is None else self.superposition.face_voltages(potential)
+        if face_voltages is None:
+            self.solver.eval_potential(self.simulation.charge_density, potential)
+        else:
+            # without space charge the potential is the sum of precomputed electrode potentials
+            phi = self.superposition.vacuum_potential(face_voltages,
+                                                      [r.potential for r in self.simulation.inner_regions])
+            potential._data[1:-1, 1:-1, 1:-1] = potential.xp.asarray(phi)
         self.simulation.potential.gradient(self.simulation.electric_field.array)
         print("Writing initial fields to file")
-        self.output_writer.write(self.simulation, "fieldsWithoutParticles")
\ No newline at end of file
+        self.output_writer.write(self.simulation, "fieldsWithoutParticles")
+
+
+class BatchRunner:
+    """
+    Run variants of a simulation in lockstep, solving their potentials as one batch with a shared field solver.
+
+    Simulations may differ in boundary and inner region potentials, particle sources and external fields,
+    but must have the same mesh, time grid and inner region shapes.
+    """
+
+    @inject.params(field_solver_class=FieldSolver)
+    def __init__(self, simulations: Sequence[Simulation], field_solver_class=None,
+                 output_writers: Optional[Sequence[OutputWriter]] = None):
+        self.simulations: List[Simulation] = list(simulations)
+        self.output_writers: List[OutputWriter] = [OutputWriterNone() for _ in self.simulations] \
+            if output_writers is None else list(output_writers)
+        first = self.simulations[0]
+        for sim in self.simulations[1:]:
+            if any(not np.array_equal(getattr(sim.mesh, a), getattr(first.mesh, a))
+                   for a in ('size', 'n_nodes', 'origin')):
+                raise ValueError("Simulations in a batch must have the same mesh")
+            if sim.time_grid.dict != first.time_grid.dict:
+                raise ValueError("Simulations in a batch must have the same time grid")
+        self.solver = field_solver_class(first.mesh, first.inner_regions)
+        self._potentials_in_regions = []
+        for sim in self.simulations:
+            nodes, potential = self.solver.generate_nodes_in_regions(sim.inner_regions)
+            if not np.array_equal(nodes, self.solver.nodes_in_regions):
+                raise ValueError("Simulations in a batch must have the same inner region shapes")
+            self._potentials_in_regions.append(potential)
+
+    @classmethod
+    def from_configs(cls, configs: Sequence['Config']) -> 'BatchRunner':
+        return cls([c.make() for c in configs], output_writers=[c.output_file.make() for c in configs])
+
+    def start(self):
+        try:
+            self.eval_and_write_fields_without_particles()
+            self.generate_and_prepare_particles(initial=True)
+            self.write()
+            self.run()
+        finally:
+            for writer in self.output_writers:
+                writer.close()
+
+    def run(self):
+        time_grid = self.simulations[0].time_grid
+        total_time_iterations = time_grid.total_nodes - 1
+        for i in range(time_grid.current_node, total_time_iterations):
+            print("\rTime step from {:d} to {:d} of {:d}".format(
+                i, i + 1, total_time_iterations), end='')
+            for sim in self.simulations:
+                sim.push_particles()
+            self.generate_and_prepare_particles()
+            for sim in self.simulations:
+                sim.time_grid.update_to_next_step()
+            if time_grid.should_save:
+                print()
+                self.write()
+
+    def generate_and_prepare_particles(self, initial=False):
+        for sim in self.simulations:
+            sim.generate_particles_and_charge_density(initial)
+        solve = [sim.should_solve_field(initial) for sim in self.simulations]
+        self.eval_potentials([i for i, s in enumerate(solve) if s])
+        for sim, s in zip(self.simulations, solve):
+            sim.prepare_particles(update_field=s, initial=initial)
+
+    def eval_potentials(self, indices):
+        if indices:
+            self.solver.eval_potentials([self.simulations[i].charge_density for i in indices],
+                                        [self.simulations[i].potential for i in indices],
+                                        [self._potentials_in_regions[i] for i in indices])
+
+    def write(self):
+        print("Writing step {} to file".format(self.simulations[0].time_grid.current_node))
+        for sim, writer in zip(self.simulations, self.output_writers):
+            writer.write(sim)
+
+    def eval_and_write_fields_without_particles(self):
+        for sim in self.simulations:
+            sim.charge_density.reset()
+        self.eval_potentials(list(range(len(self.simulations))))
+        print("Writing initial fields to file")
+        for sim, writer in zip(self.simulations, self.output_writers):
+            sim.potential.gradient(sim.electric_field.array)
+            writer.write(sim, "fieldsWithoutParticles")
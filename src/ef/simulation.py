@@ -1,12 +1,14 @@
-from collections import defaultdict
-from typing import List, Optional, Sequence, Type
+from typing import Dict, List, Optional, Sequence, Type
 
 import inject
 
 import ef.config.components.shapes as shapes
 from ef.field import FieldZero, FieldSum, Field
+from ef.field.evaluator import FieldEvaluator
+from ef.field.expression import FieldExpression
 from ef.field.on_grid import FieldOnGrid
 from ef.field.particles import FieldParticles
+from ef.field.uniform import FieldUniform
 from ef.inner_region import InnerRegion
 from ef.meshgrid import MeshGrid
 from ef.particle_array import ParticleArray
@@ -26,6 +28,7 @@ def is_trivial(potential: ArrayOnGrid, inner_regions: List[InnerRegion]):
 
 class Simulation(SerializableH5):
     array_class: Type[ArrayOnGrid] = inject.attr(ArrayOnGrid)
+    binary_field_class: Type[FieldParticles] = inject.attr(FieldParticles)
 
     def __init__(self, time_grid: TimeGrid,
                  mesh: MeshGrid,
@@ -38,7 +41,10 @@ class Simulation(SerializableH5):
                  potential: Optional[ArrayOnGrid] = None,
                  electric_field: Optional[FieldOnGrid] = None,
                  particle_tracker: Optional[ParticleTracker] = None,
-                 particle_arrays: Sequence[ParticleArray] = ()):
+                 particle_arrays: Sequence[ParticleArray] = (),
+                 sample_static_fields: str = 'none',
+                 field_solve_interval: int = 1,
+                 push_intervals: Optional[Dict[str, int]] = None):
         super().__init__()
         self.time_grid: TimeGrid = time_grid
         self.mesh: MeshGrid = mesh
@@ -48,15 +54,27 @@ class Simulation(SerializableH5):
             if electric_field is None else electric_field
         self._domain = InnerRegion('simulation_domain', shapes.Box(0, mesh.size), inverted=True)
         self.inner_regions: List[InnerRegion] = list(inner_regions)
+        for region in self.inner_regions:
+            region.index_cells(mesh)
         self.particle_sources: List[ParticleSource] = list(particle_sources)
         self.electric_fields: Field = FieldSum.factory(electric_fields, 'electric')
         self.magnetic_fields: Field = FieldSum.factory(magnetic_fields, 'magnetic')
+        self.sample_static_fields: str = sample_static_fields
+        self.field_solve_interval: int = field_solve_interval
+        self.push_intervals: Dict[str, int] = {} if push_intervals is None else dict(push_intervals)
+        sources = {src.name: src for src in self.particle_sources}
+        unknown = set(self.push_intervals) - set(sources)
+        if unknown:
+            raise ValueError("Push intervals set for unknown particle sources: {}".format(sorted(unknown)))
+        # sub-cycling is a property of a species, particle arrays are matched to sources by charge and mass
+        self._species_push_intervals = {(sources[name].charge, sources[name].mass): interval
+                                        for name, interval in self.push_intervals.items()}
         self.particle_interaction_model: Model = particle_interaction_model
         self.particle_arrays: List[ParticleArray] = list(particle_arrays)
         self.consolidate_particle_arrays()
 
         if self.particle_interaction_model == Model.binary:
-            self._dynamic_field = FieldParticles('binary_particle_field', self.particle_arrays)
+            self._dynamic_field = self.binary_field_class('binary_particle_field', self.particle_arrays)
             if not is_trivial(self.potential, self.inner_regions):
                 self._dynamic_field += self.electric_field
         elif self.particle_interaction_model == Model.noninteracting:
@@ -68,6 +86,9 @@ class Simulation(SerializableH5):
             self._dynamic_field = self.electric_field
 
         self.particle_tracker = ParticleTracker() if particle_tracker is None else particle_tracker
+        self._field_composition = ()
+        self._field_evaluator: Optional[FieldEvaluator] = None
+        self.compose_fields()
 
     @property
     def dict(self) -> dict:
@@ -89,62 +110,138 @@ class Simulation(SerializableH5):
         self.boris_integration(self.time_grid.time_step_size)
 
     def generate_and_prepare_particles(self, field_solver, initial=False):
+        self.generate_particles_and_charge_density(initial)
+        solve = self.should_solve_field(initial)
+        if solve:
+            field_solver.eval_potential(self.charge_density, self.potential)
+        self.prepare_particles(update_field=solve, initial=initial)
+
+    def should_solve_field(self, initial=False) -> bool:
+        """Whether to solve the potential for the particles of the step the time grid is about to advance to."""
+        if self.particle_interaction_model != Model.PIC:
+            return False
+        return initial or (self.time_grid.current_node + 1) % self.field_solve_interval == 0
+
+    def generate_particles_and_charge_density(self, initial=False):
         self.generate_valid_particles(initial)
         if self.particle_interaction_model == Model.PIC:
             self.eval_charge_density()
-            field_solver.eval_potential(self.charge_density, self.potential)
+
+    def prepare_particles(self, update_field=True, initial=False):
+        # the potential must be solved for the current charge density before this, unless the field is kept
+        if self.particle_interaction_model == Model.PIC and update_field:
             self.potential.gradient(self.electric_field.array)
-        self.shift_new_particles_velocities_half_time_step_back()
+        self.shift_new_particles_velocities_half_time_step_back(initial)
         self.consolidate_particle_arrays()
 
     def generate_valid_particles(self, initial=False):
         # First generate then remove.
         # This allows for overlap of source and inner region.
         self.generate_new_particles(initial)
-        self.apply_domain_boundary_conditions()
-        self.remove_particles_inside_inner_regions()
+        self.remove_absorbed_particles()
+
+    def push_interval(self, particles: ParticleArray) -> int:
+        """Push interval of the species of the particles, as set in the config."""
+        return self._species_push_intervals.get((particles.charge, particles.mass), 1)
 
     def boris_integration(self, dt):
+        next_node = self.time_grid.current_node + 1
         for particles in self.particle_arrays:
+            # an array is pushed over its whole interval at once, at the end of the interval,
+            # so that its positions are at the time of the grid on every multiple of the interval
+            interval = particles.push_interval
+            if next_node % interval:
+                continue
             total_el_field, total_mgn_field = \
                 self.compute_total_fields_at_positions(particles.positions)
             if self.magnetic_fields != 0 and total_mgn_field.any():
-                particles.boris_update_momentums(dt, total_el_field, total_mgn_field)
+                particles.boris_update_momentums(dt * interval, total_el_field, total_mgn_field)
             else:
-                particles.boris_update_momentum_no_mgn(dt, total_el_field)
-            particles.update_positions(dt)
+                particles.boris_update_momentum_no_mgn(dt * interval, total_el_field)
+            particles.update_positions(dt * interval)
 
-    def prepare_boris_integration(self, minus_half_dt):
-        # todo: place newly generated particle_arrays into separate buffer
+    def prepare_boris_integration(self, minus_half_dt, node=0):
+        """
+        Shift momentums of new particles, which are at time step `node`, back by half of their push interval.
+
+        Particles of a sub-cycled species generated within its interval are pushed on every step
+        in an array of their own, and join the array of the species at the end of the interval.
+        """
         for particles in self.particle_arrays:
-            if not particles.momentum_is_half_time_step_shifted:
-                total_el_field, total_mgn_field = \
-                    self.compute_total_fields_at_positions(particles.positions)
-                if self.magnetic_fields != 0 and total_mgn_field.any():
-                    particles.boris_update_momentums(minus_half_dt, total_el_field, total_mgn_field)
-                else:
-                    particles.boris_update_momentum_no_mgn(minus_half_dt, total_el_field)
-                particles.momentum_is_half_time_step_shifted = True
+            interval = self.push_interval(particles)
+            target = interval if node % interval == 0 else 1
+            if particles.momentum_is_half_time_step_shifted:
+                if particles.push_interval >= target:
+                    continue
+                shift = minus_half_dt * (target - particles.push_interval)
+            else:
+                shift = minus_half_dt * target
+            total_el_field, total_mgn_field = \
+                self.compute_total_fields_at_positions(particles.positions)
+            if self.magnetic_fields != 0 and total_mgn_field.any():
+                particles.boris_update_momentums(shift, total_el_field, total_mgn_field)
+            else:
+                particles.boris_update_momentum_no_mgn(shift, total_el_field)
+            particles.momentum_is_half_time_step_shifted = True
+            particles.push_interval = target
+
+    def presample_static_fields(self, fields: Field) -> Field:
+        """
+        Combine static external fields into a single field on the simulation mesh, according to sample_static_fields:
+        'none' keeps the fields as they are, 'grid' samples fields given on grids,
+        'all' also samples uniform and time-independent expression fields.
+        Sampling is skipped when it would not reduce the number of fields to evaluate.
+        """
+        if self.sample_static_fields == 'none':
+            return fields
+        fields_list = fields.fields if type(fields) is FieldSum else [fields]
+        analytic = self.sample_static_fields == 'all'
+        static = [f for f in fields_list if isinstance(f, FieldOnGrid) or
+                  analytic and (isinstance(f, FieldUniform) or
+                                isinstance(f, FieldExpression) and f.is_time_independent)]
+        if len(static) < 2 and not any(isinstance(f, FieldExpression) for f in static):
+            return fields
+        xp = self.array_class.xp
+        nodes = xp.asarray(self.mesh.node_coordinates.reshape((-1, 3)))
+        total = xp.zeros(nodes.shape)
+        for f in static:
+            total += xp.asarray(f.get_at_points(nodes, 0.))
+        array = self.array_class(self.mesh, 3, total.reshape((*self.mesh.n_nodes, 3)))
+        sampled = FieldOnGrid('sampled_static_' + fields.electric_or_magnetic, fields.electric_or_magnetic, array)
+        return FieldSum.factory([sampled] + [f for f in fields_list if f not in static], fields.electric_or_magnetic)
+
+    def compose_fields(self) -> FieldEvaluator:
+        """Combine external and particle fields for evaluation, rebuilding only when the set of fields changes."""
+        composition = (self.electric_fields, self.magnetic_fields, self._dynamic_field)
+        if len(composition) != len(self._field_composition) or \
+                any(a is not b for a, b in zip(composition, self._field_composition)):
+            electric = self.presample_static_fields(self.electric_fields)
+            magnetic = self.presample_static_fields(self.magnetic_fields)
+            self._field_evaluator = FieldEvaluator(self.mesh, electric + self._dynamic_field, magnetic)
+            self._field_composition = composition
+        return self._field_evaluator
 
     def compute_total_fields_at_positions(self, positions):
-        total_el_field = self.electric_fields + self._dynamic_field
-        return total_el_field.get_at_points(positions, self.time_grid.current_time), \
-               self.magnetic_fields.get_at_points(positions, self.time_grid.current_time)
+        return self.compose_fields().get_at_points(positions, self.time_grid.current_time)
 
-    def shift_new_particles_velocities_half_time_step_back(self):
+    def shift_new_particles_velocities_half_time_step_back(self, initial=False):
         minus_half_dt = -1.0 * self.time_grid.time_step_size / 2.0
-        self.prepare_boris_integration(minus_half_dt)
-
-    def apply_domain_boundary_conditions(self):
-        for arr in self.particle_arrays:
-            self._domain.collide_with_particles(arr)
-        self.particle_arrays = [a for a in self.particle_arrays if len(a.ids) > 0]
+        # particles are prepared for the step the time grid is about to advance to, initial ones for the current one
+        node = self.time_grid.current_node + (0 if initial else 1)
+        self.prepare_boris_integration(minus_half_dt, node)
 
-    def remove_particles_inside_inner_regions(self):
-        for region in self.inner_regions:
-            for p in self.particle_arrays:
-                region.collide_with_particles(p)
-            self.particle_arrays = [a for a in self.particle_arrays if len(a.ids) > 0]
+    def remove_absorbed_particles(self):
+        # Each particle is absorbed by the first region it hits: domain boundary, then inner regions in order
+        regions = [self._domain] + self.inner_regions
+        for p in self.particle_arrays:
+            absorbed = p.xp.zeros(len(p.ids), dtype=bool)
+            for region in regions:
+                collisions = region.check_if_points_inside(p.positions)
+                collisions &= ~absorbed
+                region.absorb(collisions, p.charge)
+                absorbed |= collisions
+            p.remove(absorbed)
+        self.particle_arrays[:] = [a for a in self.particle_arrays if len(a.ids) > 0]
 
     def generate_new_particles(self, initial=False):
         for src in self.particle_sources:
@@ -154,14 +251,12 @@ class Simulation(SerializableH5):
                 self.particle_arrays.append(particles)
 
     def consolidate_particle_arrays(self):
-        particles_by_type = defaultdict(list)
+        # Keep one array per species and push interval, append the others to it in place
+        particles_by_type = {}
         for p in self.particle_arrays:
-            particles_by_type[(p.mass, p.charge, p.momentum_is_half_time_step_shifted)].append(p)
-        self.particle_arrays = []
-        for k, v in particles_by_type.items():
-            mass, charge, shifted = k
-            ids = v[0].xp.concatenate([p.ids for p in v])
-            positions = v[0].xp.concatenate([p.positions for p in v])
-            momentums = v[0].xp.concatenate([p.momentums for p in v])
-            if len(ids):
-                self.particle_arrays.append(ParticleArray(ids, charge, mass, positions, momentums, shifted))
+            key = (p.mass, p.charge, p.momentum_is_half_time_step_shifted, p.push_interval)
+            if key in particles_by_type:
+                particles_by_type[key].append(p)
+            elif len(p.ids):
+                particles_by_type[key] = p
+        self.particle_arrays[:] = particles_by_type.values()
@@ -1,28 +1,34 @@
 from typing import Optional
 
 import numpy
-from scipy.interpolate import RegularGridInterpolator
 
 from ef.util.serializable_h5 import SerializableH5
 
 
 class ArrayOnGrid(SerializableH5):
     xp = numpy
+    deposition_engine = 'bincount'  # or 'add.at'
 
     def __init__(self, grid, value_shape=None, data=None):
         self.grid = grid
+        self._cell = self.xp.asarray(grid.cell)
+        self._size = self.xp.asarray(grid.size)
+        self._origin = self.xp.asarray(grid.origin)
+        self._last_node = self.xp.asarray(grid.n_nodes - 1)
+        self._corner_offsets = self.xp.asarray([(i * grid.n_nodes[1] + j) * grid.n_nodes[2] + k
+                                                for i, j, k in numpy.ndindex(2, 2, 2)])
         if value_shape is None:
             value_shape = ()
         self.value_shape = (value_shape,) if type(value_shape) is int else tuple(value_shape)
-        if data is None:
-            self._data = self.zero
-        else:
-            data = self.xp.array(data, dtype=self.xp.float)
-            if data.shape != self.n_nodes:
-                raise ValueError("Unexpected raw data array shape: {} for this ArrayOnGrid shape: {}".format(
-                    data.shape, self.n_nodes
-                ))
-            self._data = data
+        self._data = self.zero if data is None else self.convert_data(data)
+
+    def convert_data(self, data):
+        data = self.xp.array(data, dtype=self.xp.float)
+        if data.shape != self.n_nodes:
+            raise ValueError("Unexpected raw data array shape: {} for this ArrayOnGrid shape: {}".format(
+                data.shape, self.n_nodes
+            ))
+        return data
 
     @property
     def dict(self):
@@ -36,15 +42,15 @@ class ArrayOnGrid(SerializableH5):
 
     @property
     def cell(self):
-        return self.xp.asarray(self.grid.cell)
+        return self._cell
 
     @property
     def size(self):
-        return self.xp.asarray(self.grid.size)
+        return self._size
 
     @property
     def origin(self):
-        return self.xp.asarray(self.grid.origin)
+        return self._origin
 
     @property
     def n_nodes(self):
@@ -76,26 +82,73 @@ class ArrayOnGrid(SerializableH5):
         w = (wx * wy * wz).reshape((-1))  # np*8
         dn = self.xp.array([[[(1, 1, 1), (1, 1, 0)], [(1, 0, 1), (1, 0, 0)]],
                             [[(0, 1, 1), (0, 1, 0)], [(0, 0, 1), (0, 0, 0)]]]).reshape((8, 3))  # 8 * 3
-        nodes_to_update = (nodes[:, self.xp.newaxis] + dn).reshape((-1, 3))  # (np*8, 3)
-        self.scatter_add(self._data, tuple(nodes_to_update.transpose()), w * density)
+        if self.deposition_engine == 'bincount':
+            n = self.grid.n_nodes
+            strides = self.xp.asarray((n[1] * n[2], n[2], 1))  # 3
+            flat_nodes = (nodes.dot(strides)[:, self.xp.newaxis] + dn.dot(strides)).reshape(-1)  # np*8
+            self.bincount_add(self._data, flat_nodes, w * density)
+        elif self.deposition_engine == 'add.at':
+            nodes_to_update = (nodes[:, self.xp.newaxis] + dn).reshape((-1, 3))  # (np*8, 3)
+            self.scatter_add(self._data, tuple(nodes_to_update.transpose()), w * density)
+        else:
+            raise ValueError("Unknown deposition engine: {}".format(self.deposition_engine))
 
     def scatter_add(self, a, slices, value):
         slices = tuple(s[value != 0] for s in slices)
         value = value[value != 0]
         self.xp.add.at(a, slices, value)
 
+    def bincount_add(self, a, flat_indices, value):
+        nonzero = value != 0
+        a += self.xp.bincount(flat_indices[nonzero], value[nonzero], a.size).reshape(a.shape)
+
     def interpolate_at_positions(self, positions):
         """
         Given a field on this grid, interpolate it at n positions.
+        Field is zero outside of the grid.
 
         :param positions: array of shape (np, 3)
         :return: array of shape (np, {F})
         """
-        positions = self.xp.asarray(positions)
-        o, s = self.origin, self.size
-        xyz = tuple(self.xp.linspace(o[i], o[i] + s[i], self.n_nodes[i]) for i in (0, 1, 2))
-        interpolator = RegularGridInterpolator(xyz, self._data, bounds_error=False, fill_value=0)
-        return interpolator(positions)
+        return self.interpolate_with_stencil(self.interpolation_stencil(positions))
+
+    def interpolation_stencil(self, positions):
+        """
+        Compute trilinear interpolation indices and weights of n positions on this grid.
+        The stencil can be reused to interpolate any array on the same grid.
+
+        :param positions: array of shape (np, 3)
+        :return: flat index of the lower corner node (np), weights of the 8 cell corners (8, np), zero outside
+        """
+        xyz = (self.xp.asarray(positions).reshape((-1, 3)) - self._origin) / self._cell  # (np, 3)
+        inside = self.xp.logical_and(xyz >= 0, xyz <= self._last_node).all(axis=-1)  # (np)
+        # nodes on the far boundary are interpolated from the last cell with remainder 1
+        nodes = self.xp.clip(self.xp.floor(xyz), 0, self._last_node - 1)  # (np, 3)
+        d = xyz - nodes  # (np, 3)
+        nodes = nodes.astype(int)
+        where = (nodes[:, 0] * self.grid.n_nodes[1] + nodes[:, 1]) * self.grid.n_nodes[2] + nodes[:, 2]  # (np)
+        where[~inside] = 0
+        w = self.xp.stack((1. - d, d))  # (2, np, 3)
+        weights = self.xp.stack([w[i, :, 0] * w[j, :, 1] * w[k, :, 2]
+                                 for i, j, k in numpy.ndindex(2, 2, 2)])  # (8, np)
+        weights[:, ~inside] = 0
+        return where, weights
+
+    def interpolate_with_stencil(self, stencil):
+        """
+        Interpolate this array using a stencil computed by `interpolation_stencil` on the same grid.
+
+        :param stencil: tuple of lower corner indices (np) and corner weights (8, np)
+        :return: array of shape (np, {F})
+        """
+        where, weights = stencil
+        field = self._data.reshape((-1, *self.value_shape))
+        result = self.xp.zeros((len(where), *self.value_shape))
+        for offset, weight in zip(self._corner_offsets, weights):
+            corner = field.take(where + offset, axis=0)  # (np, {F})
+            corner *= weight.reshape((-1, *(1,) * len(self.value_shape)))
+            result += corner
+        return result
 
     def gradient(self, output_array: Optional['ArrayOnGrid'] = None) -> 'ArrayOnGrid':
         # based on numpy.gradient simplified for our case
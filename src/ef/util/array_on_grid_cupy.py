@@ -12,6 +12,8 @@ except ImportError:
 
 
 class ArrayOnGridCupy(ArrayOnGrid):
+    deposition_engine = 'add.at'
+
     def __init__(self, grid, value_shape=None, data=None):
         self.xp = cupy
         super().__init__(grid, value_shape, data)
@@ -23,9 +25,9 @@ class ArrayOnGridCupy(ArrayOnGrid):
                 double x = coords[3 * tid]/{c[0]};
                 double y = coords[3 * tid + 1]/{c[1]};
                 double z = coords[3 * tid + 2]/{c[2]};
-                int x0 = int(x);
-                int y0 = int(y);
-                int z0 = int(z);
+                int x0 = int(floor(x));
+                int y0 = int(floor(y));
+                int z0 = int(floor(z));
                 double dx = x - x0;
                 double dy = y - y0;
                 double dz = z - z0;
@@ -55,9 +57,6 @@ class ArrayOnGridCupy(ArrayOnGrid):
         }}
         '''.format(c=grid.cell, n=grid.n_nodes, s=grid.size, v=numpy.prod(self.value_shape, dtype=int)),
                                                  'interpolate_field')
-        self._cell = self.xp.array(grid.cell)
-        self._size = self.xp.array(grid.size)
-        self._origin = self.xp.array(grid.origin)
 
     @property
     def dict(self):
@@ -69,24 +68,12 @@ class ArrayOnGridCupy(ArrayOnGrid):
     def data(self):
         return self._data.get()
 
-    @property
-    def cell(self):
-        return self._cell
-
-    @property
-    def size(self):
-        return self._size
-
-    @property
-    def origin(self):
-        return self._origin
-
     def scatter_add(self, a, slices, value):
         import cupyx
         cupyx.scatter_add(a, slices, value)
 
     def interpolate_at_positions(self, positions):
-        positions = self.xp.asanyarray(positions)
+        positions = self.xp.asanyarray(positions) - self._origin
         result = self.xp.empty(reduce(operator.mul, self.value_shape, positions.shape[0]))
         n = positions.shape[0]
         block = 128
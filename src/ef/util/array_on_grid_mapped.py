@@ -0,0 +1,82 @@
+from collections import OrderedDict
+
+import inject
+import numpy
+
+from ef.util.array_on_grid import ArrayOnGrid
+from ef.util.inject import safe_default_inject
+
+
+class ArrayOnGridMapped(ArrayOnGrid):
+    """
+    Read-only array on grid backed by a lazily read storage, such as numpy.memmap or h5py.Dataset.
+
+    Interpolation reads only the blocks of nodes around the requested positions,
+    the most recently used blocks are kept in memory.
+    Blocks overlap by one node, so that all corners of a cell are found in a single block.
+    """
+
+    @safe_default_inject
+    @inject.params(output_xp=numpy)
+    def __init__(self, grid, value_shape=None, data=None, block_size=32, max_cached_blocks=64, output_xp=numpy):
+        if data is None:
+            raise ValueError("ArrayOnGridMapped needs a data storage to read from")
+        self.block_size = block_size
+        self.max_cached_blocks = max_cached_blocks
+        self._output_xp = output_xp
+        self._blocks = OrderedDict()
+        super().__init__(grid, value_shape, data)
+
+    @property
+    def dict(self):
+        d = super().dict
+        d["data"] = numpy.asarray(self.data)
+        return d
+
+    def convert_data(self, data):
+        if tuple(data.shape) != self.n_nodes:
+            raise ValueError("Unexpected raw data array shape: {} for this ArrayOnGrid shape: {}".format(
+                data.shape, self.n_nodes
+            ))
+        return data
+
+    def interpolation_stencil(self, positions):
+        return super().interpolation_stencil(self.to_host(positions))
+
+    def interpolate_with_stencil(self, stencil):
+        where, weights = (self.to_host(a) for a in stencil)
+        nodes = numpy.stack(numpy.unravel_index(where, self.grid.n_nodes), -1)  # (np, 3)
+        n_blocks = tuple((self.grid.n_nodes - 1) // self.block_size + 1)
+        keys = numpy.ravel_multi_index(tuple((nodes // self.block_size).T), n_blocks)  # (np)
+        order = numpy.argsort(keys, kind='stable')
+        starts = numpy.flatnonzero(numpy.diff(keys[order], prepend=-1))
+        result = numpy.zeros((len(where), *self.value_shape))
+        for particles in numpy.split(order, starts[1:]) if len(order) else ():
+            block = numpy.array(numpy.unravel_index(keys[particles[0]], n_blocks))  # (3)
+            data = self.read_block(tuple(block))
+            local = nodes[particles] - block * self.block_size
+            strides = numpy.array((data.shape[1] * data.shape[2], data.shape[2], 1))
+            first = local.dot(strides)
+            field = data.reshape((-1, *self.value_shape))
+            values = numpy.zeros((len(particles), *self.value_shape))
+            for (i, j, k), weight in zip(numpy.ndindex(2, 2, 2), weights[:, particles]):
+                corner = field.take(first + numpy.dot((i, j, k), strides), axis=0)
+                corner *= weight.reshape((-1, *(1,) * len(self.value_shape)))
+                values += corner
+            result[particles] = values
+        return self._output_xp.asarray(result)
+
+    def read_block(self, block):
+        if block in self._blocks:
+            self._blocks.move_to_end(block)
+            return self._blocks[block]
+        start = [b * self.block_size for b in block]
+        data = numpy.array(self._data[tuple(slice(s, s + self.block_size + 1) for s in start)], dtype=float)
+        self._blocks[block] = data
+        if len(self._blocks) > self.max_cached_blocks:
+            self._blocks.popitem(last=False)
+        return data
+
+    @staticmethod
+    def to_host(a):
+        return a.get() if hasattr(a, 'get') else a
@@ -1,18 +1,45 @@
+from typing import Optional
+
 import inject
 import numpy
 from decorator import decorator
 from inject import Binder, BinderCallable
 
-from ef.field.solvers import FieldSolver
-from ef.field.solvers.pyamg import FieldSolverPyamg
-from ef.field.solvers.pyamgx import FieldSolverPyamgx
+from ef.field.particles import FieldParticles, FieldParticlesBarnesHut
 from ef.util.array_on_grid import ArrayOnGrid
 from ef.util.array_on_grid_cupy import ArrayOnGridCupy
 
 
-def make_injection_config(solver: str = 'amg', backend: str = 'numpy') -> BinderCallable:
+def make_settings_config(binary_field: str = 'direct', lazy_field_files: bool = False,
+                         solver_cache_dir: Optional[str] = None) -> BinderCallable:
     def conf(binder: Binder) -> None:
-        binder.bind(FieldSolver, FieldSolverPyamgx if solver == 'amgx' else FieldSolverPyamg)
+        binder.bind(FieldParticles, FieldParticlesBarnesHut if binary_field == 'tree' else FieldParticles)
+        binder.bind('lazy_field_files', lazy_field_files)
+        binder.bind('solver_cache_dir', solver_cache_dir)
+
+    return conf
+
+
+def make_injection_config(solver: str = 'amg', backend: str = 'numpy', binary_field: str = 'direct',
+                          lazy_field_files: bool = False, solver_cache_dir: Optional[str] = None) -> BinderCallable:
+    def conf(binder: Binder) -> None:
+        from ef.field.solvers import FieldSolver  # solvers import this module
+        binder.install(make_settings_config(binary_field, lazy_field_files, solver_cache_dir))
+        if solver == 'amgx':
+            from ef.field.solvers.pyamgx import FieldSolverPyamgx
+            binder.bind(FieldSolver, FieldSolverPyamgx)
+        elif solver == 'fft':
+            from ef.field.solvers.fft import FieldSolverFFT
+            binder.bind(FieldSolver, FieldSolverFFT)
+        elif solver == 'mg':
+            from ef.field.solvers.geometric_mg import FieldSolverGeometricMG
+            binder.bind(FieldSolver, FieldSolverGeometricMG)
+        elif solver == 'sor':
+            from ef.field.solvers.sor import FieldSolverSOR
+            binder.bind(FieldSolver, FieldSolverSOR)
+        else:
+            from ef.field.solvers.pyamg import FieldSolverPyamg
+            binder.bind(FieldSolver, FieldSolverPyamg)
         if backend == 'cupy':
             import cupy
             binder.bind(ArrayOnGrid, ArrayOnGridCupy)
@@ -24,8 +51,9 @@ def make_injection_config(solver: str = 'amg', backend: str = 'numpy') -> Binder
     return conf
 
 
-def configure_application(solver: str = 'amg', backend: str = 'numpy'):
-    inject.configure(make_injection_config(solver, backend))
+def configure_application(solver: str = 'amg', backend: str = 'numpy', binary_field: str = 'direct',
+                          lazy_field_files: bool = False, solver_cache_dir: Optional[str] = None):
+    inject.configure(make_injection_config(solver, backend, binary_field, lazy_field_files, solver_cache_dir))
 
 
 @decorator
@@ -8,6 +8,7 @@ from ef.field.solvers.pyamg import FieldSolverPyamg
 from ef.field.solvers.pyamgx import FieldSolverPyamgx
 from ef.util.array_on_grid import ArrayOnGrid
 from ef.util.array_on_grid_cupy import ArrayOnGridCupy
+from ef.util.inject import make_settings_config
 
 @pytest.fixture(params=['numpy', pytest.param('cupy', marks=pytest.mark.cupy)], ids=['np', 'cp'])
 def _backend(request):
@@ -38,14 +39,37 @@ def _solver(request):
 
 @pytest.fixture
 def backend(_backend):
-    inject.clear_and_configure(_backend)
+    def conf(binder):
+        binder.install(_backend)
+        binder.install(make_settings_config())
+
+    inject.clear_and_configure(conf)
     yield
     inject.clear()
 
 
+@pytest.fixture
+def backend_with_settings(_backend):
+    """Call with keyword arguments of make_settings_config to configure them together with the backend."""
+    def configure(**settings):
+        def conf(binder):
+            binder.install(_backend)
+            binder.install(make_settings_config(**settings))
+
+        inject.clear_and_configure(conf)
+
+    configure()
+    yield configure
+    inject.clear()
+
+
 @pytest.fixture
 def solver(_solver):
-    inject.clear_and_configure(_solver)
+    def conf(binder):
+        binder.install(_solver)
+        binder.install(make_settings_config())
+
+    inject.clear_and_configure(conf)
     yield
     inject.clear()
 
@@ -55,6 +79,7 @@ def backend_and_solver(_backend, _solver):
     def conf(binder):
         binder.install(_backend)
         binder.install(_solver)
+        binder.install(make_settings_config())
 
     inject.clear_and_configure(conf)
     yield
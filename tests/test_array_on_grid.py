@@ -8,6 +8,7 @@ from scipy.interpolate import RegularGridInterpolator
 
 from ef.meshgrid import MeshGrid
 from ef.util.array_on_grid import ArrayOnGrid
+from ef.util.array_on_grid_mapped import ArrayOnGridMapped
 from ef.util.testing import assert_array_equal, assert_array_almost_equal, assert_dataclass_eq
 
 
@@ -80,6 +81,22 @@ class TestArrayOnGrid:
         # with raises(IndexError):
         #     a.distribute_at_positions(-2, [(1, 2, 8.1)])
 
+    def test_distribute_engines(self, monkeypatch):
+        if self.Array is not ArrayOnGrid:
+            pytest.skip("deposition engines are only selectable on the numpy backend")
+        mesh = MeshGrid((2, 4, 8), (5, 9, 17))
+        positions = np.random.RandomState(123).uniform(0, (2, 4, 8), (10000, 3))
+        positions[:10] = (2, 4, 8)
+        a = self.Array(mesh)
+        a.distribute_at_positions(-3, positions)
+        monkeypatch.setattr(ArrayOnGrid, 'deposition_engine', 'add.at')
+        b = self.Array(mesh)
+        b.distribute_at_positions(-3, positions)
+        assert_array_almost_equal(a.data, b.data, 12)
+        monkeypatch.setattr(ArrayOnGrid, 'deposition_engine', 'unknown')
+        with raises(ValueError, match="Unknown deposition engine: unknown"):
+            b.distribute_at_positions(-3, positions)
+
     def test_distribute_vector(self):
         a = self.Array(MeshGrid(1, 2))
         with raises(ValueError, match="operands could not be broadcast together with shapes"):
@@ -115,6 +132,32 @@ class TestArrayOnGrid:
                             (100, 100, 100),
                             (49.375, 50.1875, 50)])
 
+    def test_interpolate_matches_regular_grid_interpolator(self):
+        mesh = MeshGrid((10, 20, 30), (6, 11, 4), (1, -2, 3))
+        data = np.random.RandomState(0).uniform(-1, 1, (6, 11, 4, 3))
+        a = self.Array(mesh, 3, data)
+        positions = np.random.RandomState(1).uniform((0, -3, 2), (12, 19, 34), (1000, 3))
+        positions[:8] = [(1, -2, 3), (11, 18, 33), (11, -2, 33), (1, 18, 3),
+                         (0.99, 0, 10), (11.01, 0, 10), (5, 5, 2.99), (5, 5, 33.01)]
+        xyz = tuple(np.linspace(mesh.origin[i], mesh.origin[i] + mesh.size[i], mesh.n_nodes[i]) for i in (0, 1, 2))
+        interpolator = RegularGridInterpolator(xyz, data, bounds_error=False, fill_value=0)
+        assert_array_almost_equal(a.interpolate_at_positions(self.xp.asarray(positions)), interpolator(positions))
+
+    def test_interpolate_mapped(self, tmpdir):
+        mesh = MeshGrid((10, 20, 30), (16, 21, 9), (1, -2, 3))
+        data = np.random.RandomState(0).uniform(-1, 1, (16, 21, 9, 3))
+        np.save(str(tmpdir.join('field.npy')), data)
+        memmap = np.load(str(tmpdir.join('field.npy')), mmap_mode='r')
+        a = ArrayOnGridMapped(mesh, 3, memmap, block_size=4, max_cached_blocks=5)
+        positions = np.random.RandomState(1).uniform((0, -3, 2), (12, 19, 34), (1000, 3))
+        positions[:2] = [(1, -2, 3), (11, 18, 33)]
+        expected = self.Array(mesh, 3, data).interpolate_at_positions(self.xp.asarray(positions))
+        assert_array_almost_equal(a.interpolate_at_positions(self.xp.asarray(positions)), expected)
+        assert len(a._blocks) == 5
+        assert_array_almost_equal(a.interpolate_at_positions(self.xp.asarray(positions[:10])), expected[:10])
+        with raises(ValueError):
+            ArrayOnGridMapped(mesh, 3, memmap[1:])
+
     def test_gradient(self):
         m = MeshGrid((1.5, 2, 1), (4, 3, 2))
         potential = self.Array(m)
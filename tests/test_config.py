@@ -9,7 +9,8 @@ from ef.util.testing import assert_dataclass_eq
 
 comp_list = [BoundaryConditionsConf, InnerRegionConf, OutputFileConf, ParticleInteractionModelConf,
              ParticleSourceConf, SpatialMeshConf, TimeGridConf,
-             ExternalMagneticFieldUniformConf, ExternalElectricFieldUniformConf]
+             ExternalMagneticFieldUniformConf, ExternalElectricFieldUniformConf, FieldSamplingConf,
+             SubcyclingConf, SpeciesSubcyclingConf]
 
 
 def test_components_to_conf_and_back(backend):
@@ -1,16 +1,49 @@
 import numpy as np
+import pytest
 import scipy
+import scipy.sparse.linalg
 from numpy.testing import assert_array_equal, assert_allclose
+from pytest import raises
 from scipy.sparse import csr_matrix
 
 from ef.config.components import BoundaryConditionsConf
 from ef.config.components import Box
+from ef.field.solvers.fft import FieldSolverFFT
+from ef.field.solvers.geometric_mg import FieldSolverGeometricMG
+from ef.field.solvers.superposition import FieldSolverSuperposition
 from ef.field.solvers.pyamg import FieldSolverPyamg as FieldSolver
+from ef.field.solvers.sor import FieldSolverSOR
 from ef.inner_region import InnerRegion
 from ef.meshgrid import MeshGrid
 from ef.util.array_on_grid import ArrayOnGrid
 
 
+def random_charge(mesh, seed=0):
+    charge = ArrayOnGrid(mesh)
+    charge._data[1:-1, 1:-1, 1:-1] = np.random.RandomState(seed).uniform(-1, 1, mesh.n_nodes - 2)
+    return charge
+
+
+def exact_potential(mesh, regions, charge, potential):
+    """Solve the equation of the mesh and inner regions with a sparse direct solver."""
+    expected = ArrayOnGrid(mesh, (), potential.data)
+    solver = FieldSolver(mesh, regions)
+    solver.init_rhs_vector(charge, expected)
+    solver.phi_vec = scipy.sparse.linalg.spsolve(solver.A, solver.rhs)
+    solver.transfer_solution_to_spat_mesh(expected)
+    return expected
+
+
+def regions_for(solver_class, potential=3):
+    if solver_class is FieldSolverFFT:
+        return []  # not supported
+    return [InnerRegion('a', Box((0.5, 0.6, 0.75), (0.5, 0.6, 0.75)), potential)]
+
+
+solver_classes = pytest.mark.parametrize('solver_class', [FieldSolver, FieldSolverFFT, FieldSolverGeometricMG,
+                                                          FieldSolverSOR])
+
+
 class TestFieldSolver:
 
     def test_global_index(self):
@@ -142,18 +175,6 @@ class TestFieldSolver:
                                               [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0],
                                               [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]])
 
-    def test_d2dx2(self):
-        d = FieldSolver.get_diag_d2dx2_in_3d(3, 2, 2, 1)
-        assert_array_equal(d, [1, 1, 0, 1, 1, 0, 1, 1, 0, 1, 1])
-        d = FieldSolver.get_diag_d2dx2_in_3d(3, 2, 1, 4)
-        assert_array_equal(d, [4, 4, 0, 4, 4])
-
-    def test_d2dy2(self):
-        d = FieldSolver.get_diag_d2dy2_in_3d(3, 2, 2, 1)
-        assert_array_equal(d, [1, 1, 1, 0, 0, 0, 1, 1, 1])
-        d = FieldSolver.get_diag_d2dy2_in_3d(3, 2, 1, 3.5)
-        assert_array_equal(d, [3.5, 3.5, 3.5])
-
     def test_construct_equation_matrix(self):
         mesh = MeshGrid.from_step((4, 6, 9), (1, 2, 3))
         solver = FieldSolver(mesh, [])
@@ -175,6 +196,28 @@ class TestFieldSolver:
                                                 [0, 0, 0, 0, z, 0, 0, y, 0, x, d, x],
                                                 [0, 0, 0, 0, 0, z, 0, 0, y, 0, x, d]])
 
+    def test_equation_cache(self, backend_with_settings, monkeypatch, tmpdir):
+        backend_with_settings(solver_cache_dir=str(tmpdir))
+        mesh = MeshGrid.from_step((4, 6, 9), (1, 2, 3))
+        regions = [InnerRegion('test', Box((1, 2, 3), (1, 2, 3)), 3)]
+        solver = FieldSolver(mesh, regions)
+        assert len(tmpdir.listdir()) == 1
+        # must not be called with a valid cache
+        monkeypatch.setattr(FieldSolver, 'construct_equation_matrix', None)
+        monkeypatch.setattr(FieldSolver, 'generate_nodes_in_regions', None)
+        cached = FieldSolver(mesh, [InnerRegion('test', Box((1, 2, 3), (1, 2, 3)), 3)])
+        assert_array_equal(cached.A.toarray(), solver.A.toarray())
+        assert_array_equal(cached.nodes_in_regions, solver.nodes_in_regions)
+        assert_array_equal(cached.potential_in_regions, solver.potential_in_regions)
+        # potentials in regions are cached too
+        with raises(TypeError):
+            FieldSolver(mesh, [InnerRegion('test', Box((1, 2, 3), (1, 2, 3)), 2)])
+        # a region differing beyond the precision of numpy repr is a different geometry
+        with raises(TypeError):
+            FieldSolver(mesh, [InnerRegion('test', Box((1 + 1e-12, 2, 3), (1, 2, 3)), 3)])
+        with raises(TypeError):
+            FieldSolver(mesh, [InnerRegion('test', Box((1, 2, 3), (1, 2, 3)), 3, inverted=True)])
+
     def test_transfer_solution_to_spat_mesh(self):
         mesh = MeshGrid.from_step((4, 6, 9), (1, 2, 3))
         solver = FieldSolver(mesh, [])
@@ -191,3 +234,139 @@ class TestFieldSolver:
             [[0, 0, 0, 0], [0, 2, 8, 0], [0, 5, 11, 0], [0, 0, 0, 0]],
             [[0, 0, 0, 0], [0, 3, 9, 0], [0, 6, 12, 0], [0, 0, 0, 0]],
             [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]])
+
+    def test_hierarchy_reuse(self, mocker):
+        mesh = MeshGrid.from_step((4, 6, 9), (1, 2, 3))
+        charge = ArrayOnGrid(mesh)
+        charge._data[2, 2, 2] = 1
+        potential = ArrayOnGrid(mesh)
+        potential.apply_boundary_values(BoundaryConditionsConf(-1))
+        exact = exact_potential(mesh, [], charge, potential)
+
+        import pyamg
+        mocker.spy(pyamg, 'solver')
+        for accel in 'auto', 'cg', None:
+            solver = FieldSolver(mesh, [], accel=accel)
+            for i in range(3):
+                result = ArrayOnGrid(mesh, (), potential.data)
+                solver.eval_potential(charge, result)
+                assert_allclose(result.data, exact.data)
+        assert pyamg.solver.call_count == 3
+
+
+class TestFieldSolverFFT:
+    def test_inner_regions(self):
+        mesh = MeshGrid.from_step((4, 6, 9), (1, 2, 3))
+        with raises(ValueError, match="FFT field solver does not support inner regions"):
+            FieldSolverFFT(mesh, [InnerRegion('test', Box((1, 2, 3), (1, 2, 3)), 3)])
+
+
+class TestFieldSolverGeometricMG:
+    @pytest.mark.parametrize('direct_solve_unknowns', [15000, 0])
+    def test_levels(self, backend, monkeypatch, direct_solve_unknowns):
+        monkeypatch.setattr(FieldSolverGeometricMG, 'coarsest_unknowns', 100)
+        monkeypatch.setattr(FieldSolverGeometricMG, 'direct_solve_unknowns', direct_solve_unknowns)
+        mesh = MeshGrid((2, 2.4, 3), (17, 17, 9))
+        regions = [InnerRegion('a', Box((0.5, 0.6, 0.75), (0.5, 0.6, 0.75)), 3),
+                   InnerRegion('b', Box((1.25, 0, 0), (0.25, 2.4, 1.5)), -2)]
+        charge = random_charge(mesh)
+        potential = ArrayOnGrid(mesh)
+        potential.apply_boundary_values(BoundaryConditionsConf(1, 2, 3, 4, 5, 6))
+        expected = exact_potential(mesh, regions, charge, potential)
+        solver = FieldSolverGeometricMG(mesh, regions)
+        assert [level.shape for level in solver.levels] == [(17, 17, 9), (9, 9, 5), (5, 5, 3)]
+        assert (solver._coarse_lu is None) == (direct_solve_unknowns == 0)
+        solver.eval_potential(charge, potential)
+        assert_allclose(potential.data, expected.data)
+
+
+class TestFieldSolverSOR:
+    def test_convergence(self, backend, mocker):
+        mesh = MeshGrid((2, 2.4, 3), (9, 11, 7))
+        regions = [InnerRegion('a', Box((0.5, 0.6, 0.75), (0.5, 0.6, 0.75)), 3)]
+        charge = random_charge(mesh)
+        potential = ArrayOnGrid(mesh)
+        potential.apply_boundary_values(BoundaryConditionsConf(1, 2, 3, 4, 5, 6))
+        solver = FieldSolverSOR(mesh, regions)
+        assert 1 < solver.optimal_omega < 2
+        solver.eval_potential(charge, potential)
+        mocker.spy(solver.grid, 'apply')
+        solver.eval_potential(charge, potential)  # converged already, only the residual is checked
+        assert solver.grid.apply.call_count == 2
+
+
+@solver_classes
+def test_eval_potential(backend, solver_class):
+    mesh = MeshGrid((2, 2.4, 3), (9, 11, 7))
+    regions = regions_for(solver_class)
+    charge = random_charge(mesh)
+    potential = ArrayOnGrid(mesh)
+    potential.apply_boundary_values(BoundaryConditionsConf(1, 2, 3, 4, 5, 6))
+    expected = exact_potential(mesh, regions, charge, potential)
+    solver = solver_class(mesh, regions)
+    solver.eval_potential(charge, potential)
+    assert_allclose(potential.data, expected.data)
+    solver.eval_potential(charge, potential)  # starts from the solution
+    assert_allclose(potential.data, expected.data)
+
+
+@solver_classes
+def test_eval_potentials(backend, solver_class):
+    mesh = MeshGrid((2, 2.4, 3), (9, 7, 9))
+    solver = solver_class(mesh, regions_for(solver_class))
+    charges, potentials, expected, inside = [], [], [], []
+    for i in range(3):
+        charge = random_charge(mesh, i)
+        potential = ArrayOnGrid(mesh)
+        potential.apply_boundary_values(BoundaryConditionsConf(i, 2, 3, -i, 5, 6))
+        regions = regions_for(solver_class, i)
+        charges.append(charge)
+        potentials.append(potential)
+        expected.append(exact_potential(mesh, regions, charge, potential))
+        inside.append(solver.generate_nodes_in_regions(regions)[1])
+    solver.eval_potentials(charges, potentials, inside)
+    for potential, result in zip(potentials, expected):
+        assert_allclose(potential.data, result.data, atol=1e-10)
+
+
+class TestFieldSolverSuperposition:
+    def test_eval_potential(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(FieldSolverSuperposition, 'cache_directory', str(tmpdir))
+        mesh = MeshGrid.from_step((4, 6, 9), (0.5, 1, 1.5))
+        regions = [InnerRegion('a', Box((1, 2, 3), (1, 2, 3)), 3), InnerRegion('b', Box((3, 0, 0), (1, 6, 3)), -2)]
+        charge = ArrayOnGrid(mesh)
+        charge._data[1:-1, 1:-1, 1:-1] = np.random.RandomState(0).uniform(-1, 1, mesh.n_nodes - 2)
+        potential = ArrayOnGrid(mesh)
+        potential.apply_boundary_values(BoundaryConditionsConf(1, 2, 3, 4, 5, 6))
+        expected = ArrayOnGrid(mesh, (), potential.data)
+        FieldSolver(mesh, regions).eval_potential(charge, expected)
+
+        solver = FieldSolverSuperposition(FieldSolver(mesh, regions), regions)
+        assert solver.basis.shape == (8, *(mesh.n_nodes - 2))
+        assert len(tmpdir.listdir()) == 1
+        solver.eval_potential(charge, potential)
+        assert_allclose(potential.data, expected.data, atol=1e-8)
+
+        monkeypatch.setattr(FieldSolverSuperposition, 'compute_basis', None)  # must be loaded from cache
+        solver = FieldSolverSuperposition(FieldSolver(mesh, regions), regions)
+        potential = ArrayOnGrid(mesh)
+        potential.apply_boundary_values(BoundaryConditionsConf(1, 2, 3, 4, 5, 6))
+        solver.eval_potential(charge, potential)
+        assert_allclose(potential.data, expected.data, atol=1e-8)
+
+        vacuum = ArrayOnGrid(mesh, (), potential.data)
+        FieldSolver(mesh, regions).eval_potential(ArrayOnGrid(mesh), vacuum)
+        solver.eval_potential(ArrayOnGrid(mesh), potential)
+        assert_allclose(potential.data, vacuum.data, atol=1e-8)
+
+    def test_nonuniform_boundary(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(FieldSolverSuperposition, 'cache_directory', str(tmpdir))
+        mesh = MeshGrid.from_step((4, 6, 9), (1, 2, 3))
+        potential = ArrayOnGrid(mesh)
+        potential._data[0] = np.arange(16).reshape((4, 4))
+        expected = ArrayOnGrid(mesh, (), potential.data)
+        FieldSolverFFT(mesh, []).eval_potential(ArrayOnGrid(mesh), expected)
+        solver = FieldSolverSuperposition(FieldSolverFFT(mesh, []), [])
+        assert solver.face_voltages(potential) is None
+        solver.eval_potential(ArrayOnGrid(mesh), potential)
+        assert_allclose(potential.data, expected.data)
@@ -3,16 +3,19 @@ from math import sqrt
 import inject
 import numpy as np
 from pytest import raises
+from simpleeval import NameNotDefined, FunctionNotDefined, FeatureNotAvailable, InvalidExpression
 
 from ef.field import Field, FieldSum, FieldZero
-from ef.field.expression import FieldExpression
+from ef.field.evaluator import FieldEvaluator
+from ef.field.expression import FieldExpression, ExpressionCompiler
 from ef.field.from_csv import FieldFromCSVFile
 from ef.field.on_grid import FieldOnGrid
-from ef.field.particles import FieldParticles
+from ef.field.particles import FieldParticles, FieldParticlesBarnesHut
 from ef.field.uniform import FieldUniform
 from ef.meshgrid import MeshGrid
 from ef.particle_array import ParticleArray
 from ef.util.array_on_grid import ArrayOnGrid
+from ef.util.array_on_grid_mapped import ArrayOnGridMapped
 from ef.util.testing import assert_array_almost_equal, assert_array_equal
 
 
@@ -84,7 +87,8 @@ class TestFields:
         with raises(ValueError):
             FieldOnGrid('f1', 'electric', inject.instance(ArrayOnGrid)(MeshGrid(5, 6)))
 
-    def test_from_file(self, backend):
+    def test_from_file(self, backend, monkeypatch, tmpdir):
+        monkeypatch.setattr(FieldFromCSVFile, 'cache_directory', str(tmpdir))
         f = FieldFromCSVFile('f1', 'electric', 'tests/test_field.csv')
         assert_array_equal(f.get_at_points([(0, 0, 0), (1, 1, 1), (1, 0, 1), (.5, .5, .5)], 0),
                            [(1, 1, 1), (-1, -1, -1), (3, 2, 1), (1, 1, 1)])
@@ -93,6 +97,38 @@ class TestFields:
         assert_array_almost_equal(f.get_at_points([(.5, 1., .3), (0, .5, .7)], 5), [(0., .5, 1.), (1, 1.5, 2)])
         assert_array_equal(f.get_at_points([(-1, 1., .3), (1, 1, 10)], 3), [(0, 0, 0), (0, 0, 0)])
 
+    def test_from_file_cache(self, backend, monkeypatch, tmpdir):
+        monkeypatch.setattr(FieldFromCSVFile, 'chunk_lines', 3)
+        csv = tmpdir.join('field.csv')
+        lines = open('tests/test_field.csv').read().splitlines()
+        csv.write('\n'.join(lines[:1] + lines[:0:-1]))  # rows in reverse order
+        f = FieldFromCSVFile('f1', 'electric', str(csv))
+        expected = FieldFromCSVFile.parse('tests/test_field.csv')
+        assert_array_equal(f.array.data, expected[1])
+        assert sorted(p.basename[-9:] for p in tmpdir.listdir()) == ['.grid.npy', 'field.csv', 'field.npy']
+        incomplete = tmpdir.join('incomplete.csv')
+        incomplete.write('\n'.join(lines[:-1]))
+        with raises(ValueError):
+            FieldFromCSVFile('f1', 'electric', str(incomplete))
+        repeated = tmpdir.join('repeated.csv')
+        repeated.write('\n'.join(lines[:-1] + lines[1:2]))
+        with raises(ValueError, match="no values at 1 nodes"):
+            FieldFromCSVFile('f1', 'electric', str(repeated))
+        monkeypatch.setattr(FieldFromCSVFile, 'parse', None)  # must not be called with a valid cache
+        g = FieldFromCSVFile('f1', 'electric', str(csv))
+        assert_array_equal(g.array.data, f.array.data)
+        assert_array_equal(g.array.grid.origin, expected[0].origin)
+        assert_array_equal(g.array.grid.n_nodes, expected[0].n_nodes)
+
+    def test_from_file_lazy(self, backend_with_settings, monkeypatch, tmpdir):
+        monkeypatch.setattr(FieldFromCSVFile, 'cache_directory', str(tmpdir))
+        f = FieldFromCSVFile('f1', 'electric', 'tests/test_field.csv')
+        backend_with_settings(lazy_field_files=True)
+        g = FieldFromCSVFile('f1', 'electric', 'tests/test_field.csv')
+        assert type(g.array) is ArrayOnGridMapped
+        positions = [(0, 0, 0), (1, 1, 1), (.5, 1., .3), (0, .5, .7), (-1, 1., .3)]
+        assert_array_almost_equal(g.get_at_points(positions, 0), f.get_at_points(positions, 0))
+
     def test_binary(self, backend):
         f = FieldParticles('f', [ParticleArray(1, -1, 1, [(1, 2, 3)], [(-2, 2, 0)], False)])
         ParticleArray.xp.testing.assert_array_almost_equal(f.get_at_points((1, 2, 3), 0), [(0, 0, 0)])
@@ -105,3 +141,60 @@ class TestFields:
         ParticleArray.xp.testing.assert_array_almost_equal(f.get_at_points(
             [(1, 2, 3), (1, 2, 4), (0, 2, 3), (0, 1, 2)], 0),
             ParticleArray.xp.array([(0, 0, 0), (0, 0, -4), (4, 0, 0), (4 / sqrt(27), 4 / sqrt(27), 4 / sqrt(27))]))
+
+    def test_barnes_hut(self, backend):
+        xp = ParticleArray.xp
+        rng = np.random.RandomState(123)
+        arrays = [ParticleArray(range(1000), -1, 1, rng.normal(size=(1000, 3)), np.zeros((1000, 3))),
+                  ParticleArray(range(500), 2, 1, rng.uniform(-1, 1, (500, 3)), np.zeros((500, 3)))]
+        points = xp.concatenate([arrays[0].positions[:200], xp.asarray(rng.uniform(-3, 3, (100, 3)))])
+        exact = FieldParticles('f', arrays).get_at_points(points, 0)
+        xp.testing.assert_allclose(FieldParticlesBarnesHut('f', arrays, 0).get_at_points(points, 0), exact,
+                                   rtol=1e-9, atol=1e-12)
+        approx = FieldParticlesBarnesHut('f', arrays, 0.5).get_at_points(points, 0)
+        assert xp.linalg.norm(approx - exact) < 1e-2 * xp.linalg.norm(exact)
+        xp.testing.assert_array_equal(
+            FieldParticlesBarnesHut('f', arrays, 0.5, direct_sum_max_particles=2000).get_at_points(points, 0), exact)
+
+    def test_expression_compiled(self, backend):
+        f = FieldExpression('e1', 'magnetic', '3*x + sqrt(y) - z**2', 'sqrt(y) * 2 - (3*x)', 'cos(x) * (z > 1)')
+        assert f.is_time_independent
+        assert not FieldExpression('e2', 'electric', '0', 'sin(t)', '0').is_time_independent
+        xp = inject.instance(np)
+        x, y, z = xp.asarray([1., 2.]), xp.asarray([4., 9.]), xp.asarray([2., 0.5])
+        assert_array_almost_equal(f.get_at_points(xp.stack((x, y, z), -1), 0),
+                                  xp.stack((3 * x + xp.sqrt(y) - z ** 2, xp.sqrt(y) * 2 - 3 * x,
+                                            xp.cos(x) * (z > 1)), -1))
+        compiler = ExpressionCompiler()
+        compiler.compile(['3*x + sqrt(y) - z**2', 'sqrt(y) * 2 - (3*x)', '-1 + t'])
+        assert compiler.lines == ['_0 = c0 * x', '_1 = sqrt(y)', '_2 = _0 + _1', '_3 = z ** c1', '_4 = _2 - _3',
+                                  '_5 = _1 * c1', '_6 = _5 - _0', '_7 = -c2', '_8 = _7 + t']
+        with raises(NameNotDefined):
+            FieldExpression('e3', 'electric', 'w', '0', '0')
+        with raises(FunctionNotDefined):
+            FieldExpression('e3', 'electric', '0', 'exp(x)', '0')
+        with raises(InvalidExpression):
+            FieldExpression('e3', 'electric', '0', '0', '__import__("os").system("ls")')
+        with raises(FeatureNotAvailable):
+            FieldExpression('e3', 'electric', '0', '0', 'x.real')
+
+    def test_evaluator(self, backend):
+        xp = inject.instance(np)
+        mesh = MeshGrid(5, 6)
+        array_class = inject.instance(ArrayOnGrid)
+        grid_e = FieldOnGrid('e', 'electric', array_class(mesh, 3, xp.arange(6 ** 3 * 3).reshape((6, 6, 6, 3))))
+        grid_b = FieldOnGrid('b', 'magnetic', array_class(MeshGrid(5, 6), 3, xp.full((6, 6, 6, 3), 2.)))
+        other_grid = FieldOnGrid('o', 'electric', array_class(MeshGrid(10, 6), 3, xp.ones((6, 6, 6, 3))))
+        uniform = FieldUniform('u', 'electric', (1, 2, 3))
+        electric = FieldSum.factory([grid_e, other_grid, uniform])
+        evaluator = FieldEvaluator(mesh, electric, grid_b)
+        assert evaluator._electric_on_mesh == [grid_e]
+        assert evaluator._electric_other == [other_grid, uniform]
+        assert evaluator._magnetic_on_mesh == [grid_b]
+        positions = xp.asarray([(0.5, 1.2, 3.3), (4.9, 5., 0.), (-1., 2., 2.), (3., 3., 3.)])
+        e, b = evaluator.get_at_points(positions, 0.)
+        assert_array_almost_equal(e, electric.get_at_points(positions, 0.))
+        assert_array_almost_equal(b, grid_b.get_at_points(positions, 0.))
+        e, b = FieldEvaluator(mesh, FieldZero('z', 'electric'), FieldZero('z', 'magnetic')).get_at_points(positions, 0)
+        assert_array_equal(e, xp.zeros((4, 3)))
+        assert_array_equal(b, xp.zeros((4, 3)))
@@ -1,8 +1,9 @@
 import numpy as np
 import pytest
 
-from ef.config.components import Box
-from ef.inner_region import InnerRegion
+from ef.config.components import Box, Sphere, Cylinder, Tube
+from ef.inner_region import InnerRegion, CELL_INSIDE, CELL_OUTSIDE, CELL_BOUNDARY
+from ef.meshgrid import MeshGrid
 from ef.particle_array import ParticleArray
 from ef.util.testing import assert_dataclass_eq
 
@@ -68,3 +69,32 @@ class TestInnerRegion:
         assert ir.total_absorbed_particles == 1
         assert ir.total_absorbed_charge == -2
         assert_dataclass_eq(particles, ParticleArray([1], -2.0, 1.0, [(0, 0, 0)], np.zeros((1, 3))))
+
+    @pytest.mark.parametrize('shape', [Box((-1, -1, -1), (8, 8, 5)), Sphere((3, 3, 3), 4.2),
+                                       Cylinder((3, 3, -1), (3, 2, 7), 3.9), Tube((3, 3, -1), (3, 3, 7), 1, 4.5)])
+    def test_cell_index(self, shape):
+        ir = InnerRegion('test', shape)
+        ir.index_cells(MeshGrid(6, 25))
+        index = ir._cell_index.get() if hasattr(ir._cell_index, 'get') else ir._cell_index
+        assert {CELL_INSIDE, CELL_OUTSIDE, CELL_BOUNDARY} == set(np.unique(index))
+        positions = shape.xp.asarray(np.random.RandomState(0).uniform(-1, 7, (10000, 3)))
+        shape.xp.testing.assert_array_equal(ir.check_if_points_inside(positions),
+                                            shape.are_positions_inside(positions))
+
+    def test_cell_index_small_region(self):
+        ir = InnerRegion('test', Sphere((3, 3, 3), 1))
+        ir.index_cells(MeshGrid(6, 25))
+        assert ir._cell_index is None
+
+    @pytest.mark.parametrize('shape, min_saving, indexed', [(Sphere((3, 3, 3), 1), 0.5, False),
+                                                            (Sphere((3, 3, 3), 1), 0., True),
+                                                            (Box((-1, -1, -1), (8, 8, 5)), 0.5, True),
+                                                            (Box((-1, -1, -1), (8, 8, 5)), 1., False)])
+    def test_cell_index_min_saving(self, shape, min_saving, indexed, monkeypatch):
+        monkeypatch.setattr(InnerRegion, 'cell_index_min_saving', min_saving)
+        ir = InnerRegion('test', shape)
+        ir.index_cells(MeshGrid(6, 25))
+        assert (ir._cell_index is not None) == indexed
+        positions = shape.xp.asarray(np.random.RandomState(0).uniform(-1, 7, (1000, 3)))
+        shape.xp.testing.assert_array_equal(ir.check_if_points_inside(positions),
+                                            shape.are_positions_inside(positions))
@@ -79,7 +79,7 @@ def test_guess_stdin(tmpdir, monkeypatch):
     assert guess_input_type('-') == (True, p)
 
 
-@pytest.mark.parametrize('solver_', [' ', 'amg', pytest.param('amgx', marks=pytest.mark.amgx)])
+@pytest.mark.parametrize('solver_', [' ', 'amg', 'fft', 'mg', 'sor', pytest.param('amgx', marks=pytest.mark.amgx)])
 @pytest.mark.parametrize('backend_', [' ', 'numpy', pytest.param('cupy', marks=pytest.mark.cupy)])
 def test_main(mocker, capsys, tmpdir, monkeypatch, solver_, backend_):
     inject.clear()
@@ -106,6 +106,9 @@ output_file = OutputFileConf(prefix='out_', suffix='.h5', format_='cpp')
 boundary_conditions = BoundaryConditionsConf(right=0.0, left=0.0, bottom=0.0, top=0.0, near=0.0, far=0.0)
 particle_interaction_model = ParticleInteractionModelConf(model='PIC')
 external_fields = []
+field_sampling = FieldSamplingConf(sample_static_fields='none')
+subcycling = SubcyclingConf(field_solve_interval=1)
+species_subcycling = []
 Writing initial fields to file
 Writing to file out_fieldsWithoutParticles.h5
 Writing step 0 to file
@@ -137,6 +140,21 @@ Writing to file out_0000010.h5
 """
 
 
+def test_main_async_output(mocker, tmpdir, monkeypatch):
+    inject.clear()
+    monkeypatch.chdir(tmpdir)
+    Config(time_grid=TimeGridConf(10, 5, 1)).export_to_fname("test_main.conf")
+    mocker.patch("sys.argv", ["main.py", "test_main.conf", "--async-output"])
+    main()
+    inject.clear()
+    assert {f.basename for f in tmpdir.listdir()} == {'test_main.conf', 'out_fieldsWithoutParticles.h5',
+                                                      'out_0000000.h5', 'out_0000005.h5', 'out_0000010.h5'}
+    mocker.patch("sys.argv", ["main.py", "out_0000005.h5", "--async-output", "--prefix", "cont_"])
+    main()
+    inject.clear()
+    assert tmpdir.join('cont_0000010.h5').exists()
+
+
 @pytest.mark.slow
 @pytest.mark.parametrize('solver_', ['amg', pytest.param('amgx', marks=pytest.mark.amgx)])
 @pytest.mark.parametrize('backend_', ['numpy', pytest.param('cupy', marks=pytest.mark.cupy)])
@@ -1,5 +1,7 @@
 import h5py
+import numpy as np
 import pytest
+from numpy.testing import assert_array_equal, assert_array_almost_equal
 
 from ef.config.components import *
 from ef.config.config import Config
@@ -8,14 +10,18 @@ from ef.field.uniform import FieldUniform
 from ef.inner_region import InnerRegion
 from ef.meshgrid import MeshGrid
 from ef.output import OutputWriterNumberedH5, OutputWriterNone
+from ef.output.background import OutputWriterBackground
 from ef.output.cpp import OutputWriterCpp
 from ef.output.history import OutputWriterHistory
 from ef.output.python import OutputWriterPython
 from ef.output.reader import Reader
+from ef.particle_array import ParticleArray
 from ef.particle_interaction_model import Model
 from ef.particle_source import ParticleSource
+from ef.particle_tracker import ParticleTracker
 from ef.simulation import Simulation
 from ef.time_grid import TimeGrid
+from ef.util.array_on_grid_cupy import ArrayOnGridCupy
 from ef.util.testing import assert_dataclass_eq
 
 
@@ -56,6 +62,19 @@ class TestOutput:
             assert Reader().guess_h5_format(h5file) == 'cpp'
             assert_dataclass_eq(Reader().read_simulation(h5file), sim)
 
+    def test_write_cpp_subcycling(self, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        sim = Simulation(TimeGrid(10, 1, 5, current_node=3), MeshGrid(5, 6),
+                         particle_sources=[ParticleSource('a', Box(), charge=-1, mass=2),
+                                           ParticleSource('b', Box(), charge=1, mass=3)],
+                         particle_arrays=[ParticleArray([0, 1], -1, 2, np.ones((2, 3)), np.zeros((2, 3)), True, 2),
+                                          ParticleArray([2], -1, 2, np.ones((1, 3)), np.ones((1, 3)), True, 1),
+                                          ParticleArray([3], 1, 3, np.ones((1, 3)), np.ones((1, 3)), True, 1)],
+                         particle_tracker=ParticleTracker(3), field_solve_interval=3, push_intervals={'a': 2})
+        OutputWriterCpp('test_', '.ext').write(sim)
+        with h5py.File('test_0000003.ext') as h5file:
+            assert_dataclass_eq(Reader().read_simulation(h5file), sim)
+
     def test_write_python(self, monkeypatch, tmpdir, sim_full):
         monkeypatch.chdir(tmpdir)
         sim = sim_full
@@ -83,6 +102,100 @@ class TestOutput:
             assert Reader().guess_h5_format(h5file) == 'history'
             assert_dataclass_eq(Reader().read_simulation(h5file), sim)
 
+    @pytest.mark.parametrize('compression', [None, 'gzip'])
+    def test_write_history_particles(self, monkeypatch, tmpdir, compression):
+        monkeypatch.chdir(tmpdir)
+        sim = Simulation(TimeGrid(10, 1, 5), MeshGrid(5, 6),
+                         particle_sources=[ParticleSource('a', Box(), 7, 0, charge=-1, mass=2)],
+                         particle_interaction_model=Model.PIC,
+                         particle_arrays=[ParticleArray([5, 1, 0], -1, 2, np.arange(9).reshape((3, 3)),
+                                                        -np.arange(9).reshape((3, 3))),
+                                          ParticleArray([6, 2], 3, 4, np.ones((2, 3)), np.zeros((2, 3)))])
+        sim.potential._data[:] = 3.14
+        writer = OutputWriterHistory('test_', '.ext', compression)
+        writer.write(sim)
+        sim.time_grid.current_node = 5
+        sim.particle_arrays[0].positions += 10
+        writer.write(sim)
+        h = writer.h5file['history']
+        assert h['particles/position'].compression == compression
+        assert h['particles/position'].chunks == (7, 1, 3)
+        expected = np.zeros((7, 3, 3))
+        expected[[5, 1, 0], 0] = np.arange(9).reshape((3, 3))
+        expected[[6, 2], 0] = 1
+        expected[:, 1] = expected[:, 0]
+        expected[[5, 1, 0], 1] += 10
+        assert_array_equal(h['particles/position'][()], expected)
+        assert_array_equal(h['particles/momentum'][[0, 1, 5], 1], -np.arange(9).reshape((3, 3))[::-1])
+        assert_array_equal(h['particles/mass'][()], [2, 2, 4, 0, 0, 2, 4])
+        assert_array_equal(h['particles/charge'][()], [-1, -1, 3, 0, 0, -1, 3])
+        assert_array_almost_equal(h['field/potential'][:2], np.full((2, 6, 6, 6), 3.14), 6)
+
+    def test_write_background(self, monkeypatch, tmpdir, sim_full):
+        monkeypatch.chdir(tmpdir)
+        sim = sim_full
+        writer = OutputWriterBackground(OutputWriterPython('test_', '.ext'))
+        writer.write(sim, 'asdf')
+        sim.time_grid.current_node = 1
+        sim.potential._data[:] = 2.5
+        writer.write(sim)
+        sim.potential._data[:] = 0
+        writer.close()
+        assert not writer._thread.is_alive()
+        with h5py.File('test_asdf.ext') as h5file:
+            assert_array_equal(Reader().read_simulation(h5file).potential.data, 0)
+        with h5py.File('test_0000001.ext') as h5file:
+            saved = Reader().read_simulation(h5file)
+        assert saved.time_grid.current_node == 1
+        assert_array_equal(saved.potential.data, 2.5)
+
+    def test_background_snapshot(self, sim_full):
+        sim = sim_full
+        sim.particle_arrays.append(ParticleArray([0, 1], -1, 2, np.ones((2, 3)), np.zeros((2, 3)), True))
+        snapshot = OutputWriterBackground.snapshot(sim)
+        assert_dataclass_eq(snapshot, sim)
+        assert snapshot.mesh is sim.mesh
+        assert snapshot.electric_fields is sim.electric_fields
+        assert snapshot.magnetic_fields is sim.magnetic_fields
+        assert snapshot.particle_sources is sim.particle_sources
+        sim.time_grid.current_node = 3
+        sim.particle_arrays[0].positions += 1
+        sim.potential._data[:] = 1
+        sim.electric_field.array._data[:] = 1
+        sim.inner_regions[0].total_absorbed_particles = 5
+        assert snapshot.time_grid.current_node == 0
+        assert_array_equal(snapshot.particle_arrays[0].positions, 1)
+        assert_array_equal(snapshot.potential.data, 0)
+        assert_array_equal(snapshot.electric_field.array.data, 0)
+        assert snapshot.inner_regions[0].total_absorbed_particles == 0
+
+    @pytest.mark.cupy
+    @pytest.mark.parametrize('_backend', ['cupy'], indirect=True)
+    def test_write_background_cupy(self, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        sim = Simulation(TimeGrid(10, 1, 5), MeshGrid(5, 6), particle_interaction_model=Model.PIC,
+                         particle_arrays=[ParticleArray([0, 1], -1, 2, np.ones((2, 3)), np.zeros((2, 3)), True)])
+        assert type(sim.potential) is ArrayOnGridCupy
+        sim.potential._data[:] = 2.5
+        writer = OutputWriterBackground(OutputWriterPython('test_', '.ext'))
+        writer.write(sim)
+        sim.potential._data[:] = 0
+        sim.particle_arrays[0].positions += 1
+        writer.close()
+        with h5py.File('test_0000000.ext') as h5file:
+            saved = Reader().read_simulation(h5file)
+        assert_array_equal(saved.potential.data, 2.5)
+        assert_array_equal(saved.particle_arrays[0].dict['positions'], 1)
+
+    def test_write_background_error(self, mocker):
+        inner = OutputWriterNone()
+        mocker.patch.object(inner, 'write', side_effect=OSError('disk full'))
+        writer = OutputWriterBackground(inner)
+        writer.write(Config().make())
+        with pytest.raises(RuntimeError, match='Background output writer failed') as excinfo:
+            writer.close()
+        assert isinstance(excinfo.value.__cause__, OSError)
+
     def test_numbered(self, capsys, mocker):
         mocker.patch('h5py.File')
         sim = Config().make()
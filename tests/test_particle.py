@@ -1,8 +1,12 @@
+import logging
+import sys
+from importlib.util import find_spec
+
 import inject
 import numpy
 import pytest
 
-from ef.particle_array import ParticleArray
+from ef.particle_array import ParticleArray, numba_boris_kernel
 from ef.util.physical_constants import speed_of_light
 from ef.util.testing import assert_array_equal
 
@@ -19,6 +23,36 @@ class TestParticle:
         p.update_positions(10.0)
         assert_array_equal(p.positions, [(5., 0., 16.), (-4, -0.5, 3)])
 
+    def test_append(self):
+        p = ParticleArray([1, 2], -1.0, 2.0, [(0, 0, 1), (1, 2, 3)], [(1, 0, 3), (-1, -0.5, 0)])
+        assert p.capacity == 2
+        p.append(ParticleArray([3], -1.0, 2.0, [(4, 5, 6)], [(7, 8, 9)]))
+        assert p.capacity == 4
+        buffer = p._positions
+        p.append(ParticleArray([4], -1.0, 2.0, [(1, 1, 1)], [(2, 2, 2)]))
+        assert p._positions is buffer
+        assert_array_equal(p.ids, [1, 2, 3, 4])
+        assert_array_equal(p.positions, [(0, 0, 1), (1, 2, 3), (4, 5, 6), (1, 1, 1)])
+        assert_array_equal(p.momentums, [(1, 0, 3), (-1, -0.5, 0), (7, 8, 9), (2, 2, 2)])
+        p.append(ParticleArray([5, 6], -1.0, 2.0, self.xp.zeros((2, 3)), self.xp.zeros((2, 3))))
+        assert p.capacity == 8
+        assert_array_equal(p.ids, [1, 2, 3, 4, 5, 6])
+
+    def test_keep_remove(self):
+        p = ParticleArray(range(6), -1.0, 2.0, [(i, 0, 0) for i in range(6)], [(0, i, 0) for i in range(6)])
+        p.keep([True, False, True, True, True, True])
+        assert_array_equal(p.ids, [0, 2, 3, 4, 5])
+        assert p.capacity == 6
+        p.remove([True, False, False, True, False])
+        assert_array_equal(p.ids, [5, 2, 3])
+        assert_array_equal(p.positions, [(5, 0, 0), (2, 0, 0), (3, 0, 0)])
+        assert_array_equal(p.momentums, [(0, 5, 0), (0, 2, 0), (0, 3, 0)])
+        p.remove([False, False, False])
+        assert_array_equal(p.ids, [5, 2, 3])
+        p.remove([True, True, True])
+        assert len(p.ids) == 0
+        assert p.positions.shape == (0, 3)
+
     def test_field_at_point(self):
         p = ParticleArray([1], -16.0, 2.0, [(0., 0., 1.)], [(1., 0., 3.)])
         assert_array_equal(p.field_at_points((2., 0., 1.)), [(-4, 0, 0)])
@@ -32,6 +66,14 @@ class TestParticle:
         assert_array_equal(p.field_at_points([(0, 0, 0.5), (0, 0, 2), (0, 0, 2)]),
                            [(0, 0, 0), (0, 0, -20), (0, 0, -20)])
 
+    def test_field_at_points_tiled(self, monkeypatch):
+        rng = numpy.random.RandomState(0)
+        p = ParticleArray(range(50), 3.0, 2.0, rng.uniform(size=(50, 3)), self.xp.zeros((50, 3)))
+        points = self.xp.concatenate([p.positions[:10], self.xp.asarray(rng.uniform(size=(27, 3)))])
+        expected = p.field_at_points(points)
+        monkeypatch.setattr(ParticleArray, 'field_tile_size', 7)
+        self.xp.testing.assert_allclose(p.field_at_points(points), expected, rtol=1e-12)
+
     def test_update_momentums_no_mgn(self):
         p = ParticleArray(123, -1.0, 2.0, (0., 0., 1.), (1., 0., 3.))
         p.boris_update_momentum_no_mgn(0.1, (-1.0, 2.0, 3.0))
@@ -46,6 +88,39 @@ class TestParticle:
         p.boris_update_momentums(2, (-1.0, 2.0, 3.0), (2 * speed_of_light, 0, 0))
         assert_array_equal(p.momentums, [(3, -2, -5)])
 
+    @pytest.mark.parametrize('engine', ['numpy', pytest.param('numba', marks=pytest.mark.skipif(
+        find_spec('numba') is None, reason="numba is not installed"))])
+    def test_update_momentums_in_place(self, monkeypatch, engine):
+        monkeypatch.setattr(ParticleArray, 'boris_engine', engine)
+        rng = numpy.random.RandomState(0)
+        momentums, el_field, mgn_field = (self.xp.asarray(rng.normal(size=(100, 3))) for _ in range(3))
+        mgn_field *= speed_of_light
+        p = ParticleArray(range(50), -1.5, 2.5, self.xp.zeros((50, 3)), momentums[:50].copy())
+        for n in 50, 50, 100:  # work arrays are reused, and grown with the particles
+            if n > len(p.ids):
+                p.append(ParticleArray(range(50, 100), -1.5, 2.5, self.xp.zeros((50, 3)), momentums[50:]))
+            expected = ParticleArray._boris_update_momentums(-1.5, 2.5, p.momentums, 0.3, el_field[:n], mgn_field[:n])
+            buffer = p._momentums
+            p.boris_update_momentums(0.3, el_field[:n], mgn_field[:n])
+            assert p._momentums is buffer
+            assert_array_equal(p.momentums, expected)
+        monkeypatch.setattr(ParticleArray, 'boris_engine', 'unknown')
+        with pytest.raises(ValueError, match="Unknown Boris pusher engine"):
+            p.boris_update_momentums(0.3, el_field, mgn_field)
+
+    def test_numba_fallback(self, monkeypatch, caplog):
+        monkeypatch.setattr(ParticleArray, 'boris_engine', 'numba')
+        monkeypatch.setitem(sys.modules, 'numba', None)  # import fails as if numba was not installed
+        numba_boris_kernel.cache_clear()
+        try:
+            p = ParticleArray([1], -1.0, 2.0, [(0., 0., 1.)], [(1., 0., 3.)])
+            with caplog.at_level(logging.WARNING):
+                p.boris_update_momentums(2, (-1.0, 2.0, 3.0), (2 * speed_of_light, 0, 0))
+            assert "numba is not installed, the Boris pusher falls back to numpy" in caplog.text
+            assert_array_equal(p.momentums, [(3, -2, -5)])
+        finally:
+            numba_boris_kernel.cache_clear()
+
     def test_update_momentums_function(self):
         assert_array_equal(ParticleArray._boris_update_momentums(-1, 2, (1, 0, 3), 0.1, (-1.0, 2.0, 3.0), (0, 0, 0)),
                            (1.1, -0.2, 2.7))
@@ -6,7 +6,7 @@ from numpy.random import RandomState
 from numpy.testing import assert_array_almost_equal
 
 from ef.config.components import Cylinder, Tube
-from ef.config.components.shapes import Box, Sphere, rotation_from_z
+from ef.config.components.shapes import Box, Sphere, Cone, rotation_from_z
 
 
 @pytest.mark.usefixtures("backend")
@@ -164,3 +164,51 @@ class TestShapes:
         assert_array_almost_equal(np.cov(points.transpose()), [[.2, 0, 0],
                                                                [0, .2, 0],
                                                                [0, 0, .2]], decimals)
+
+    @pytest.mark.parametrize('shape', [Box((1, 2, 3), (4, 3.5, 2)), Sphere((3, 3, 3), 2.2),
+                                       Cylinder((1, 1, 1), (5, 4, 3), 1.3), Tube((3, 3, 0), (3, 3, 5), 1, 2.5)])
+    def test_signed_distance(self, shape):
+        positions = np.random.RandomState(0).uniform(-1, 7, (2000, 3))
+        distance = shape.signed_distance(positions)
+        assert np.all((distance <= 0) == shape.are_positions_inside(positions))
+        # the sign does not change within the distance from any point
+        offsets = np.random.RandomState(1).normal(size=(2000, 3))
+        offsets *= (np.abs(distance) * 0.999 / np.linalg.norm(offsets, axis=-1))[:, np.newaxis]
+        assert np.all(shape.are_positions_inside(positions + offsets) == shape.are_positions_inside(positions))
+
+    def test_signed_distance_values(self):
+        assert_array_almost_equal(Box((0, 0, 0), (2, 2, 2)).signed_distance([(1, 1, 1), (1, 1, 3), (5, 6, 1)]),
+                                  [-1, 1, 5])
+        assert_array_almost_equal(Sphere((0, 0, 0), 2).signed_distance([(0, 0, 0), (3, 0, 0)]), [-2, 1])
+        assert_array_almost_equal(Cylinder((0, 0, 0), (0, 0, 4), 1).signed_distance([(0, 0, 1), (3, 0, 2), (0, 0, 6)]),
+                                  [-1, 2, 2])
+        assert_array_almost_equal(Tube((0, 0, 0), (0, 0, 4), 1, 2).signed_distance([(1.5, 0, 2), (0, 0, 2), (0, 1, 5)]),
+                                  [-.5, 1, 1])
+
+    def test_cone_positions_in(self):
+        c = Cone((1, 2, 3, 5), (1, 2), (2, 4))
+        assert c.are_positions_inside((2.5, 2, 3))
+        c.xp.testing.assert_array_equal(c.are_positions_inside([
+            (2.5, 2, 3), (1, 4.5, 4), (1, -1, 5), (-1.5, 2, 4.5),
+            (1, 2, 4), (1.5, 2, 3), (4, 2, 3), (1, 2, 2.9), (1, 5, 5.1)]),
+            c.xp.asarray([1, 1, 1, 1,
+                          0, 0, 0, 0, 0]))
+
+    def test_bounding_box(self):
+        assert_array_almost_equal(np.array([b.get() if hasattr(b, 'get') else b
+                                            for b in Cylinder((0, 0, 0), (0, 0, 3), 2).bounding_box]),
+                                  [(-2, -2, 0), (2, 2, 3)])
+        lower, upper = Tube((1, 1, 1), (3, 1, 3), 1, sqrt(2)).bounding_box
+        c = Cone((1, 2, 5, 3), (1, 2), (2, 4)).bounding_box
+        assert_array_almost_equal(np.array([b.get() if hasattr(b, 'get') else b for b in c]),
+                                  [(-3, -2, 3), (5, 6, 5)])
+        assert_array_almost_equal(np.array([b.get() if hasattr(b, 'get') else b for b in (lower, upper)]),
+                                  [(0, 1 - sqrt(2), 0), (4, 1 + sqrt(2), 4)])
+
+    @pytest.mark.parametrize('shape', [Sphere((3, 3, 3), 1.2), Cylinder((1, 1, 1), (2, 4, 3), 0.7),
+                                       Tube((3, 3, 0), (3, 3, 2), 1, 1.5), Cone((3, 2, 1, 3), (0.5, 1), (1, 2))])
+    def test_bounding_box_prefilter(self, shape):
+        positions = shape.xp.asarray(np.random.RandomState(0).uniform(-1, 7, (10000, 3)))
+        inside = shape.are_positions_inside(positions)
+        assert 0 < int(inside.sum()) < 1000
+        shape.xp.testing.assert_array_equal(inside, shape.are_positions_inside_exact(positions))
@@ -10,11 +10,16 @@ from ef.config.config import Config
 from ef.field import FieldZero
 from ef.field.expression import FieldExpression
 from ef.field.on_grid import FieldOnGrid
+from ef.field.particles import FieldParticles, FieldParticlesBarnesHut
 from ef.field.uniform import FieldUniform
 from ef.inner_region import InnerRegion
 from ef.meshgrid import MeshGrid
+from ef.particle_array import ParticleArray
 from ef.particle_interaction_model import Model
-from ef.runner import Runner
+from ef.field.solvers.adaptive import FieldSolverAdaptive
+from ef.field.solvers.superposition import FieldSolverSuperposition
+from ef.runner import Runner, BatchRunner
+from ef.simulation import Simulation
 from ef.time_grid import TimeGrid
 from ef.util.array_on_grid import ArrayOnGrid
 from ef.util.testing import assert_dataclass_eq, _assert_value_eq
@@ -95,6 +100,13 @@ class TestSimulation:
                      ).make()
         Runner(sim).start()
 
+    @pytest.mark.parametrize('binary_field, field_class', [('direct', FieldParticles),
+                                                           ('tree', FieldParticlesBarnesHut)])
+    def test_binary_field_class(self, binary_field, field_class, backend_with_settings):
+        backend_with_settings(binary_field=binary_field)
+        sim = Simulation(TimeGrid(1, .1, .1), MeshGrid(10, 11), particle_interaction_model=Model.binary)
+        assert type(sim._dynamic_field) is field_class
+
     def test_id_generation(self, backend_and_solver):
         conf = Config(TimeGridConf(0.001, save_step=.0005, step=0.0001), SpatialMeshConf((10, 10, 10), (1, 1, 1)),
                       sources=[ParticleSourceConf('gas', Box((4, 4, 4), size=(1, 1, 1)), 50, 0, np.zeros(3), 0.00),
@@ -121,3 +133,171 @@ class TestSimulation:
         sim = conf.make()
         Runner(sim).start()
         assert [len(a.ids) for a in sim.particle_arrays] == [4]
+
+    def test_remove_absorbed_particles(self, backend):
+        regions = [InnerRegion('big', Box((1, 1, 1), (3, 3, 3)), 1), InnerRegion('small', Box((2, 2, 2), (1, 1, 1)))]
+        particles = ParticleArray(range(5), -2., 1., [(2.5, 2.5, 2.5), (1.5, 1.5, 1.5), (6, 1, 1), (4.5, 4, 4),
+                                                      (0.5, 0.5, 0.5)], np.zeros((5, 3)))
+        sim = Simulation(TimeGrid(1, 1, 1), MeshGrid(5, 6), inner_regions=regions, particle_arrays=[particles])
+        sim.remove_absorbed_particles()
+        particles.xp.testing.assert_array_equal(sim.particle_arrays[0].ids, [3, 4])
+        assert regions[0].total_absorbed_particles == 2
+        assert regions[0].total_absorbed_charge == -4.
+        assert regions[1].total_absorbed_particles == 0
+        assert sim._domain.total_absorbed_particles == 1
+
+    def test_sample_static_fields(self, backend):
+        electric = [FieldUniform('u', 'electric', (1, 0, 0)),
+                    FieldExpression('e', 'electric', 'x', 'y*z', '0'),
+                    FieldExpression('t', 'electric', 't', '0', '0')]
+        magnetic = [FieldUniform('m', 'magnetic', (0, 0, 3))]
+        positions = np.array([(1., 2., 3.), (2.5, 0.5, 4.), (3.3, 1.2, 0.7)])
+        exact = Simulation(TimeGrid(1, 1, 1), MeshGrid(5, 11), electric_fields=electric, magnetic_fields=magnetic)
+        assert exact.presample_static_fields(exact.electric_fields) is exact.electric_fields
+        grid = Simulation(TimeGrid(1, 1, 1), MeshGrid(5, 11), electric_fields=electric, magnetic_fields=magnetic,
+                          sample_static_fields='grid')
+        assert grid.presample_static_fields(grid.electric_fields) is grid.electric_fields
+        sampled = Simulation(TimeGrid(1, 1, 1), MeshGrid(5, 11), electric_fields=electric, magnetic_fields=magnetic,
+                             sample_static_fields='all')
+        assert [f.name for f in sampled.presample_static_fields(sampled.electric_fields).fields] == \
+               ['sampled_static_electric', 't']
+        assert sampled.presample_static_fields(sampled.magnetic_fields) is sampled.magnetic_fields
+        e, m = exact.compute_total_fields_at_positions(positions)
+        e_sampled, m_sampled = sampled.compute_total_fields_at_positions(positions)
+        # trilinear interpolation is exact for these fields
+        sampled.array_class.xp.testing.assert_allclose(e_sampled, e)
+        _assert_value_eq(m_sampled, m)
+        assert sampled.sample_static_fields == 'all'
+
+    def test_compose_fields(self, backend):
+        sim = Simulation(TimeGrid(1, 1, 1), MeshGrid(5, 11), electric_fields=[FieldUniform('u', 'electric', (1, 0, 0))])
+        evaluator = sim.compose_fields()
+        assert sim.compose_fields() is evaluator
+        sim.electric_fields = FieldUniform('v', 'electric', (0, 2, 0))
+        assert sim.compose_fields() is not evaluator
+        e, m = sim.compute_total_fields_at_positions(np.array([(1., 2., 3.)]))
+        sim.array_class.xp.testing.assert_array_equal(e, [(0, 2, 0)])
+        sim.array_class.xp.testing.assert_array_equal(m, [(0, 0, 0)])
+
+    def test_batch_runner(self, backend_and_solver):
+        def config(potential):
+            return Config(TimeGridConf(1.0, save_step=.5, step=.1), SpatialMeshConf((10, 10, 10), (1, 1, 1)),
+                          [ParticleSourceConf('gas', Box((2, 2, 2), (6, 6, 6)), 20, 0, np.zeros(3), 0.)],
+                          [InnerRegionConf('hole', Box(origin=(4, 4, 4), size=(2, 2, 2)), potential)],
+                          boundary_conditions=BoundaryConditionsConf(-potential))
+        configs = [config(1.), config(2.)]
+        expected = [c.make() for c in configs]
+        for sim in expected:
+            Runner(sim).start()
+        batch = BatchRunner([c.make() for c in configs])
+        batch.start()
+        for sim, exp in zip(batch.simulations, expected):
+            assert sim.time_grid.current_node == exp.time_grid.current_node
+            sim.potential.xp.testing.assert_allclose(sim.potential._data, exp.potential._data, atol=1e-8)
+            assert [len(p.ids) for p in sim.particle_arrays] == [len(p.ids) for p in exp.particle_arrays]
+        with pytest.raises(ValueError, match="same mesh"):
+            BatchRunner([configs[0].make(), Config(spatial_mesh=SpatialMeshConf((5, 5, 5), (1, 1, 1))).make()])
+        with pytest.raises(ValueError, match="same inner region shapes"):
+            BatchRunner([configs[0].make(), Config(TimeGridConf(1.0, save_step=.5, step=.1),
+                                                   SpatialMeshConf((10, 10, 10), (1, 1, 1))).make()])
+
+    def test_electrode_superposition(self, backend_and_solver, monkeypatch, tmpdir):
+        monkeypatch.setattr(FieldSolverSuperposition, 'cache_directory', str(tmpdir))
+        conf = Config(TimeGridConf(1.0, save_step=.5, step=.1), SpatialMeshConf((10, 10, 10), (1, 1, 1)),
+                      [ParticleSourceConf('gas', Box((2, 2, 2), (6, 6, 6)), 20, 0, np.zeros(3), 0.)],
+                      [InnerRegionConf('hole', Box(origin=(4, 4, 4), size=(2, 2, 2)), 1.)],
+                      boundary_conditions=BoundaryConditionsConf(-1, 0, 2, 0, 0, 3))
+        expected = conf.make()
+        Runner(expected).start()
+        sim = conf.make()
+        runner = Runner(sim, electrode_superposition=True)
+        assert type(runner.solver) is FieldSolverSuperposition
+        vacuum, expected_vacuum = conf.make(), conf.make()
+        Runner(expected_vacuum).eval_and_write_fields_without_particles()
+        vacuum_runner = Runner(vacuum, electrode_superposition=True)
+        monkeypatch.setattr(vacuum_runner.superposition, 'eval_potential', None)  # vacuum_potential is used directly
+        vacuum_runner.eval_and_write_fields_without_particles()
+        sim.potential.xp.testing.assert_allclose(vacuum.potential._data, expected_vacuum.potential._data, atol=1e-8)
+        runner.start()
+        sim.potential.xp.testing.assert_allclose(sim.potential._data, expected.potential._data, atol=1e-8)
+
+    def test_field_solve_interval(self, backend_and_solver, mocker):
+        conf = Config(TimeGridConf(1.0, save_step=.5, step=.1), SpatialMeshConf((10, 10, 10), (1, 1, 1)),
+                      [ParticleSourceConf('gas', Box((2, 2, 2), (6, 6, 6)), 20, 5, np.zeros(3), 0.)],
+                      subcycling=SubcyclingConf(3))
+        conf = Config.from_string(conf.export_to_string())
+        assert_dataclass_eq(conf.subcycling, SubcyclingConf(3))
+        runner = Runner(conf.make())
+        assert runner.simulation.field_solve_interval == 3
+        mocker.spy(runner.solver, 'eval_potential')
+        mocker.spy(runner.simulation.potential, 'gradient')
+        runner.start()
+        # fields without particles, initial particles, steps 3, 6 and 9
+        assert runner.solver.eval_potential.call_count == 5
+        assert runner.simulation.potential.gradient.call_count == 5
+
+    def test_species_subcycling(self, backend_and_solver):
+        def config(species_subcycling):
+            return Config(TimeGridConf(1.0, save_step=.5, step=.1), SpatialMeshConf((10, 10, 10), (1, 1, 1)),
+                          [ParticleSourceConf('electrons', Box((2, 2, 2), (6, 6, 6)), 20, 0, (1, 2, 3), 0.,
+                                              -1., 1.),
+                           ParticleSourceConf('ions', Box((2, 2, 2), (6, 6, 6)), 20, 1, (3, 2, 1), 0., 1., 10.)],
+                          particle_interaction_model=ParticleInteractionModelConf('noninteracting'),
+                          external_fields=[ExternalElectricFieldUniformConf('e', (0.1, 0.2, 0.3))],
+                          species_subcycling=species_subcycling)
+
+        conf = Config.from_string(config([SpeciesSubcyclingConf('ions', 2)]).export_to_string())
+        assert len(conf.species_subcycling) == 1
+        assert_dataclass_eq(conf.species_subcycling[0], SpeciesSubcyclingConf('ions', 2))
+        sim = conf.make()
+        assert sim.push_intervals == {'ions': 2}
+        expected = config([]).make()
+        for s in sim, expected:
+            for source in s.particle_sources:
+                source._generator = np.random.RandomState(0)
+        # leapfrog is exact for a uniform field, so a longer step gives the same positions
+        runner, expected_runner = Runner(sim), Runner(expected)
+        runner.start()
+        expected_runner.start()
+        assert [sim.push_interval(p) for p in sim.particle_arrays] == [1, 2]
+        assert [p.push_interval for p in sim.particle_arrays] == [1, 2]
+        for p, e in zip(sim.particle_arrays, expected.particle_arrays):
+            p.xp.testing.assert_array_equal(p.ids[p.ids.argsort()], e.ids[e.ids.argsort()])
+            p.xp.testing.assert_allclose(p.positions[p.ids.argsort()], e.positions[e.ids.argsort()])
+        # an ion generated within the interval is pushed on every step until the end of the interval
+        sim.advance_one_time_step(runner.solver)
+        expected.advance_one_time_step(expected_runner.solver)
+        assert sorted(p.push_interval for p in sim.particle_arrays) == [1, 1, 2]
+        new = next(p for p in sim.particle_arrays if p.push_interval == 1 and p.mass == 10.)
+        ions = next(p for p in expected.particle_arrays if p.mass == 10.)
+        assert len(new.ids) == 1
+        new.xp.testing.assert_allclose(new.positions, ions.positions[ions.ids == new.ids[0]])
+        for s in sim, expected:
+            s.advance_one_time_step(runner.solver)
+        assert [p.push_interval for p in sim.particle_arrays] == [1, 2]
+        for p, e in zip(sim.particle_arrays, expected.particle_arrays):
+            p.xp.testing.assert_allclose(p.positions[p.ids.argsort()], e.positions[e.ids.argsort()])
+        with pytest.raises(ValueError, match="unknown particle sources"):
+            config([SpeciesSubcyclingConf('neutrals', 2)]).make()
+
+    def test_adaptive_field_solve(self, backend_and_solver, mocker):
+        def config(particles_per_step):
+            return Config(TimeGridConf(1.0, save_step=.5, step=.1), SpatialMeshConf((10, 10, 10), (1, 1, 1)),
+                          [ParticleSourceConf('gas', Box((2, 2, 2), (6, 6, 6)), 20, particles_per_step,
+                                              np.zeros(3), 0., -1.799e-6, 1.)],
+                          boundary_conditions=BoundaryConditionsConf(-1))
+
+        runner = Runner(config(20).make(), field_solve_threshold=1e-3, max_skipped_solves=3)
+        assert type(runner.solver) is FieldSolverAdaptive
+        runner.start()
+        # particles are generated on every step, the charge density changes each time
+        assert runner.solver.solved == [True] * 12
+
+        sim = config(0).make()  # heavy particles at rest, the charge density barely changes
+        runner = Runner(sim, field_solve_threshold=1e-3, max_skipped_solves=3)
+        mocker.spy(runner.solver.solver, 'eval_potential')
+        runner.start()
+        # fields without particles, initial particles, then every fourth step
+        assert runner.solver.solved == [True, True] + [False, False, False, True] * 2 + [False, False]
+        assert runner.solver.solver.eval_potential.call_count == 4
+        assert type(Runner(sim).solver) is not FieldSolverAdaptive